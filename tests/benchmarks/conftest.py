@@ -0,0 +1,24 @@
+"""Benchmark fixture configuration
+
+Measurements of the stage benchmarks are compared against the baselines in
+BENCHMARK_BASELINES, failing when they regress by more than
+BENCHMARK_THRESHOLD. Run with BENCHMARK_SAVE_BASELINES=true to store the
+measurements as the new baselines.
+"""
+import os
+
+import pytest
+
+from . import utils
+
+BASELINES_PATH = os.getenv('BENCHMARK_BASELINES', 'tests/benchmarks/baselines.json')
+THRESHOLD = float(os.getenv('BENCHMARK_THRESHOLD', '0.5'))
+SAVE_BASELINES = os.getenv('BENCHMARK_SAVE_BASELINES', 'false').lower() == 'true'
+
+@pytest.fixture(scope='session')
+def baselines():
+    """Baselines of this run, saved at the end when asked to"""
+    stored = utils.Baselines(BASELINES_PATH, THRESHOLD)
+    yield stored
+    if SAVE_BASELINES:
+        stored.save()
@@ -0,0 +1,48 @@
+"""Recorded DataCite API records of different sizes for benchmarks"""
+
+import base64
+import copy
+import json
+
+from lxml import etree
+
+FIXTURES = 'tests/benchmarks/fixtures/'
+# Lists of the attributes, and elements of the resource XML, repeated to make a huge record
+REPEATED = ['creators', 'contributors', 'relatedIdentifiers', 'subjects']
+# How many times the large record's lists are repeated in the huge record
+HUGE_FACTOR = 40
+
+SIZES = ['small', 'typical', 'huge']
+
+
+def load_entry(size):
+    """A json-api DOI entry of the given size
+
+    The small, typical and large records were recorded from the DataCite API.
+    Records with thousands of creators are too big to keep in the repository,
+    so the huge record is the large one with its lists repeated.
+    """
+    if size == 'huge':
+        return scale_entry(load_entry('large'), HUGE_FACTOR)
+
+    with open(FIXTURES + 'datacite_api_doi_%s.json' % size) as json_file:
+        return json.load(json_file)['data']
+
+
+def scale_entry(entry, factor):
+    """A copy of an entry with its lists, in attributes and XML, repeated factor times"""
+    entry = copy.deepcopy(entry)
+    attributes = entry['attributes']
+
+    for name in REPEATED:
+        if attributes.get(name):
+            attributes[name] = attributes[name] * factor
+
+    resource = etree.fromstring(base64.b64decode(attributes['xml']))
+    for name in REPEATED:
+        for e_list in resource.iterfind('{*}' + name):
+            for e_item in list(e_list) * (factor - 1):
+                e_list.append(copy.deepcopy(e_item))
+
+    attributes['xml'] = base64.b64encode(etree.tostring(resource)).decode('ascii')
+    return entry
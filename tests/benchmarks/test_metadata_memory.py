@@ -0,0 +1,69 @@
+"""Benchmark of the memory held by parsed Metadata results"""
+
+import json
+from datetime import datetime
+
+import pytest
+
+from viringo.services import datacite
+from . import utils
+
+LIST_FIELDS = [
+    'titles', 'creators', 'subjects', 'descriptions', 'dates', 'contributors',
+    'resource_types', 'funding_references', 'geo_locations', 'formats',
+    'identifiers', 'relations', 'rights', 'sizes'
+]
+
+
+class DictMetadata:
+    """Metadata as it was before slots, a dict per instance and new empty lists"""
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            if name in LIST_FIELDS:
+                value = value or []
+            setattr(self, name, value)
+        self.created_datetime = self.created_datetime or datetime.min
+        self.updated_datetime = self.updated_datetime or datetime.min
+
+
+def load_fields(count):
+    """Parsed fields of count records from recorded DataCite API responses"""
+    entries = []
+    for fixture in ['datacite_api_dois.json', 'datacite_api_dois_2016.json']:
+        with open('tests/integration/fixtures/' + fixture) as json_file:
+            entries += json.load(json_file)['data']
+
+    records = []
+    for i in range(count):
+        result = datacite.build_metadata(entries[i % len(entries)])
+        records.append({
+            field: getattr(result, field) for field in datacite.FIELD_PARSERS
+        })
+
+    return records
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('page_size', [50, 1000])
+def test_metadata_bytes_per_record(page_size):
+    """Compare the bytes held by a page of dict and slotted results
+
+    The field values are shared, so only the results themselves and their
+    empty list defaults are counted.
+    """
+    records = load_fields(page_size)
+
+    previous = utils.retained(
+        'dict per instance',
+        lambda: [DictMetadata(**fields) for fields in records],
+        page_size
+    )
+    current = utils.retained(
+        'slots and shared empty tuples',
+        lambda: [datacite.Metadata(**fields) for fields in records],
+        page_size
+    )
+
+    utils.report('Page of %d records' % page_size, previous, current)
+
+    assert current.retained_bytes < previous.retained_bytes
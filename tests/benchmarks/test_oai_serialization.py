@@ -0,0 +1,153 @@
+"""Benchmark of serializing large ListRecords pages"""
+
+from xml.dom import minidom
+
+import oaipmh.metadata
+import pytest
+
+from viringo import catalogs, config, metadata, oai
+from tests.integration import factories
+from . import utils
+
+PAGE_SIZES = [50, 200]
+STYLESHEET = '/static/oaitohtml.xsl'
+
+
+@pytest.fixture(autouse=True)
+def render_every_record(monkeypatch):
+    """Measure rendering, not the fragment cache, unless a benchmark turns it on"""
+    monkeypatch.setattr(config, 'FRAGMENT_CACHE_ENABLED', False)
+
+
+def build_server(page_size, stylesheet=None, streaming=False):
+    """Construct an OAI server whose catalog serves one fixed page of records"""
+    results = [
+        factories.MetadataFactory(identifier='10.5072/not-a-real-doi-%d' % i)
+        for i in range(page_size)
+    ]
+
+    class PageCatalog(catalogs.DataCiteOAIServer):
+        def listRecords(self, **kw):
+            return self.build_list_records(results, page_size, None)
+
+    metadata_registry = oaipmh.metadata.MetadataRegistry()
+    metadata_registry.registerWriter('oai_dc', metadata.oai_dc_writer)
+    metadata_registry.registerWriter('oai_datacite', metadata.oai_datacite_writer)
+    metadata_registry.registerWriter('datacite', metadata.datacite_writer)
+
+    return oai.Server(
+        PageCatalog(), metadata_registry, stylesheet=stylesheet, streaming=streaming)
+
+
+def minidom_stylesheet(xml):
+    """The previous approach of adding the stylesheet by re-parsing the response"""
+    dom = minidom.parseString(xml)
+    process_instruction = dom.createProcessingInstruction(
+        'xml-stylesheet',
+        'type="text/xsl" href="%s"' % STYLESHEET
+    )
+    dom.insertBefore(process_instruction, dom.firstChild)
+    return dom.toxml()
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('page_size', PAGE_SIZES)
+def test_stylesheet_without_reparse(page_size):
+    """Compare the minidom round trip against writing the stylesheet at serialization"""
+    request = {'verb': 'ListRecords', 'metadataPrefix': 'oai_datacite'}
+
+    reparse_server = build_server(page_size)
+    direct_server = build_server(page_size, stylesheet=STYLESHEET)
+
+    reparse = utils.measure(
+        'minidom re-parse',
+        lambda: minidom_stylesheet(reparse_server.handleRequest(dict(request))),
+        iterations=5
+    )
+    direct = utils.measure(
+        'stylesheet at serialization',
+        lambda: direct_server.handleRequest(dict(request)),
+        iterations=5
+    )
+
+    utils.report('ListRecords oai_datacite, %d records' % page_size, reparse, direct)
+
+    assert direct.seconds_per_op < reparse.seconds_per_op
+    assert direct.peak_bytes < reparse.peak_bytes
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('page_size', PAGE_SIZES)
+def test_streamed_list_records(page_size):
+    """Compare building the whole response tree against streaming it record by record"""
+    request = {'verb': 'ListRecords', 'metadataPrefix': 'oai_datacite'}
+
+    tree_server = build_server(page_size, stylesheet=STYLESHEET)
+    streaming_server = build_server(page_size, stylesheet=STYLESHEET, streaming=True)
+
+    def consume_stream():
+        for _ in streaming_server.handleRequest(dict(request)):
+            pass
+
+    tree = utils.measure(
+        'whole response tree',
+        lambda: tree_server.handleRequest(dict(request)),
+        iterations=5
+    )
+    streamed = utils.measure('streamed chunks', consume_stream, iterations=5)
+
+    utils.report('ListRecords oai_datacite, %d records' % page_size, tree, streamed)
+
+    assert streamed.peak_bytes < tree.peak_bytes
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('prefix', ['oai_datacite', 'datacite'])
+def test_raw_xml_splice(prefix, monkeypatch):
+    """Compare parsing each resource into the tree against splicing the raw xml"""
+    request = {'verb': 'ListRecords', 'metadataPrefix': prefix}
+    server = build_server(PAGE_SIZES[-1])
+
+    monkeypatch.setattr(config, 'RAW_XML_SPLICE', False)
+    parsed = utils.measure(
+        'parse and serialize each resource',
+        lambda: server.handleRequest(dict(request)),
+        iterations=5
+    )
+
+    monkeypatch.setattr(config, 'RAW_XML_SPLICE', True)
+    spliced = utils.measure(
+        'splice raw resource xml',
+        lambda: server.handleRequest(dict(request)),
+        iterations=5
+    )
+
+    utils.report('ListRecords %s, %d records' % (prefix, PAGE_SIZES[-1]), parsed, spliced)
+
+    assert spliced.seconds_per_op < parsed.seconds_per_op
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('prefix', ['oai_dc', 'oai_datacite'])
+def test_fragment_cache(prefix, monkeypatch):
+    """Compare rendering every record against serving records already rendered"""
+    request = {'verb': 'ListRecords', 'metadataPrefix': prefix}
+    server = build_server(PAGE_SIZES[-1])
+
+    rendered = utils.measure(
+        'render every record',
+        lambda: server.handleRequest(dict(request)),
+        iterations=5
+    )
+
+    monkeypatch.setattr(config, 'FRAGMENT_CACHE_ENABLED', True)
+    cached = utils.measure(
+        'rendered record fragments',
+        lambda: server.handleRequest(dict(request)),
+        iterations=5
+    )
+
+    utils.report('ListRecords %s, %d records' % (prefix, PAGE_SIZES[-1]), rendered, cached)
+
+    assert cached.seconds_per_op < rendered.seconds_per_op
+
@@ -0,0 +1,50 @@
+"""Benchmark of sharing one OAI server between requests"""
+
+import pytest
+
+from viringo import create_app, oai
+from tests.integration import factories
+from . import utils
+
+STATIC_URL_PATH = '/static'
+
+REQUESTS = {
+    'Identify': {'verb': 'Identify'},
+    'GetRecord': {
+        'verb': 'GetRecord',
+        'metadataPrefix': 'datacite',
+        'identifier': 'doi:10.5072/not-a-real-doi'
+    },
+}
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('verb', sorted(REQUESTS))
+def test_shared_server(verb, mocker):
+    """Compare building the server stack for every request against sharing one"""
+    mocked_get_metadata = mocker.patch('viringo.services.datacite.get_metadata')
+    mocked_get_metadata.return_value = factories.MetadataFactory()
+    request = REQUESTS[verb]
+    server = oai.build_oai_server(STATIC_URL_PATH)
+
+    with create_app({'TESTING': True}).test_request_context('/oai'):
+        build = utils.measure(
+            'build server stack',
+            lambda: oai.build_oai_server(STATIC_URL_PATH),
+            iterations=200
+        )
+        rebuilt = utils.measure(
+            'server built for the request',
+            lambda: oai.build_oai_server(STATIC_URL_PATH).handle(dict(request)),
+            iterations=200
+        )
+        shared = utils.measure(
+            'shared server',
+            lambda: server.handle(dict(request)),
+            iterations=200
+        )
+
+    utils.report('%s, setup %.1f%% of a request' % (
+        verb, 100 * build.seconds_per_op / rebuilt.seconds_per_op), build, rebuilt, shared)
+
+    assert shared.peak_bytes < rebuilt.peak_bytes
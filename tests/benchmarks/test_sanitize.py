@@ -0,0 +1,58 @@
+"""Micro-benchmark of removing invalid XML characters from DataCite text"""
+
+import json
+import re
+
+import pytest
+
+from viringo import sanitize
+from . import utils
+
+# The pattern previously passed to re.sub for every value
+PREVIOUS_PATTERN = u'[^ -퟿\u0009\u000A\u000D-�\U00010000-\U0010FFFF]+'
+
+
+def load_values():
+    """Titles and descriptions from recorded DataCite API responses"""
+    values = []
+    for fixture in ['datacite_api_dois.json', 'datacite_api_dois_2016.json']:
+        with open('tests/integration/fixtures/' + fixture) as json_file:
+            data = json.load(json_file)['data']
+
+        for entry in data:
+            attributes = entry['attributes']
+            values += [title.get('title') for title in attributes.get('titles', [])]
+            values += [
+                description.get('description')
+                for description in attributes.get('descriptions', [])
+            ]
+
+    return [value for value in values if value]
+
+
+@pytest.mark.benchmark
+def test_clean_text():
+    """Compare re.sub on every value against the clean fast path"""
+    values = load_values()
+
+    previous = utils.measure(
+        're.sub every value',
+        lambda: [re.sub(PREVIOUS_PATTERN, '', value) for value in values],
+        iterations=200
+    )
+    current = utils.measure(
+        'sanitize.clean_text',
+        lambda: [sanitize.clean_text(value) for value in values],
+        iterations=200
+    )
+
+    utils.report(
+        '%d titles and descriptions, %d characters' % (
+            len(values), sum(len(value) for value in values)),
+        previous,
+        current
+    )
+
+    assert [re.sub(PREVIOUS_PATTERN, '', value) for value in values] == \
+        [sanitize.clean_text(value) for value in values]
+    assert current.seconds_per_op < previous.seconds_per_op
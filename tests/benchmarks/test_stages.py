@@ -0,0 +1,70 @@
+"""Benchmarks of each stage of turning a DataCite record into OAI-PMH output"""
+
+import oaipmh.common
+import pytest
+from lxml.etree import Element
+
+from viringo import catalogs, metadata, splice
+from viringo.services import datacite
+from . import records, utils
+
+WRITERS = {
+    'oai_dc': metadata.oai_dc_writer,
+    'oai_datacite': metadata.oai_datacite_writer,
+    'datacite': metadata.datacite_writer,
+}
+# Fewer iterations for bigger records keep each benchmark around a second
+ITERATIONS = {'small': 200, 'typical': 100, 'huge': 10}
+# Times a regressed stage is measured again, before it is put down to a busy machine
+ATTEMPTS = 3
+
+
+def parse_all(entry):
+    """A result with every field parsed, as the oai_dc format needs"""
+    result = datacite.build_metadata(entry)
+    for field in datacite.FIELD_PARSERS:
+        getattr(result, field)
+    return result
+
+
+def write(writer, metadata_map):
+    """Write a record as the server does, collecting raw XML for splicing"""
+    with splice.collecting():
+        writer(Element('metadata'), oaipmh.common.Metadata(None, metadata_map))
+
+
+def stages(entry):
+    """The callable measured for each stage, given a record"""
+    catalog = catalogs.DataCiteOAIServer()
+    result = parse_all(entry)
+    metadata_map = dict(catalog.build_metadata_map(result))
+
+    functions = {
+        'build_metadata': lambda: parse_all(entry),
+        'build_metadata_map': lambda: dict(catalog.build_metadata_map(result)),
+        'build_header': lambda: catalog.build_header(result),
+    }
+    for prefix, writer in WRITERS.items():
+        functions['writer_' + prefix] = lambda writer=writer: write(writer, metadata_map)
+    return functions
+
+
+STAGES = list(stages(records.load_entry('small')))
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('size', records.SIZES)
+@pytest.mark.parametrize('stage', STAGES)
+def test_stage(stage, size, baselines):
+    """Measure a stage with a record of a size and compare it to its baseline"""
+    func = stages(records.load_entry(size))[stage]
+
+    for _ in range(ATTEMPTS):
+        measurement = utils.measure(
+            '%s %s' % (stage, size), func, iterations=ITERATIONS[size], repeat=5)
+        regressions = baselines.check('%s/%s' % (stage, size), measurement)
+        if not regressions:
+            break
+
+    utils.report('Stage %s, %s record' % (stage, size), measurement)
+    assert not regressions, '; '.join(regressions)
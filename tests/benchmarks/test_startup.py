@@ -0,0 +1,98 @@
+"""Benchmark of starting a worker, from its first import to its first response"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from . import utils
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Run in a fresh interpreter, so every import is paid for as a new worker would
+STARTUP = """
+import json, sys, time
+
+def max_rss():
+    # ru_maxrss is kept across exec, so it could be the benchmark's own
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+started = time.perf_counter()
+from viringo import create_app
+imported = time.perf_counter()
+app = create_app({'TESTING': True})
+created = time.perf_counter()
+response = app.test_client().get('/oai?verb=Identify')
+assert response.status_code == 200
+responded = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_response': responded - started,
+    'max_rss': max_rss(),
+    'modules': sorted(sys.modules),
+}))
+"""
+# Times a worker is started, the fastest is kept
+RUNS = 5
+# Times a regressed start up is measured again, before it is put down to a busy machine
+ATTEMPTS = 3
+# Modules only imported once something needs them, never by an Identify request
+DEFERRED_MODULES = ['sentry_sdk', 'dateutil', 'sqlite3', 'cProfile']
+
+
+def start_worker():
+    """Start the application in a new interpreter, returning its timings"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop('SENTRY_DSN', None)
+    output = subprocess.run(
+        [sys.executable, '-c', STARTUP], env=env, cwd=ROOT,
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)
+
+
+def measure_startup():
+    """The fastest of a number of starts, as a measurement of its first response"""
+    # The first start may compile bytecode, which workers don't do
+    start_worker()
+    starts = [start_worker() for _ in range(RUNS)]
+    fastest = min(starts, key=lambda start: start['first_response'])
+    measurement = utils.Measurement(
+        'time to first response', fastest['first_response'], fastest['max_rss'])
+    return measurement, fastest
+
+
+@pytest.mark.benchmark
+def test_time_to_first_response(baselines):
+    """Measure starting a worker and compare it to its baseline"""
+    for _ in range(ATTEMPTS):
+        measurement, startup = measure_startup()
+        regressions = baselines.check('startup/first_response', measurement)
+        if not regressions:
+            break
+
+    utils.report(
+        'Worker start up, import %.1f ms, create_app %.1f ms' % (
+            startup['import'] * 1000, startup['create_app'] * 1000),
+        measurement
+    )
+    assert not regressions, '; '.join(regressions)
+
+
+@pytest.mark.benchmark
+def test_deferred_imports():
+    """Test modules not needed to start are left for the requests that use them"""
+    modules = start_worker()['modules']
+
+    for module in DEFERRED_MODULES:
+        assert module not in modules, '%s is imported on start up' % module
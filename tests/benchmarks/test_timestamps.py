@@ -0,0 +1,52 @@
+"""Micro-benchmark of parsing the created and updated timestamps of a page"""
+
+import json
+
+import dateutil.parser
+import dateutil.tz
+import pytest
+
+from viringo import timestamps
+from . import utils
+
+
+def previous_parse_datetime(value):
+    """The previous approach of parsing every timestamp with dateutil"""
+    parsed = dateutil.parser.parse(value)
+    return parsed.astimezone(dateutil.tz.UTC).replace(tzinfo=None)
+
+
+def load_timestamps():
+    """Created and updated timestamps of two recorded pages of DataCite DOIs"""
+    values = []
+    for fixture in ['datacite_api_dois.json', 'datacite_api_dois_2016.json']:
+        with open('tests/integration/fixtures/' + fixture) as json_file:
+            data = json.load(json_file)['data']
+
+        for entry in data:
+            values += [entry['attributes']['created'], entry['attributes']['updated']]
+
+    return values
+
+
+@pytest.mark.benchmark
+def test_parse_datetime():
+    """Compare dateutil against the fast path for a page of timestamps"""
+    values = load_timestamps()
+
+    previous = utils.measure(
+        'dateutil.parser.parse',
+        lambda: [previous_parse_datetime(value) for value in values],
+        iterations=200
+    )
+    current = utils.measure(
+        'timestamps.parse_datetime',
+        lambda: [timestamps.parse_datetime(value) for value in values],
+        iterations=200
+    )
+
+    utils.report('%d timestamps from 50 records' % len(values), previous, current)
+
+    assert [previous_parse_datetime(value) for value in values] == \
+        [timestamps.parse_datetime(value) for value in values]
+    assert current.seconds_per_op < previous.seconds_per_op
@@ -0,0 +1,164 @@
+"""Helpers for timing and memory measurements in benchmarks"""
+
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+
+class Measurement:
+    """Timing and peak traced memory of a benchmarked callable"""
+    def __init__(self, name, seconds_per_op, peak_bytes):
+        self.name = name
+        self.seconds_per_op = seconds_per_op
+        self.peak_bytes = peak_bytes
+
+    @property
+    def ops_per_second(self):
+        return 1 / self.seconds_per_op if self.seconds_per_op else float('inf')
+
+    def __str__(self):
+        return "%-40s %10.3f ms/op %10.0f ops/s %12d peak bytes" % (
+            self.name, self.seconds_per_op * 1000, self.ops_per_second, self.peak_bytes)
+
+
+class Retained:
+    """Traced bytes held by a number of items built by a benchmarked callable"""
+    def __init__(self, name, retained_bytes, items):
+        self.name = name
+        self.retained_bytes = retained_bytes
+        self.items = items
+
+    @property
+    def bytes_per_item(self):
+        return self.retained_bytes // self.items
+
+    def __str__(self):
+        return "%-40s %10d bytes %10d bytes/item" % (
+            self.name, self.retained_bytes, self.bytes_per_item)
+
+
+def measure(name, func, iterations=20, repeat=3):
+    """Time func over a number of iterations and trace its peak memory for one call
+
+    The iterations are timed repeat times and the fastest round is kept, as
+    slower rounds only tell us about other work on the machine.
+    """
+
+    # Warm up any lazily initialised state first
+    func()
+
+    rounds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        rounds.append((time.perf_counter() - start) / iterations)
+    seconds_per_op = min(rounds)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Measurement(name, seconds_per_op, peak_bytes)
+
+
+def retained_bytes(func):
+    """Traced bytes still allocated while the value func returns is held"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        value = func()
+        current_bytes, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    del value
+    return current_bytes
+
+
+def retained(name, func, items):
+    """Measure the bytes held by the items func returns"""
+    return Retained(name, retained_bytes(func), items)
+
+
+def report(title, *measurements):
+    """Print measurements in a comparable table, shown with pytest -s"""
+    print()
+    print(title)
+    for measurement in measurements:
+        print("  %s" % measurement)
+
+
+def calibrate():
+    """Seconds per op of a fixed pure Python workload
+
+    Timings are stored relative to it, so baselines recorded on one machine
+    can be compared on another.
+    """
+    return measure(
+        'calibration', lambda: sorted(str(i) for i in range(5000)), iterations=20, repeat=5
+    ).seconds_per_op
+
+
+class Baselines:
+    """Measurements stored as JSON for later runs to be compared against
+
+    A measurement regresses when its time relative to the calibration, or
+    its peak memory, grows by more than the threshold. The calibration is
+    measured again with every measurement so both see the machine equally
+    busy. Allocations differ
+    between Python versions, so baselines only apply to the version they
+    were recorded with.
+    """
+    def __init__(self, path, threshold):
+        self.path = path
+        self.threshold = threshold
+        self.python = platform.python_version_tuple()[0] + '.' + platform.python_version_tuple()[1]
+        self.results = {}
+        self.recorded = {}
+
+        if os.path.exists(path):
+            with open(path) as baselines_file:
+                stored = json.load(baselines_file)
+            if stored.get('python') == self.python:
+                self.results = stored['results']
+
+    def check(self, key, measurement):
+        """Record a measurement, returning descriptions of how it regressed"""
+        relative_time = measurement.seconds_per_op / calibrate()
+        self.recorded[key] = {
+            'ops_per_second': round(measurement.ops_per_second, 1),
+            'relative_time': round(relative_time, 6),
+            'peak_bytes': measurement.peak_bytes,
+        }
+
+        baseline = self.results.get(key)
+        if baseline is None:
+            return []
+
+        regressions = []
+        limit = 1 + self.threshold
+        if relative_time > baseline['relative_time'] * limit:
+            regressions.append('%s is %.0f%% slower than its baseline' % (
+                key, (relative_time / baseline['relative_time'] - 1) * 100))
+        if measurement.peak_bytes > baseline['peak_bytes'] * limit:
+            regressions.append('%s allocates %.0f%% more than its baseline' % (
+                key, (measurement.peak_bytes / baseline['peak_bytes'] - 1) * 100))
+        return regressions
+
+    def save(self):
+        """Store the measurements recorded in this run as the new baselines"""
+        results = dict(self.results)
+        results.update(self.recorded)
+        with open(self.path, 'w') as baselines_file:
+            json.dump({'python': self.python, 'results': results}, baselines_file,
+                      indent=2, sort_keys=True)
+            baselines_file.write('\n')
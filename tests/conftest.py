@@ -1,6 +1,9 @@
 """Test fixture configuration"""
 import pytest
-from viringo import create_app
+from viringo import config, create_app, metrics
+from viringo.fragments import fragment_cache
+from viringo.resumption import DirectoryBackend, sessions
+from viringo.services import datacite, sets
 
 @pytest.fixture
 def app():
@@ -15,3 +18,39 @@ def app():
 def client(app):
     """Create a test client fixture"""
     return app.test_client()
+
+@pytest.fixture
+def configured_client(monkeypatch):
+    """Create test clients of applications created with config changed"""
+    def create_client(**settings):
+        for name, value in settings.items():
+            monkeypatch.setattr(config, name, value)
+        return create_app({'TESTING': True}).test_client()
+
+    return create_client
+
+@pytest.fixture(autouse=True)
+def reset_caches():
+    """Ensure no cached upstream data leaks between tests"""
+    sets.catalogue.reset()
+    datacite.record_cache.clear()
+    fragment_cache.clear()
+    metrics.registry.clear()
+    yield
+    sets.catalogue.reset()
+    datacite.record_cache.clear()
+    fragment_cache.clear()
+    metrics.registry.clear()
+
+@pytest.fixture(autouse=True)
+def reset_sessions():
+    """Sessions are off without a shared directory, tests of them share one"""
+    yield
+    sessions.clear()
+
+@pytest.fixture
+def shared_sessions(monkeypatch, tmp_path):
+    """Start resumption sessions, shared in a temporary directory"""
+    monkeypatch.setattr(
+        sessions, 'backend', DirectoryBackend(str(tmp_path), sessions.ttl, sessions.ttl))
+    return sessions
@@ -2,7 +2,7 @@ import json
 from viringo import catalogs
 from viringo.services import datacite
 def test_build_metadata_null_dates(mocker):
-    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.get')
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
     with open('tests/integration/fixtures/datacite_api_doi_dateproblems.json') as json_file:
         data = json.load(json_file)
     mocked_requests_get.return_value.status_code = 200
@@ -15,3 +15,24 @@ def test_build_metadata_null_dates(mocker):
         result
     )
     assert meta.get('date') == ['2018', 'Updated: 2018-01-18']
+
+def test_build_metadata_map_is_lazy():
+    """Test only the metadata map values that are read get built"""
+    result = datacite.build_metadata({
+        'id': '10.5072/lazy',
+        'attributes': {
+            'xml': 'PHJlc291cmNlLz4=',
+            'titles': None
+        },
+        'relationships': {
+            'client': {'data': {'id': 'datacite.datacite'}},
+            'provider': {'data': {'id': 'datacite'}}
+        }
+    })
+
+    meta = catalogs.DataCiteOAIServer().build_metadata_map(result)
+
+    # The titles would fail to parse if they were built
+    assert meta.get('xml') == b'<resource/>'
+    assert meta.get('set') == 'DATACITE.DATACITE'
+    assert 'title' in meta
@@ -0,0 +1,77 @@
+"""Tests for negotiated response compression"""
+
+import gzip
+import zlib
+
+from . import factories
+
+def test_gzip_response(client):
+    """Test responses are gzip compressed when the client accepts it"""
+    response = client.get('/oai?verb=Identify', headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()).startswith(b"<?xml version='1.0'")
+
+def test_deflate_response(client):
+    """Test the encoding with the highest quality is chosen"""
+    response = client.get('/oai?verb=Identify', headers={'Accept-Encoding': 'gzip;q=0.5, deflate'})
+
+    assert response.headers['Content-Encoding'] == 'deflate'
+    assert zlib.decompress(response.get_data()).startswith(b"<?xml version='1.0'")
+
+def test_uncompressed_without_accept_encoding(client):
+    """Test responses are not compressed for clients that don't ask for it"""
+    response = client.get('/oai?verb=Identify')
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data().startswith(b"<?xml version='1.0'")
+
+def test_uncompressed_below_threshold(client, mocker):
+    """Test small responses are not worth compressing"""
+    mocker.patch('viringo.config.COMPRESSION_MIN_SIZE', 1024 * 1024)
+
+    response = client.get('/oai?verb=Identify', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in response.headers
+
+def test_uncompressed_when_disabled(client, mocker):
+    """Test compression can be switched off"""
+    mocker.patch('viringo.config.COMPRESSION_ENABLED', False)
+
+    response = client.get('/oai?verb=Identify', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in response.headers
+
+def test_not_modified_uncompressed(client):
+    """Test a 304 has no body to compress"""
+    etag = client.get('/oai?verb=Identify').headers['ETag']
+
+    response = client.get(
+        '/oai?verb=Identify',
+        headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}
+    )
+
+    assert response.status_code == 304
+    assert 'Content-Encoding' not in response.headers
+
+def test_streamed_response_compressed(configured_client, mocker):
+    """Test streamed responses are compressed chunk by chunk"""
+    client = configured_client(STREAM_LIST_RESPONSES=True)
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.return_value = [
+        factories.MetadataFactory(identifier='10.5072/not-a-real-doi-%d' % i)
+        for i in range(100)
+    ], 100, None
+
+    response = client.get(
+        '/oai?verb=ListRecords&metadataPrefix=oai_dc',
+        headers={'Accept-Encoding': 'gzip'}
+    )
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    xml = gzip.decompress(response.get_data())
+    assert xml.count(b'<record') == 100
+    assert xml.rstrip().endswith(b'</OAI-PMH>')
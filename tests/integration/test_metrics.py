@@ -0,0 +1,42 @@
+"""Tests for the metrics endpoint"""
+
+import json
+
+from . import factories
+
+def test_metrics_of_requests(client, mocker):
+    """Test OAI-PMH requests are counted by verb and metadataPrefix"""
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.return_value = [factories.MetadataFactory()] * 3, 3, None
+
+    # Responses are measured once the server closes them
+    client.get('/oai?verb=ListRecords&metadataPrefix=oai_dc').close()
+    client.get('/oai?verb=Unknown&metadataPrefix=anything').close()
+
+    response = client.get('/metrics')
+    text = response.get_data(as_text=True)
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert 'viringo_request_duration_seconds_count{metadata_prefix="oai_dc",verb="ListRecords"} 1' in text
+    assert 'viringo_request_duration_seconds_count{metadata_prefix="other",verb="other"} 1' in text
+    assert 'viringo_page_records_sum{verb="ListRecords"} 3' in text
+    assert 'viringo_response_bytes_count{verb="ListRecords"} 1' in text
+
+def test_metrics_of_upstream_and_caches(client, mocker):
+    """Test API requests are counted by endpoint and status along with cache lookups"""
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+    with open('tests/integration/fixtures/datacite_api_doi.json') as json_file:
+        mocked_requests_get.return_value.json.return_value = json.load(json_file)
+    mocked_requests_get.return_value.status_code = 200
+    mocked_requests_get.return_value.headers = {}
+
+    url = '/oai?verb=GetRecord&metadataPrefix=datacite&identifier=doi:10.5438/prvv-nv23'
+    client.get(url).close()
+    client.get(url).close()
+
+    text = client.get('/metrics').get_data(as_text=True)
+
+    assert 'viringo_upstream_responses_total{endpoint="/dois/{id}",status="200"} 1' in text
+    assert 'viringo_upstream_duration_seconds_count{endpoint="/dois/{id}"} 1' in text
+    assert 'viringo_cache_events_total{cache="records",event="hits"} 1' in text
@@ -0,0 +1,159 @@
+"""Tests for the local SQLite mirror backend"""
+
+import datetime
+import json
+
+import pytest
+
+from viringo.services import mirror
+
+
+def load_page(fixture):
+    with open('tests/integration/fixtures/' + fixture) as json_file:
+        return json.load(json_file)
+
+
+def api_responses(mocker, *pages):
+    """Mock the API to return each page in turn, followed by an empty page"""
+    responses = []
+    for page in list(pages) + [{'meta': {'total': 0}, 'data': [], 'links': {}}]:
+        response = mocker.Mock(status_code=200)
+        response.json.return_value = page
+        responses.append(response)
+
+    mocked_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+    mocked_get.side_effect = responses
+    return mocked_get
+
+
+@pytest.fixture
+def mirror_database(mocker, tmp_path):
+    """Use an empty mirror database for the test"""
+    mocker.patch('viringo.config.MIRROR_DATABASE', str(tmp_path / 'mirror.sqlite3'))
+    yield
+    mirror.close_connections()
+
+
+@pytest.fixture
+def synced(mocker, mirror_database):
+    """A mirror holding the two recorded pages of DOIs"""
+    api_responses(
+        mocker,
+        load_page('datacite_api_dois.json'),
+        load_page('datacite_api_dois_2016.json')
+    )
+    assert mirror.sync() == 50
+
+
+def test_sync_stores_dois(synced):
+    """Test synced DOIs are stored with their header fields and decoded xml"""
+    results, total, _ = mirror.get_metadata_list(client_id='datacite.datacite')
+
+    assert total == 25
+    assert all(result.client == 'DATACITE.DATACITE' for result in results)
+    assert results[0].xml.startswith(b'<?xml')
+    assert results[0].titles
+
+
+def test_sync_is_incremental(mocker, synced):
+    """Test later syncs only request DOIs updated since the previous sync"""
+    mocked_get = api_responses(mocker)
+
+    assert mirror.sync() == 0
+    assert 'updated:[' in mocked_get.call_args.kwargs['params']
+
+    mocked_get = api_responses(mocker)
+    mirror.sync(full=True)
+    assert 'updated:[' not in mocked_get.call_args.kwargs['params']
+
+
+def test_keyset_pages(mocker, synced):
+    """Test pages follow on from each other in updated order without repeats"""
+    mocker.patch('viringo.config.RESULT_SET_SIZE', 20)
+
+    seen = []
+    cursor = None
+    while True:
+        results, total, cursor = mirror.get_metadata_list(cursor=cursor)
+        assert total == 50
+        seen += results
+        if not cursor:
+            break
+
+    assert len(seen) == 50
+    assert len({result.identifier for result in seen}) == 50
+    updated = [result.updated_datetime for result in seen]
+    assert updated == sorted(updated)
+
+
+def test_total_counted_once(mocker, synced):
+    """Test the total is counted for the first page and carried by the cursor"""
+    mocker.patch('viringo.config.RESULT_SET_SIZE', 20)
+    statements = []
+    mirror.get_connection().set_trace_callback(statements.append)
+
+    try:
+        _, _, cursor = mirror.get_metadata_list()
+        _, total, cursor = mirror.get_metadata_list(cursor=cursor)
+    finally:
+        mirror.get_connection().set_trace_callback(None)
+
+    assert total == 50
+    assert len([sql for sql in statements if 'COUNT(*)' in sql]) == 1
+
+
+def test_filters(synced):
+    """Test sets and dates filter the mirrored DOIs"""
+    # The recorded pages relate all but one of their DOIs to the dryad provider
+    _, total, _ = mirror.get_metadata_list(provider_id='datacite')
+    assert total == 1
+
+    results, total, _ = mirror.get_metadata_list(
+        from_datetime=datetime.datetime(2019, 8, 21),
+        until_datetime=datetime.datetime(2019, 8, 22)
+    )
+    assert total == 2
+    assert all(result.updated_datetime >= datetime.datetime(2019, 8, 21) for result in results)
+
+
+def test_header_fields_only(synced):
+    """Test header only requests don't read the xml or attributes"""
+    results, _, _ = mirror.get_metadata_list(fields=('updated', 'isActive', 'client', 'provider'))
+
+    assert results[0].active
+    assert results[0].xml is None
+    assert not results[0].titles
+
+
+def test_search_query_uses_api(mocker, mirror_database):
+    """Test sets with a search query are passed on to the API"""
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.return_value = [], 0, None
+
+    mirror.get_metadata_list(query='publicationYear:2016', cursor='abc')
+
+    mocked_get_metadata_list.assert_called_once()
+    assert mocked_get_metadata_list.call_args.kwargs['cursor'] == 'abc'
+
+
+def test_list_identifiers_from_mirror(configured_client, mocker, synced):
+    """Test the mirror backend answers list requests without the API"""
+    client = configured_client(CATALOG_BACKEND='mirror')
+    mocked_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+
+    response = client.get('/oai?verb=ListIdentifiers&metadataPrefix=oai_dc&set=NOAA.NCEI')
+
+    assert response.status_code == 200
+    assert response.get_data().count(b'<header>') == 21
+    mocked_get.assert_not_called()
+
+
+def test_mirror_sync_command(app, mocker):
+    """Test the sync command runs a sync"""
+    mocked_sync = mocker.patch('viringo.services.mirror.sync')
+    mocked_sync.return_value = 3
+
+    result = app.test_cli_runner().invoke(args=['mirror-sync', '--full'])
+
+    assert 'Mirrored 3 DOIs' in result.output
+    mocked_sync.assert_called_once_with(full=True)
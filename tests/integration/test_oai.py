@@ -1,8 +1,11 @@
 """Tests for http endpoints of OAI-PMH verbs"""
 
 import datetime
+from urllib.parse import quote
 from lxml import etree
 
+from viringo import metadata
+from viringo.resumption import session_id_of, sessions
 from . import factories
 
 def construct_oai_xml_comparisons(fixture_file_path, target_xml, oai_element):
@@ -26,6 +29,19 @@ def construct_oai_xml_comparisons(fixture_file_path, target_xml, oai_element):
 
     return original, target
 
+def construct_canonical_oai_xml_comparisons(fixture_file_path, target_xml, oai_element):
+    """Return canonical xml strings for comparison, ignoring whitespace and namespace layout"""
+    fixture_et = etree.parse(fixture_file_path)
+    metadata_a = fixture_et.getroot().find("./{http://www.openarchives.org/OAI/2.0/}" + oai_element)
+
+    response_et = etree.fromstring(target_xml)
+    metadata_b = response_et.find("./{http://www.openarchives.org/OAI/2.0/}" + oai_element)
+
+    return (
+        etree.canonicalize(etree.tostring(metadata_a, encoding="unicode"), strip_text=True),
+        etree.canonicalize(etree.tostring(metadata_b, encoding="unicode"), strip_text=True)
+    )
+
 def test_identify(client):
     """Test the identify verb responds and conforms as expected"""
     response = client.get('/oai')
@@ -87,8 +103,8 @@ def test_get_record_oai_datacite(client, mocker):
     assert response.status_code == 200
     assert response.content_type == 'application/xml; charset=utf-8'
 
-    # Compare just the verb part of the oai xml
-    original, target = construct_oai_xml_comparisons(
+    # Compare just the verb part of the oai xml, the spliced resource keeps its own namespace declarations
+    original, target = construct_canonical_oai_xml_comparisons(
         'tests/integration/fixtures/oai_getrecord_oaidatacite.xml',
         response.get_data(),
         "GetRecord"
@@ -114,8 +130,8 @@ def test_get_record_datacite(client, mocker):
     assert response.status_code == 200
     assert response.content_type == 'application/xml; charset=utf-8'
 
-    # Compare just the verb part of the oai xml
-    original, target = construct_oai_xml_comparisons(
+    # Compare just the verb part of the oai xml, the spliced resource keeps its own namespace declarations
+    original, target = construct_canonical_oai_xml_comparisons(
         'tests/integration/fixtures/oai_getrecord_datacite.xml',
         response.get_data(),
         "GetRecord"
@@ -196,11 +212,27 @@ def test_list_identifiers(client, mocker):
     # Compare the main part of the request against test case
     assert original == target
 
+def test_list_requests_projected_fields(client, mocker):
+    """Test list verbs only ask the API for the fields they need"""
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.return_value = [factories.MetadataFactory()], 1, None
+
+    client.get('/oai?verb=ListIdentifiers&metadataPrefix=oai_dc')
+    fields = mocked_get_metadata_list.call_args.kwargs['fields']
+    assert 'xml' not in fields
+    assert {'updated', 'isActive', 'client', 'provider'} <= set(fields)
+
+    client.get('/oai?verb=ListRecords&metadataPrefix=datacite')
+    assert 'xml' in mocked_get_metadata_list.call_args.kwargs['fields']
+
+    client.get('/oai?verb=ListRecords&metadataPrefix=oai_dc')
+    assert mocked_get_metadata_list.call_args.kwargs['fields'] is None
+
 def test_list_sets(client, mocker):
     """Test the listIdentifiers verb responds and conforms as expected"""
 
     # Mock the datacite service to ensure the same record data is returned.
-    mocked_get_sets = mocker.patch('viringo.services.datacite.get_sets')
+    mocked_get_sets = mocker.patch('viringo.services.datacite_async.get_sets')
 
     # Get fake results
     results = [
@@ -264,3 +296,393 @@ def test_responds_to_get_post(client):
 
     assert response.status_code == 200
     assert response.content_type == 'application/xml; charset=utf-8'
+
+def test_get_record_dc_async_catalog(configured_client, mocker):
+    """Test the getRecord verb through the asynchronous catalog"""
+
+    client = configured_client(CATALOG_ASYNC=True)
+
+    # Mock the async datacite service to ensure the same record data is returned.
+    mocked_get_metadata = mocker.patch('viringo.services.datacite_async.get_metadata')
+    mocked_get_metadata.return_value = factories.MetadataFactory()
+
+    response = client.get(
+        '/oai?verb=GetRecord&metadataPrefix=oai_dc&identifier=doi:10.5072/not-a-real-doi'
+    )
+
+    assert response.status_code == 200
+    mocked_get_metadata.assert_awaited_once_with('10.5072/not-a-real-doi')
+
+    # Compare just the verb part of the oai xml
+    original, target = construct_oai_xml_comparisons(
+        'tests/integration/fixtures/oai_getrecord_dc.xml',
+        response.get_data(),
+        "GetRecord"
+    )
+
+    assert original == target
+
+def test_responds_with_stylesheet(client):
+    """Test the xsl stylesheet instruction precedes the OAI-PMH root element"""
+    response = client.get('/oai?verb=Identify')
+
+    lines = response.get_data().splitlines()
+    assert lines[0] == b"<?xml version='1.0' encoding='UTF-8'?>"
+    assert lines[1] == b'<?xml-stylesheet type="text/xsl" href="/static/oaitohtml.xsl"?>'
+    assert lines[2].startswith(b'<OAI-PMH')
+
+def test_error_responds_with_stylesheet(client):
+    """Test OAI-PMH error responses also carry the xsl stylesheet instruction"""
+    response = client.get('/oai?verb=NotAVerb')
+
+    assert response.status_code == 200
+    assert b'<?xml-stylesheet type="text/xsl" href="/static/oaitohtml.xsl"?>' in response.get_data()
+    assert b'code="badVerb"' in response.get_data()
+
+def test_list_records_dc_streamed(configured_client, mocker):
+    """Test the listRecords verb streams the same records when streaming is enabled"""
+
+    client = configured_client(STREAM_LIST_RESPONSES=True)
+
+    # Mock the datacite service to ensure the same record data is returned.
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    result_1 = factories.MetadataFactory()
+    result_2 = factories.MetadataFactory(
+        identifier="10.5072/not-a-real-doi-2",
+        updated_datetime=datetime.datetime(2018, 5, 17, 6, 33),
+        dates=[
+            {'type': 'Issued', 'date': '2018-02-16'},
+            {'type': 'Created', 'date': '2018-02-16'},
+            {'type': 'Updated', 'date': '2018-02-16'}
+        ],
+        identifiers=[
+            {'type': 'DOI', 'identifier': '10.5072/not-a-real-doi-2'}
+        ],
+        relations=[]
+    )
+    mocked_get_metadata_list.return_value = [result_1, result_2], 2, 1
+
+    response = client.get('/oai?verb=ListRecords&metadataPrefix=oai_dc&set=DATACITE.DATACITE')
+
+    assert response.status_code == 200
+    assert response.content_type == 'application/xml; charset=utf-8'
+
+    # Compare just the verb part of the oai xml
+    original, target = construct_canonical_oai_xml_comparisons(
+        'tests/integration/fixtures/oai_listrecords_dc.xml',
+        response.get_data(),
+        "ListRecords"
+    )
+
+    assert original == target
+
+def test_list_identifiers_streamed(configured_client, mocker):
+    """Test the listIdentifiers verb streams the same headers when streaming is enabled"""
+
+    client = configured_client(STREAM_LIST_RESPONSES=True)
+
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    result_1 = factories.MetadataFactory()
+    result_2 = factories.MetadataFactory(
+        identifier="10.5072/not-a-real-doi-2",
+        updated_datetime=datetime.datetime(2018, 5, 17, 6, 33),
+    )
+    mocked_get_metadata_list.return_value = [result_1, result_2], 2, 1
+
+    response = client.get('/oai?verb=ListIdentifiers&metadataPrefix=oai_dc&set=DATACITE.DATACITE')
+
+    assert response.status_code == 200
+
+    original, target = construct_canonical_oai_xml_comparisons(
+        'tests/integration/fixtures/oai_listidentifiers.xml',
+        response.get_data(),
+        "ListIdentifiers"
+    )
+
+    assert original == target
+
+def test_list_records_streamed_no_records(configured_client, mocker):
+    """Test errors found before streaming starts are returned as OAI-PMH errors"""
+
+    client = configured_client(STREAM_LIST_RESPONSES=True)
+
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.return_value = [], 0, None
+
+    response = client.get('/oai?verb=ListRecords&metadataPrefix=oai_dc')
+
+    assert response.status_code == 200
+    assert b'code="noRecordsMatch"' in response.get_data()
+
+def test_list_records_streamed_unknown_format(configured_client, mocker):
+    """Test an unknown metadata format is an OAI-PMH error before streaming starts"""
+
+    client = configured_client(STREAM_LIST_RESPONSES=True)
+
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.return_value = [factories.MetadataFactory()], 1, None
+
+    response = client.get('/oai?verb=ListRecords&metadataPrefix=bogus')
+
+    assert response.status_code == 200
+    assert b'code="cannotDisseminateFormat"' in response.get_data()
+    assert 'Cache-Control' not in response.headers
+
+def test_get_record_conditional(client, mocker):
+    """Test GetRecord responses carry validators and answer conditional requests"""
+
+    mocked_get_metadata = mocker.patch('viringo.services.datacite.get_metadata')
+    mocked_get_metadata.return_value = factories.MetadataFactory()
+
+    url = '/oai?verb=GetRecord&metadataPrefix=oai_dc&identifier=doi:10.5072/not-a-real-doi'
+    response = client.get(url)
+
+    assert response.status_code == 200
+    assert response.headers['Last-Modified'] == 'Sat, 17 Mar 2018 06:33:00 GMT'
+    assert response.headers['Cache-Control'] == 'public, max-age=300'
+    etag = response.headers['ETag']
+    assert etag.startswith('W/"')
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+    response = client.get(url, headers={'If-Modified-Since': 'Sat, 17 Mar 2018 06:33:00 GMT'})
+    assert response.status_code == 304
+
+    # A newer version of the record is a new representation
+    mocked_get_metadata.return_value = factories.MetadataFactory(
+        updated_datetime=datetime.datetime(2019, 1, 1)
+    )
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_list_identifiers_etag_follows_headers(client, mocker):
+    """Test list pages are validated by the headers of the records they contain"""
+
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.return_value = [factories.MetadataFactory()], 1, None
+
+    url = '/oai?verb=ListIdentifiers&metadataPrefix=oai_dc'
+    etag = client.get(url).headers['ETag']
+
+    assert client.get(url).headers['ETag'] == etag
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    mocked_get_metadata_list.return_value = [
+        factories.MetadataFactory(),
+        factories.MetadataFactory(identifier='10.5072/not-a-real-doi-2')
+    ], 2, None
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert 'Last-Modified' not in response.headers
+
+def test_list_records_streamed_conditional(configured_client, mocker):
+    """Test streamed list pages are validated before any output is written"""
+
+    client = configured_client(STREAM_LIST_RESPONSES=True)
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.return_value = [factories.MetadataFactory()], 1, None
+
+    url = '/oai?verb=ListRecords&metadataPrefix=oai_dc'
+    response = client.get(url)
+    etag = response.headers['ETag']
+
+    # The response must not have been buffered to work out its length
+    assert 'Content-Length' not in response.headers
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+def test_error_not_cached(client):
+    """Test OAI-PMH error responses have no validators or cache lifetime"""
+    response = client.get('/oai?verb=NotAVerb')
+
+    assert 'ETag' not in response.headers
+    assert 'Cache-Control' not in response.headers
+
+def test_cache_lifetime_per_verb(client, mocker):
+    """Test the cache lifetime is configured per verb"""
+    mocker.patch.dict('viringo.config.CACHE_MAX_AGE', {'ListMetadataFormats': 42})
+
+    response = client.get('/oai?verb=ListMetadataFormats')
+
+    assert response.headers['Cache-Control'] == 'public, max-age=42'
+
+def test_get_record_datacite_invalid_characters(client, mocker):
+    """Test raw xml with characters not allowed in XML is still returned"""
+
+    mocked_get_metadata = mocker.patch('viringo.services.datacite.get_metadata')
+    result = factories.MetadataFactory()
+    result.xml = result.xml.replace('fake metadata.</title>', 'fake metadata.\x0b</title>')
+    mocked_get_metadata.return_value = result
+
+    response = client.get(
+        '/oai?verb=GetRecord&metadataPrefix=datacite&identifier=doi:10.5072/not-a-real-doi'
+    )
+
+    assert response.status_code == 200
+
+    # Compare just the verb part of the oai xml, the spliced resource keeps its own namespace declarations
+    original, target = construct_canonical_oai_xml_comparisons(
+        'tests/integration/fixtures/oai_getrecord_datacite.xml',
+        response.get_data(),
+        "GetRecord"
+    )
+
+    assert original == target
+
+def test_list_records_datacite_spliced(configured_client, mocker):
+    """Test raw resource xml is spliced into streamed and whole responses the same as parsed"""
+
+    # Enough records for the stream to be drained part way through
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.return_value = [
+        factories.MetadataFactory(identifier='10.5072/not-a-real-doi-%d' % i)
+        for i in range(20)
+    ], 20, None
+    client = configured_client()
+
+    def list_records():
+        response = client.get('/oai?verb=ListRecords&metadataPrefix=oai_datacite')
+        assert response.status_code == 200
+        return etree.fromstring(response.get_data())
+
+    mocker.patch('viringo.config.RAW_XML_SPLICE', False)
+    parsed = list_records()
+
+    mocker.patch('viringo.config.RAW_XML_SPLICE', True)
+    spliced = list_records()
+
+    client = configured_client(STREAM_LIST_RESPONSES=True)
+    streamed = list_records()
+
+    def canonical(tree):
+        e_list = tree.find('{http://www.openarchives.org/OAI/2.0/}ListRecords')
+        return etree.canonicalize(etree.tostring(e_list, encoding='unicode'), strip_text=True)
+
+    assert b'viringo-splice' not in etree.tostring(streamed)
+    assert len(streamed.findall('.//{http://datacite.org/schema/kernel-4}resource')) == 20
+    assert canonical(parsed) == canonical(spliced) == canonical(streamed)
+
+def test_get_record_rendered_from_fragment_cache(configured_client, mocker):
+    """Test records are rendered once per version and format"""
+    mocked_get_metadata = mocker.patch('viringo.services.datacite.get_metadata')
+    mocked_get_metadata.return_value = factories.MetadataFactory()
+    # Writers are registered as the application is created
+    mocked_writer = mocker.spy(metadata, 'oai_dc_writer')
+    client = configured_client()
+
+    url = '/oai?verb=GetRecord&metadataPrefix=oai_dc&identifier=doi:10.5072/not-a-real-doi'
+    first = client.get(url)
+    second = client.get(url)
+
+    assert mocked_writer.call_count == 1
+    assert first.get_data() == second.get_data()
+
+    # A new version of the record is rendered again
+    mocked_get_metadata.return_value = factories.MetadataFactory(
+        updated_datetime=datetime.datetime(2019, 1, 1),
+        titles=['A new title']
+    )
+    third = client.get(url)
+
+    assert mocked_writer.call_count == 2
+    assert b'A new title' in third.get_data()
+
+def test_list_records_streamed_from_fragment_cache(configured_client, mocker):
+    """Test streamed lists use the same rendered records as whole responses"""
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.return_value = [factories.MetadataFactory()], 1, None
+    client = configured_client()
+
+    def list_records():
+        response = client.get('/oai?verb=ListRecords&metadataPrefix=oai_dc')
+        e_list = etree.fromstring(response.get_data()).find(
+            '{http://www.openarchives.org/OAI/2.0/}ListRecords')
+        return etree.canonicalize(etree.tostring(e_list, encoding='unicode'), strip_text=True)
+
+    whole = list_records()
+
+    mocked_writer = mocker.spy(metadata, 'oai_dc_writer')
+    client = configured_client(STREAM_LIST_RESPONSES=True)
+    streamed = list_records()
+
+    assert mocked_writer.call_count == 0
+    assert streamed == whole
+
+def test_list_records_not_prefetched_by_default(client, mocker):
+    """Test the default configuration, without a shared directory, starts no sessions"""
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.side_effect = [
+        ([factories.MetadataFactory()], 2, 'next'),
+        ([factories.MetadataFactory(identifier='10.5072/not-a-real-doi-2')], 2, None),
+    ]
+
+    response = client.get('/oai?verb=ListIdentifiers&metadataPrefix=oai_dc')
+    token = etree.fromstring(response.get_data()).findtext(
+        './/{http://www.openarchives.org/OAI/2.0/}resumptionToken')
+    assert session_id_of(token) is None
+    assert mocked_get_metadata_list.call_count == 1
+
+    response = client.get('/oai?verb=ListIdentifiers&resumptionToken=' + quote(token))
+    assert b'doi:10.5072/not-a-real-doi-2' in response.get_data()
+    assert mocked_get_metadata_list.call_count == 2
+    assert not sessions.enabled
+
+def test_list_records_resumed_from_prefetched_page(client, mocker, shared_sessions):
+    """Test the page a resumptionToken resumes is fetched ahead of the harvester"""
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.side_effect = [
+        ([factories.MetadataFactory()], 2, 'next'),
+        ([factories.MetadataFactory(identifier='10.5072/not-a-real-doi-2')], 2, None),
+    ]
+
+    response = client.get('/oai?verb=ListIdentifiers&metadataPrefix=oai_dc')
+    token = etree.fromstring(response.get_data()).findtext(
+        './/{http://www.openarchives.org/OAI/2.0/}resumptionToken')
+    assert token == 'rs.' + session_id_of(token)
+    assert len(token) < 24
+
+    response = client.get('/oai?verb=ListIdentifiers&resumptionToken=' + quote(token))
+    assert response.status_code == 200
+    assert b'doi:10.5072/not-a-real-doi-2' in response.get_data()
+    assert mocked_get_metadata_list.call_count == 2
+    assert mocked_get_metadata_list.call_args.kwargs['cursor'] == 'next'
+
+def test_list_records_resumed_without_session(client, mocker, shared_sessions):
+    """Test a token whose page is gone is resumed from its stateless token"""
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.side_effect = lambda cursor=None, **kwargs: (
+        [factories.MetadataFactory()], 2, None if cursor else 'next')
+
+    url = '/oai?verb=ListIdentifiers&metadataPrefix=oai_dc'
+    first_response, second_response = client.get(url), client.get(url)
+    tokens = [
+        etree.fromstring(response.get_data()).findtext(
+            './/{http://www.openarchives.org/OAI/2.0/}resumptionToken')
+        for response in [first_response, second_response]
+    ]
+    # Each response has a session of its own, the validators follow the page
+    assert tokens[0] != tokens[1]
+    assert first_response.headers['ETag'] == second_response.headers['ETag']
+
+    # Used up as if other workers had answered them
+    for token in tokens:
+        sessions.take(token, 'ListIdentifiers')
+
+    response = client.get('/oai?verb=ListIdentifiers&resumptionToken=' + quote(tokens[0]))
+    assert response.status_code == 200
+    assert mocked_get_metadata_list.call_count == 5
+    assert mocked_get_metadata_list.call_args.kwargs['cursor'] == 'next'
+
+def test_list_records_unknown_session(client, mocker):
+    """Test a session token that can't be resolved is a badResumptionToken error"""
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+
+    response = client.get('/oai?verb=ListIdentifiers&resumptionToken=rs.unknown')
+
+    assert response.status_code == 200
+    assert b'code="badResumptionToken"' in response.get_data()
+    mocked_get_metadata_list.assert_not_called()
@@ -0,0 +1,118 @@
+"""Tests for profiling single requests"""
+
+import os
+import pstats
+
+from viringo import profiling
+
+from . import factories
+
+TOKEN = 'profile-secret'
+
+def test_request_not_profiled_without_token(client, mocker, tmp_path):
+    """Test a wrong or missing token leaves the request unprofiled"""
+    mocker.patch('viringo.config.PROFILING_TOKEN', TOKEN)
+    mocker.patch('viringo.config.PROFILING_DIR', str(tmp_path))
+
+    assert 'X-Viringo-Profile-Id' not in client.get('/oai?verb=Identify').headers
+    response = client.get('/oai?verb=Identify', headers={'X-Viringo-Profile': 'wrong'})
+    assert 'X-Viringo-Profile-Id' not in response.headers
+
+def test_request_not_profiled_when_disabled(client, mocker):
+    """Test nothing is profiled without a configured token"""
+    mocker.patch('viringo.config.PROFILING_TOKEN', '')
+
+    response = client.get('/oai?verb=Identify', headers={'X-Viringo-Profile': ''})
+    assert 'X-Viringo-Profile-Id' not in response.headers
+
+def test_request_profiled_as_pstats(client, mocker, tmp_path):
+    """Test a request with the token stores a profile that can be downloaded"""
+    mocker.patch('viringo.config.PROFILING_TOKEN', TOKEN)
+    mocker.patch('viringo.config.PROFILING_DIR', str(tmp_path))
+    mocked_get_metadata = mocker.patch('viringo.services.datacite.get_metadata')
+    mocked_get_metadata.return_value = factories.MetadataFactory()
+
+    response = client.get(
+        '/oai?verb=GetRecord&metadataPrefix=oai_dc&identifier=doi:10.5072/not-a-real-doi',
+        headers={'X-Viringo-Profile': TOKEN}
+    )
+    assert response.status_code == 200
+    assert b'GetRecord' in response.get_data()
+    response.close()
+
+    name = response.headers['X-Viringo-Profile-Id']
+    assert name.endswith('.pstats')
+    stats = pstats.Stats(str(tmp_path / name))
+    assert any(function[2] == 'oai_dc_writer' for function in stats.stats)
+
+    assert client.get('/oai/profiles/' + name).status_code == 404
+    download = client.get('/oai/profiles/' + name, headers={'X-Viringo-Profile': TOKEN})
+    assert download.status_code == 200
+
+def test_streamed_request_profiled_as_collapsed_stacks(configured_client, mocker, tmp_path):
+    """Test collapsed stacks include the records written after the view returns"""
+    mocker.patch('viringo.config.PROFILING_TOKEN', TOKEN)
+    mocker.patch('viringo.config.PROFILING_DIR', str(tmp_path))
+    client = configured_client(STREAM_LIST_RESPONSES=True)
+    mocker.patch('viringo.config.FRAGMENT_CACHE_ENABLED', False)
+    mocker.patch('viringo.profiling.SAMPLE_INTERVAL', 0.0001)
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.return_value = [
+        factories.MetadataFactory(identifier='10.5072/not-a-real-doi-%d' % i) for i in range(500)
+    ], 500, None
+
+    response = client.get(
+        '/oai?verb=ListRecords&metadataPrefix=oai_dc',
+        headers={'X-Viringo-Profile': TOKEN, 'X-Viringo-Profile-Format': 'collapsed'}
+    )
+    assert b'not-a-real-doi-499' in response.get_data()
+    response.close()
+
+    name = response.headers['X-Viringo-Profile-Id']
+    assert '-ListRecords-' in name
+    stacks = (tmp_path / name).read_text().splitlines()
+    assert stacks
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in stacks)
+    assert any('_streamList' in line for line in stacks)
+
+def test_profiled_response_not_cached(client, mocker, tmp_path):
+    """Test a profiled response has no validators and isn't stored by caches"""
+    mocker.patch('viringo.config.PROFILING_TOKEN', TOKEN)
+    mocker.patch('viringo.config.PROFILING_DIR', str(tmp_path))
+
+    etag = client.get('/oai?verb=Identify').headers['ETag']
+    response = client.get(
+        '/oai?verb=Identify', headers={'X-Viringo-Profile': TOKEN, 'If-None-Match': etag})
+    response.close()
+
+    assert response.status_code == 200
+    assert 'X-Viringo-Profile-Id' in response.headers
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert 'ETag' not in response.headers
+    assert 'Last-Modified' not in response.headers
+
+def test_profile_chunks_closes_stream(mocker):
+    """Test closing a profiled stream early closes the stream it wraps"""
+    chunks = mocker.MagicMock()
+    chunks.__iter__.return_value = iter([b'a', b'b'])
+    streamed = profiling.profile_chunks(mocker.Mock(), chunks)
+
+    assert next(streamed) == b'a'
+    streamed.close()
+    chunks.close.assert_called_once_with()
+
+def test_oldest_profiles_pruned(client, mocker, tmp_path):
+    """Test only the newest profiles are kept"""
+    mocker.patch('viringo.config.PROFILING_TOKEN', TOKEN)
+    mocker.patch('viringo.config.PROFILING_DIR', str(tmp_path))
+    mocker.patch('viringo.config.PROFILING_MAX_PROFILES', 2)
+
+    names = []
+    for age in range(3):
+        response = client.get('/oai?verb=Identify', headers={'X-Viringo-Profile': TOKEN})
+        response.close()
+        names.append(response.headers['X-Viringo-Profile-Id'])
+        # Make each profile older than the next
+        os.utime(str(tmp_path / names[-1]), (age, age))
+
+    assert sorted(os.listdir(str(tmp_path))) == sorted(names[1:])
@@ -20,7 +20,7 @@ def test_integration_contract_metadata(mocker):
         data = json.load(json_file)
 
     # Mock the datacite service to ensure the same record data is returned.
-    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.get')
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
 
      # Set the mocked service to use the fake result
     mocked_requests_get.return_value.status_code = 200
@@ -28,13 +28,16 @@ def test_integration_contract_metadata(mocker):
 
     fake_metadata = datacite.get_metadata("10.5438/prvv-nv23")
 
-    # Compare just the keys of the results for checking the contract
-    assert list(real_metadata.__dict__.keys()) == list(fake_metadata.__dict__.keys())
+    # Compare just the field types of the results for checking the contract
+    def field_types(metadata):
+        return {field: type(getattr(metadata, field)) for field in datacite.FIELD_PARSERS}
+
+    assert field_types(real_metadata) == field_types(fake_metadata)
 
 def test_get_metadata(mocker):
     """Tests the results of the datasite service for getting a single metadata record"""
     # Mock the datacite service to ensure the same record data is returned.
-    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.get')
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
 
     with open('tests/integration/fixtures/datacite_api_doi.json') as json_file:
         data = json.load(json_file)
@@ -70,7 +73,7 @@ Can you tell us a little bit about what you did before you started...']
 def test_get_metadata_list(mocker):
     """Tests the results of the datasite service for getting a list of metadata records"""
     # Mock the datacite service to ensure the same record data is returned.
-    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.get')
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
 
     with open('tests/integration/fixtures/datacite_api_dois.json') as json_file:
         data = json.load(json_file)
@@ -88,7 +91,7 @@ def test_get_metadata_list(mocker):
 def test_get_metadata_list_search_query(mocker):
     """Tests the results of the datasite service for getting a list of metadata records"""
     # Mock the datacite service to ensure the same record data is returned.
-    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.get')
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
 
     with open('tests/integration/fixtures/datacite_api_dois_2016.json') as json_file:
         data = json.load(json_file)
@@ -107,7 +110,7 @@ def test_get_metadata_list_search_query(mocker):
 def test_get_sets(mocker):
     """Tests the results of the datasite service for getting a list of sets"""
     # Mock the datacite service to ensure the same record data is returned.
-    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.get')
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
 
     with open('tests/integration/fixtures/datacite_api_clients.json') as json_file:
         data = json.load(json_file)
@@ -134,3 +137,79 @@ def test_get_sets(mocker):
 
     assert total_results == 11
     assert sets == expected_sets
+
+def test_get_sets_error(mocker):
+    """Tests an API error getting sets is reported rather than an empty list"""
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+    mocked_requests_get.return_value.status_code = 500
+
+    assert datacite.get_sets() is None
+
+def test_get_metadata_cached(mocker):
+    """Tests a fresh cached record is served without calling the API"""
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+
+    with open('tests/integration/fixtures/datacite_api_doi.json') as json_file:
+        data = json.load(json_file)
+
+    mocked_requests_get.return_value.status_code = 200
+    mocked_requests_get.return_value.json.return_value = data
+    mocked_requests_get.return_value.headers = {'ETag': 'W/"abc"'}
+
+    first = datacite.get_metadata("10.5438/prvv-nv23")
+    second = datacite.get_metadata("10.5438/prvv-nv23")
+
+    assert second is first
+    assert mocked_requests_get.call_count == 1
+    assert datacite.record_cache.stats() == {
+        'hits': 1, 'revalidations': 0, 'misses': 1, 'evictions': 0
+    }
+
+def test_get_metadata_revalidated(mocker):
+    """Tests a stale cached record is revalidated with a conditional request"""
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+    mocker.patch.object(datacite.record_cache, 'ttl', -1)
+
+    with open('tests/integration/fixtures/datacite_api_doi.json') as json_file:
+        data = json.load(json_file)
+
+    mocked_requests_get.return_value.status_code = 200
+    mocked_requests_get.return_value.json.return_value = data
+    mocked_requests_get.return_value.headers = {
+        'ETag': 'W/"abc"',
+        'Last-Modified': 'Wed, 17 Jan 2018 06:33:00 GMT'
+    }
+
+    first = datacite.get_metadata("10.5438/prvv-nv23")
+
+    mocked_requests_get.return_value.status_code = 304
+    mocked_requests_get.return_value.json.side_effect = ValueError("No body")
+
+    second = datacite.get_metadata("10.5438/prvv-nv23")
+
+    assert second is first
+    _, kwargs = mocked_requests_get.call_args
+    assert kwargs['headers'] == {
+        'If-None-Match': 'W/"abc"',
+        'If-Modified-Since': 'Wed, 17 Jan 2018 06:33:00 GMT'
+    }
+    assert datacite.record_cache.revalidations == 1
+
+def test_get_metadata_removed_from_cache(mocker):
+    """Tests a record that no longer exists upstream is dropped from the cache"""
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+    mocker.patch.object(datacite.record_cache, 'ttl', -1)
+
+    with open('tests/integration/fixtures/datacite_api_doi.json') as json_file:
+        data = json.load(json_file)
+
+    mocked_requests_get.return_value.status_code = 200
+    mocked_requests_get.return_value.json.return_value = data
+    mocked_requests_get.return_value.headers = {}
+
+    datacite.get_metadata("10.5438/prvv-nv23")
+
+    mocked_requests_get.return_value.status_code = 404
+
+    assert datacite.get_metadata("10.5438/prvv-nv23") is None
+    assert datacite.record_cache.lookup("10.5438/prvv-nv23") is None
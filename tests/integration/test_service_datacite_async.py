@@ -0,0 +1,99 @@
+"""Tests for the asynchronous DataCite service"""
+
+import asyncio
+import copy
+import json
+from viringo.services import datacite, datacite_async
+
+def test_get_metadata(mocker):
+    """Tests the async service parses a single metadata record the same as the sync one"""
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+
+    with open('tests/integration/fixtures/datacite_api_doi.json') as json_file:
+        data = json.load(json_file)
+
+    mocked_requests_get.return_value.status_code = 200
+    mocked_requests_get.return_value.json.return_value = data
+
+    metadata = asyncio.run(datacite_async.get_metadata("10.5438/prvv-nv23"))
+    expected = datacite.get_metadata("10.5438/prvv-nv23")
+
+    assert metadata.identifier == "10.5438/prvv-nv23"
+    assert metadata.titles == expected.titles
+    assert metadata.updated_datetime == expected.updated_datetime
+    assert metadata.xml == expected.xml
+
+def test_get_metadata_not_found(mocker):
+    """Tests the async service returns nothing for unknown records"""
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+    mocked_requests_get.return_value.status_code = 404
+
+    assert asyncio.run(datacite_async.get_metadata("10.5072/missing")) is None
+
+def test_get_metadata_list(mocker):
+    """Tests the async service for getting a list of metadata records"""
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+
+    with open('tests/integration/fixtures/datacite_api_dois.json') as json_file:
+        data = json.load(json_file)
+
+    mocked_requests_get.return_value.status_code = 200
+    mocked_requests_get.return_value.json.return_value = data
+
+    metadata_list, total_results, _ = asyncio.run(
+        datacite_async.get_metadata_list(client_id="datacite.datacite")
+    )
+
+    assert total_results == 40
+    assert len(metadata_list) == 25
+
+def test_get_sets_fetches_all_pages(mocker):
+    """Tests the async service requests every /clients page at once and merges them"""
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+
+    with open('tests/integration/fixtures/datacite_api_clients.json') as json_file:
+        data = json.load(json_file)
+
+    # Split the fixture into two pages
+    first_page = copy.deepcopy(data)
+    first_page['meta']['totalPages'] = 2
+    first_page['data'] = data['data'][:5]
+    second_page = copy.deepcopy(data)
+    second_page['meta']['totalPages'] = 2
+    second_page['data'] = data['data'][5:]
+
+    def fake_get(url, params=None, **kwargs):
+        response = mocker.Mock()
+        response.status_code = 200
+        if 'page[number]=2' in params:
+            response.json.return_value = second_page
+        else:
+            response.json.return_value = first_page
+        return response
+
+    mocked_requests_get.side_effect = fake_get
+
+    sets, total_results = asyncio.run(datacite_async.get_sets())
+
+    assert mocked_requests_get.call_count == 2
+    assert total_results == 11
+    assert ('datacite.transfer', 'DOI Transfer Client') in sets
+    assert ('datacite.axiom', 'Axiom Data Science') in sets
+
+def test_get_sets_page_error(mocker):
+    """Tests sets aren't returned when one of the /clients pages fails"""
+    mocked_requests_get = mocker.patch('viringo.services.datacite.requests.Session.get')
+
+    with open('tests/integration/fixtures/datacite_api_clients.json') as json_file:
+        data = json.load(json_file)
+    data['meta']['totalPages'] = 2
+
+    def fake_get(url, params=None, **kwargs):
+        response = mocker.Mock()
+        response.status_code = 500 if 'page[number]=2' in params else 200
+        response.json.return_value = data
+        return response
+
+    mocked_requests_get.side_effect = fake_get
+
+    assert asyncio.run(datacite_async.get_sets()) is None
@@ -0,0 +1,52 @@
+"""Tests for the Server-Timing breakdown of requests"""
+
+import logging
+
+import pytest
+import requests
+
+from . import factories
+
+def test_server_timing_header(client, mocker):
+    """Test sampled requests have a breakdown of their stages"""
+    mocker.patch('viringo.config.TIMING_SAMPLE_RATE', 1.0)
+    mocked_get_metadata = mocker.patch('viringo.services.datacite.get_metadata')
+    mocked_get_metadata.return_value = factories.MetadataFactory()
+
+    response = client.get(
+        '/oai?verb=GetRecord&metadataPrefix=oai_dc&identifier=doi:10.5072/not-a-real-doi')
+
+    stages = [part.split(';')[0] for part in response.headers['Server-Timing'].split(', ')]
+    assert {'build_metadata_map', 'write_metadata', 'serialize', 'total'} <= set(stages)
+
+def test_server_timing_sampled(client, mocker):
+    """Test requests outside the sample have no breakdown"""
+    mocker.patch('viringo.config.TIMING_SAMPLE_RATE', 0.0)
+
+    assert 'Server-Timing' not in client.get('/oai?verb=Identify').headers
+
+def test_breakdown_logged(client, mocker, caplog):
+    """Test the request log line has the breakdown once the response is sent"""
+    mocker.patch('viringo.config.TIMING_SAMPLE_RATE', 1.0)
+
+    with caplog.at_level(logging.INFO):
+        client.get('/oai?verb=Identify').close()
+
+    record = next(record for record in caplog.records if record.getMessage() == 'OAI request Identify')
+    assert record.verb == 'Identify'
+    assert 'total' in record.timing
+
+def test_failed_request_logged(client, mocker, caplog):
+    """Test a request that fails is logged with its error and breakdown so far"""
+    mocker.patch('viringo.config.TIMING_SAMPLE_RATE', 1.0)
+    mocked_get_metadata_list = mocker.patch('viringo.services.datacite.get_metadata_list')
+    mocked_get_metadata_list.side_effect = requests.exceptions.ConnectionError
+
+    with caplog.at_level(logging.INFO), pytest.raises(requests.exceptions.ConnectionError):
+        client.get('/oai?verb=ListRecords&metadataPrefix=oai_dc')
+
+    record = next(
+        record for record in caplog.records if record.getMessage() == 'OAI request ListRecords')
+    assert record.metadataPrefix == 'oai_dc'
+    assert record.error == 'ConnectionError'
+    assert 'total' in record.timing
@@ -0,0 +1,179 @@
+"""Load driver measuring each OAI-PMH verb through the Flask app
+
+Harvesters run concurrently against create_app(), with the DataCite API
+replaced by the local stand-in. Every harvest walks a whole ListRecords or
+ListIdentifiers list through its resumption tokens. The report gives the
+requests per second and the p50 and p99 latency of each verb.
+
+    python -m tests.load.driver --dois 2000 --latency 0.05 --harvesters 4
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import quote
+
+from lxml import etree
+
+from viringo import config, create_app
+from .fake_api import FakeDataCiteAPI, doi_at
+
+NS_OAIPMH = '{http://www.openarchives.org/OAI/2.0/}'
+
+
+class Timings:
+    """Latencies of the requests made for each verb"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+
+    def add(self, verb, seconds):
+        with self._lock:
+            self.latencies[verb].append(seconds)
+
+
+class Harvester:
+    """An OAI-PMH client of the app, timing every request it makes"""
+
+    def __init__(self, app, timings):
+        self.client = app.test_client()
+        self.timings = timings
+
+    def get(self, verb, **arguments):
+        """Make a request, returning its parsed response"""
+        url = '/oai?verb=' + verb + ''.join(
+            '&%s=%s' % (name, quote(value)) for name, value in arguments.items())
+
+        start = time.perf_counter()
+        response = self.client.get(url)
+        data = response.get_data()
+        self.timings.add(verb, time.perf_counter() - start)
+
+        if response.status_code != 200:
+            raise RuntimeError('%s responded with %s' % (url, response.status_code))
+        return etree.fromstring(data)
+
+    def harvest(self, verb, metadata_prefix, set_spec=None):
+        """Walk a whole list through its resumption tokens, returning how many items it had"""
+        arguments = {'metadataPrefix': metadata_prefix}
+        if set_spec:
+            arguments['set'] = set_spec
+
+        items = 0
+        while True:
+            tree = self.get(verb, **arguments)
+            items += len(tree.findall('.//' + NS_OAIPMH + 'header'))
+
+            token = tree.findtext('.//' + NS_OAIPMH + 'resumptionToken')
+            if not token:
+                return items
+            arguments = {'resumptionToken': token}
+
+    def single_requests(self, metadata_prefix, count):
+        """Make the verbs that answer with one response, count times"""
+        for index in range(count):
+            self.get('Identify')
+            self.get('ListMetadataFormats')
+            self.get('ListSets')
+            self.get('GetRecord', metadataPrefix=metadata_prefix, identifier='doi:' + doi_at(index))
+
+
+def run(dois=1000, size='typical', latency=0.0, harvesters=4, harvests=1,
+        metadata_prefix='oai_dc', verb='ListRecords', single_requests=20):
+    """Run a load test, returning its timings, items harvested and duration"""
+    timings = Timings()
+    items = []
+    errors = []
+
+    with FakeDataCiteAPI(dois=dois, size=size, latency=latency) as api:
+        api_url = config.DATACITE_API_URL
+        config.DATACITE_API_URL = api.url
+        try:
+            app = create_app({'TESTING': True})
+
+            def work():
+                harvester = Harvester(app, timings)
+                try:
+                    harvester.single_requests(metadata_prefix, single_requests)
+                    for _ in range(harvests):
+                        items.append(harvester.harvest(verb, metadata_prefix))
+                except Exception as error: #pylint: disable=broad-except
+                    errors.append(error)
+
+            threads = [threading.Thread(target=work) for _ in range(harvesters)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            duration = time.perf_counter() - start
+        finally:
+            config.DATACITE_API_URL = api_url
+
+    if errors:
+        raise errors[0]
+
+    return timings, items, duration
+
+
+def percentile(values, fraction):
+    """The value a fraction of the sorted values are at or below"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def report(timings, items, duration):
+    """A throughput and latency table of a load test run
+
+    The requests per second of a verb are those of one harvester making only
+    that request, the overall rate is of all harvesters together.
+    """
+    lines = ['%-20s %8s %10s %10s %10s' % ('verb', 'requests', 'req/s', 'p50 ms', 'p99 ms')]
+    total = 0
+    for verb, latencies in sorted(timings.latencies.items()):
+        total += len(latencies)
+        lines.append('%-20s %8d %10.1f %10.1f %10.1f' % (
+            verb,
+            len(latencies),
+            len(latencies) / sum(latencies),
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000
+        ))
+    every_latency = [seconds for latencies in timings.latencies.values() for seconds in latencies]
+    lines.append('%d requests in %.2fs, %.1f req/s overall, %d items harvested, mean %.1f ms' % (
+        total, duration, total / duration, sum(items), statistics.mean(every_latency) * 1000))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dois', type=int, default=1000, help='DOIs the API serves')
+    parser.add_argument('--size', choices=['small', 'typical', 'large', 'huge'],
+                        default='typical', help='size of each DOI record')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the API takes to answer each request')
+    parser.add_argument('--harvesters', type=int, default=4, help='concurrent harvesters')
+    parser.add_argument('--harvests', type=int, default=1, help='harvests by each harvester')
+    parser.add_argument('--metadata-prefix', default='oai_dc')
+    parser.add_argument('--verb', choices=['ListRecords', 'ListIdentifiers'], default='ListRecords')
+    parser.add_argument('--single-requests', type=int, default=20,
+                        help='requests of each other verb by each harvester')
+    arguments = parser.parse_args()
+
+    print(report(*run(
+        dois=arguments.dois,
+        size=arguments.size,
+        latency=arguments.latency,
+        harvesters=arguments.harvesters,
+        harvests=arguments.harvests,
+        metadata_prefix=arguments.metadata_prefix,
+        verb=arguments.verb,
+        single_requests=arguments.single_requests
+    )))
+
+
+if __name__ == '__main__':
+    main()
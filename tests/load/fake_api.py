@@ -0,0 +1,168 @@
+"""Local stand-in for the DataCite API, for load tests that mustn't reach api.datacite.org
+
+DOIs are generated from a recorded record of the chosen size, spread over
+the clients of a recorded /clients response, and paged with cursors the way
+api_get_cursor reads them. Every response can be delayed to simulate the
+latency of the real API.
+
+Only the parts of the API viringo uses are served. Searches, including the
+updated range of from and until, are ignored.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from tests.benchmarks import records
+
+CLIENTS_FIXTURE = 'tests/integration/fixtures/datacite_api_clients.json'
+# Updated time of the first generated DOI, the others follow a second apart
+FIRST_UPDATED = datetime(2019, 1, 1)
+DOI_PREFIX = '10.5072/load-'
+
+
+class FakeDataCiteAPI:
+    """A DataCite API serving a number of generated DOIs over HTTP"""
+
+    def __init__(self, dois=1000, size='typical', latency=0.0):
+        self.dois = dois
+        self.latency = latency
+        self.template = records.load_entry(size)
+
+        with open(CLIENTS_FIXTURE) as json_file:
+            self.clients = json.load(json_file)
+        # Every client is on the one page
+        self.clients.pop('links', None)
+        self.client_ids = [client['id'] for client in self.clients['data']]
+
+        self.requests = 0
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    def entry(self, index, fields=None, detail=True):
+        """The json-api entry of the generated DOI at index"""
+        client_id = self.client_ids[index % len(self.client_ids)]
+        attributes = dict(self.template['attributes'])
+        attributes['doi'] = doi_at(index)
+        attributes['updated'] = (FIRST_UPDATED + timedelta(seconds=index)).isoformat() + 'Z'
+
+        if fields is not None:
+            attributes = {name: value for name, value in attributes.items() if name in fields}
+        if not detail:
+            attributes.pop('xml', None)
+
+        return {
+            'id': doi_at(index),
+            'type': 'dois',
+            'attributes': attributes,
+            'relationships': {
+                'client': {'data': {'id': client_id, 'type': 'clients'}},
+                'provider': {'data': {'id': client_id.split('.')[0], 'type': 'providers'}},
+            }
+        }
+
+    def matching(self, client_id=None, provider_id=None):
+        """Indexes of the DOIs of a client or provider, in updated order"""
+        if client_id:
+            return [
+                index for index in range(self.dois)
+                if self.client_ids[index % len(self.client_ids)] == client_id.lower()
+            ]
+        if provider_id:
+            return [
+                index for index in range(self.dois)
+                if self.client_ids[index % len(self.client_ids)].split('.')[0] == provider_id.lower()
+            ]
+        return range(self.dois)
+
+    def create_app(self):
+        """The Flask app serving the API"""
+        app = Flask(__name__)
+
+        @app.before_request
+        def delay():
+            self.requests += 1
+            if self.latency:
+                time.sleep(self.latency)
+
+        @app.route('/dois')
+        def dois():
+            indexes = self.matching(
+                request.args.get('client_id'), request.args.get('provider_id'))
+            page_size = int(request.args.get('page[size]', 25))
+            # The first page is asked for with a cursor of 1
+            cursor = request.args.get('page[cursor]', '1')
+            start = 0 if cursor == '1' else int(cursor.split('-', 1)[1])
+
+            fields = request.args.get('fields[dois]')
+            fields = fields.split(',') if fields else None
+            # As strict as the API may be, any detail value asks for detail
+            detail = 'detail' in request.args
+
+            page = indexes[start:start + page_size]
+            response = {
+                'data': [self.entry(index, fields, detail) for index in page],
+                'meta': {'total': len(indexes)},
+                'links': {},
+            }
+            if start + page_size < len(indexes):
+                response['links']['next'] = '%s/dois?page[cursor]=offset-%d&page[size]=%d' % (
+                    self.url, start + page_size, page_size)
+
+            return jsonify(response)
+
+        @app.route('/dois/<path:doi>')
+        def doi(doi):
+            index = index_of(doi)
+            if index is None or index >= self.dois:
+                return jsonify({'errors': [{'status': '404', 'title': 'Not found'}]}), 404
+            return jsonify({'data': self.entry(index)})
+
+        @app.route('/clients')
+        def clients():
+            return jsonify(self.clients)
+
+        return app
+
+    def start(self):
+        """Serve the API on a free local port from a background thread"""
+        self._server = make_server(
+            '127.0.0.1', 0, self.create_app(), threaded=True, request_handler=QuietRequestHandler)
+        self.url = 'http://127.0.0.1:%d' % self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Leaves requests unlogged, a load test makes far too many"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def doi_at(index):
+    return DOI_PREFIX + str(index)
+
+
+def index_of(doi):
+    """The index of a generated DOI, None for any other DOI"""
+    number = doi.lower()[len(DOI_PREFIX):]
+    if not doi.lower().startswith(DOI_PREFIX) or not number.isdigit():
+        return None
+    return int(number)
@@ -0,0 +1,32 @@
+"""Load tests through the Flask app against the local API stand-in"""
+
+import pytest
+import requests
+
+from . import driver
+from .fake_api import FakeDataCiteAPI
+
+def test_fake_api_cursor_paging():
+    """Test the stand-in pages DOIs with cursors the way the service reads them"""
+    with FakeDataCiteAPI(dois=30) as api:
+        first = requests.get(api.url + '/dois', params={'page[size]': 20, 'page[cursor]': 1}).json()
+        assert first['meta']['total'] == 30
+        assert len(first['data']) == 20
+
+        second = requests.get(first['links']['next']).json()
+        assert len(second['data']) == 10
+        assert 'next' not in second['links']
+
+        assert requests.get(api.url + '/dois/10.5072/load-29').status_code == 200
+        assert requests.get(api.url + '/dois/10.5072/load-30').status_code == 404
+
+@pytest.mark.load
+@pytest.mark.parametrize('verb', ['ListRecords', 'ListIdentifiers'])
+def test_full_harvest(verb):
+    """Test concurrent harvests walk every DOI through their resumption tokens"""
+    timings, items, _ = driver.run(
+        dois=120, harvesters=2, harvests=1, verb=verb, single_requests=2)
+
+    assert items == [120, 120]
+    assert len(timings.latencies[verb]) == 2 * 3
+    assert len(timings.latencies['GetRecord']) == 2 * 2
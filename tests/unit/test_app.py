@@ -0,0 +1,23 @@
+"""Unit tests for creating the application"""
+
+import viringo
+
+
+def test_sentry_skipped_without_dsn(mocker):
+    """Test Sentry is not initialised when no DSN is set"""
+    mocker.patch('viringo.config.SENTRY_DSN', None)
+    mocked_init = mocker.patch('sentry_sdk.init')
+
+    viringo.create_app({'TESTING': True})
+
+    mocked_init.assert_not_called()
+
+def test_sentry_initialised_with_dsn(mocker):
+    """Test Sentry is initialised as the application is created when a DSN is set"""
+    mocker.patch('viringo.config.SENTRY_DSN', 'https://key@sentry.example.org/1')
+    mocked_init = mocker.patch('sentry_sdk.init')
+
+    viringo.create_app({'TESTING': True})
+
+    mocked_init.assert_called_once()
+    assert mocked_init.call_args.kwargs['dsn'] == 'https://key@sentry.example.org/1'
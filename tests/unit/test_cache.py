@@ -0,0 +1,66 @@
+"""Unit tests for the bounded caches"""
+
+from viringo.cache import LRUCache
+
+def test_lru_cache_get_set():
+    """Test values are returned and counted as hits or misses"""
+    cache = LRUCache(max_entries=2)
+
+    cache.set('a', 1)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.stats.as_dict() == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+def test_lru_cache_evicts_least_recently_used():
+    """Test the least recently used entry is evicted when full"""
+    cache = LRUCache(max_entries=2)
+
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert cache.stats.evictions == 1
+
+def test_lru_cache_evicts_by_size():
+    """Test entries are evicted to keep within the byte budget"""
+    cache = LRUCache(max_entries=10, max_bytes=10, sizeof=len)
+
+    cache.set('a', 'xxxx')
+    cache.set('b', 'xxxx')
+    cache.set('c', 'xxxx')
+
+    assert 'a' not in cache
+    assert len(cache) == 2
+    assert cache.size == 8
+
+def test_lru_cache_skips_oversized_values():
+    """Test a value larger than the whole budget is not stored"""
+    cache = LRUCache(max_entries=10, max_bytes=10, sizeof=len)
+
+    cache.set('a', 'x' * 11)
+
+    assert 'a' not in cache
+    assert cache.size == 0
+
+def test_lru_cache_replace_updates_size():
+    """Test replacing a value accounts for the new size only"""
+    cache = LRUCache(max_entries=10, max_bytes=100, sizeof=len)
+
+    cache.set('a', 'xxxx')
+    cache.set('a', 'xx')
+
+    assert cache.size == 2
+    assert cache.get('a') == 'xx'
+
+def test_lru_cache_disabled():
+    """Test a cache without entries stores nothing"""
+    cache = LRUCache(max_entries=0)
+
+    cache.set('a', 1)
+
+    assert cache.get('a') is None
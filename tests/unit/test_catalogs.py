@@ -1,7 +1,11 @@
 """Unit tests for the OAI-PMH DataCite Catalog implementation"""
 
+import asyncio
+import inspect
+
 import pytest
 from viringo import catalogs
+from tests.integration import factories
 
 def test_set_to_search_query():
     """Test for parsing a search query from a set"""
@@ -98,3 +102,24 @@ def test_none_type_identifier_to_string():
         identifier_string = catalogs.identifier_to_string(identifier_type)
     assert exc.type == catalogs.InvalidIdentifierException
 
+
+def test_async_backend_builds_same_response(mocker):
+    """Test a coroutine backend gets an awaitable of the blocking backend's response"""
+    page = [factories.MetadataFactory()], 1, None
+
+    async def get_metadata_list(**kwargs):
+        return page
+
+    blocking = catalogs.DataCiteOAIServer(backend=mocker.Mock(
+        get_metadata_list=mocker.Mock(return_value=page)))
+    awaiting = catalogs.DataCiteOAIServer(backend=mocker.Mock(
+        get_metadata_list=get_metadata_list))
+
+    expected = blocking.listIdentifiers(metadataPrefix='oai_dc')
+    result = awaiting.listIdentifiers(metadataPrefix='oai_dc')
+
+    assert inspect.isawaitable(result)
+    headers, total_records, paging_cursor = asyncio.run(result)
+    assert [header.identifier() for header in headers] == [
+        header.identifier() for header in expected[0]]
+    assert (total_records, paging_cursor) == expected[1:]
@@ -0,0 +1,72 @@
+"""Unit tests for the rendered metadata fragment cache"""
+
+import datetime
+import os
+
+from viringo.fragments import DiskTier, FragmentCache
+
+UPDATED = datetime.datetime(2019, 1, 2, 3, 4, 5)
+
+def test_key_includes_record_version_and_format():
+    """Test a new updated time or another format never shares a fragment"""
+    key = FragmentCache.key('10.5072/a', UPDATED, 'oai_dc')
+
+    assert key != FragmentCache.key('10.5072/a', UPDATED + datetime.timedelta(seconds=1), 'oai_dc')
+    assert key != FragmentCache.key('10.5072/a', UPDATED, 'datacite')
+    assert key != FragmentCache.key('10.5072/b', UPDATED, 'oai_dc')
+
+def test_memory_only():
+    """Test fragments are served from memory without a directory"""
+    cache = FragmentCache(max_entries=2, max_bytes=1024)
+    cache.set('a', b'<a/>')
+
+    assert cache.disk is None
+    assert cache.get('a') == b'<a/>'
+    assert cache.get('b') is None
+    assert cache.stats() == {'memory': {'hits': 1, 'misses': 1, 'evictions': 0}}
+
+def test_disk_tier_fills_memory(tmp_path):
+    """Test fragments evicted from memory are still found on disk"""
+    cache = FragmentCache(max_entries=1, max_bytes=1024, directory=str(tmp_path), disk_max_bytes=1024)
+    cache.set('a', b'<a/>')
+    cache.set('b', b'<b/>')
+
+    assert 'a' not in cache.memory
+    assert cache.get('a') == b'<a/>'
+    assert 'a' in cache.memory
+    assert cache.stats()['disk']['hits'] == 1
+
+def test_disk_tier_evicts_oldest(tmp_path):
+    """Test the disk tier removes the least recently used fragments when full"""
+    disk = DiskTier(str(tmp_path), max_bytes=250)
+    for number in range(3):
+        disk.set(str(number), b'x' * 100)
+        # Make the write order visible to the modified times
+        os.utime(disk.path(str(number)), (number, number))
+
+    # Eviction leaves the tier under 90% of its limit
+    assert disk.get('0') is None
+    assert disk.get('1') == b'x' * 100
+    assert disk.get('2') == b'x' * 100
+    assert disk.stats.evictions == 1
+    assert disk.measure() == 200
+
+def test_disk_tier_counts_other_workers(tmp_path):
+    """Test fragments other workers store are counted once the size is measured again"""
+    now = [1000.0]
+    disk = DiskTier(str(tmp_path), max_bytes=250, measure_interval=60, clock=lambda: now[0])
+    # Stands in for other workers, whose own writes keep them under the limit
+    other_workers = DiskTier(str(tmp_path), max_bytes=10000)
+
+    disk.set('0', b'x' * 100)
+    other_workers.set('1', b'x' * 100)
+    other_workers.set('2', b'x' * 100)
+    disk.set('3', b'x' * 10)
+    assert disk.stats.evictions == 0
+
+    # Once the interval has passed the next write sees the whole directory
+    now[0] += 61
+    disk.set('4', b'x' * 10)
+
+    assert disk.stats.evictions > 0
+    assert disk.measure() <= 250 * 0.9
@@ -0,0 +1,114 @@
+"""Unit tests for the metrics registry and its exposition"""
+
+import json
+import os
+
+from viringo import metrics
+
+def test_histogram_buckets_are_cumulative():
+    """Test histogram samples count every value at or below each bound"""
+    registry = metrics.Registry()
+    registry.observe('viringo_page_records', {'verb': 'ListRecords'}, 0)
+    registry.observe('viringo_page_records', {'verb': 'ListRecords'}, 50)
+    registry.observe('viringo_page_records', {'verb': 'ListRecords'}, 5000)
+
+    text = metrics.render(registry.snapshot())
+
+    assert '# TYPE viringo_page_records histogram' in text
+    assert 'viringo_page_records_bucket{le="0",verb="ListRecords"} 1' in text
+    assert 'viringo_page_records_bucket{le="50",verb="ListRecords"} 2' in text
+    assert 'viringo_page_records_bucket{le="+Inf",verb="ListRecords"} 3' in text
+    assert 'viringo_page_records_sum{verb="ListRecords"} 5050.0' in text
+    assert 'viringo_page_records_count{verb="ListRecords"} 3' in text
+
+def test_histogram_buckets_in_order():
+    """Test each histogram series lists its buckets in increasing order, then its sum and count"""
+    registry = metrics.Registry()
+    registry.observe('viringo_page_records', {'verb': 'ListSets'}, 1)
+    registry.observe('viringo_page_records', {'verb': 'ListRecords'}, 1)
+
+    lines = [
+        line for line in metrics.render(registry.snapshot()).splitlines()
+        if line.startswith('viringo_page_records')
+    ]
+
+    bounds = [str(bound) for bound in metrics.RECORD_BUCKETS] + ['+Inf']
+    expected = []
+    for verb in ['ListRecords', 'ListSets']:
+        expected += ['viringo_page_records_bucket{le="%s",verb="%s"}' % (bound, verb)
+                     for bound in bounds]
+        expected += ['viringo_page_records_sum{verb="%s"}' % verb,
+                     'viringo_page_records_count{verb="%s"}' % verb]
+    assert [line.split(' ')[0] for line in lines] == expected
+
+def test_counter_labels_are_escaped():
+    """Test label values can't break the exposition format"""
+    registry = metrics.Registry()
+    registry.inc('viringo_upstream_responses_total', {'endpoint': 'a"b\\c', 'status': '200'})
+
+    assert 'viringo_upstream_responses_total{endpoint="a\\"b\\\\c",status="200"} 1' in \
+        metrics.render(registry.snapshot())
+
+def test_upstream_endpoint(mocker):
+    """Test API urls are labelled by endpoint without the DOI"""
+    mocker.patch('viringo.config.DATACITE_API_URL', 'https://api.test')
+
+    assert metrics.upstream_endpoint('https://api.test/dois') == '/dois'
+    assert metrics.upstream_endpoint('https://api.test/dois/10.5072/abc') == '/dois/{id}'
+    assert metrics.upstream_endpoint('https://api.test/clients?page[number]=2') == '/clients'
+    assert metrics.upstream_endpoint('https://api.test/providers') == 'other'
+
+def test_collect_sums_workers(tmp_path, mocker):
+    """Test the counts of every worker are summed, keeping those of exited workers"""
+    mocker.patch('viringo.config.METRICS_DIR', str(tmp_path))
+    mocker.patch('viringo.metrics.CACHES', {})
+    mocker.patch('viringo.metrics.registry', metrics.Registry())
+    metrics.registry.inc('viringo_upstream_responses_total', {'endpoint': '/dois', 'status': '200'})
+
+    other_worker = {
+        'counters': [['viringo_upstream_responses_total', {'endpoint': '/dois', 'status': '200'}, 2]],
+        'histograms': [],
+    }
+    # A pid above the kernel's limit can't belong to a running worker
+    exited_path = tmp_path / 'worker-99999999.json'
+    exited_path.write_text(json.dumps(other_worker))
+
+    snapshot = metrics.collect()
+    assert snapshot['counters'] == [
+        ['viringo_upstream_responses_total', {'endpoint': '/dois', 'status': '200'}, 3]]
+
+    # The exited worker's counts are kept once its file is gone
+    assert not exited_path.exists()
+    assert os.path.exists(tmp_path / metrics.ARCHIVE_FILE)
+    assert metrics.collect()['counters'][0][2] == 3
+
+def test_flush_writes_held_back_counts(tmp_path, mocker):
+    """Test counts made within the flush interval are written once it has passed"""
+    mocker.patch('viringo.config.METRICS_DIR', str(tmp_path))
+    mocker.patch('viringo.config.METRICS_FLUSH_INTERVAL', 0.1)
+    mocker.patch('viringo.metrics.CACHES', {})
+    mocker.patch('viringo.metrics.registry', metrics.Registry())
+    mocker.patch.dict('viringo.metrics._FLUSHED_AT', {'time': 0.0})
+    mocker.patch.dict('viringo.metrics._PENDING_FLUSH', {'timer': None, 'pid': None})
+    path = metrics.worker_path(os.getpid())
+
+    metrics.flush()
+    metrics.registry.inc('viringo_upstream_responses_total', {'endpoint': '/dois', 'status': '200'})
+    metrics.flush()
+    metrics.flush()
+    assert metrics.read_json(path)['counters'] == []
+
+    metrics._PENDING_FLUSH['timer'].join()
+    assert metrics.read_json(path)['counters'][0][2] == 1
+
+def test_count_bytes_closes_stream(mocker):
+    """Test closing a counted stream early closes the stream it wraps"""
+    chunks = mocker.MagicMock()
+    chunks.__iter__.return_value = iter([b'ab', b'c'])
+    sent = [0]
+    counted = metrics.count_bytes(chunks, sent)
+
+    assert next(counted) == b'ab'
+    counted.close()
+    assert sent == [2]
+    chunks.close.assert_called_once_with()
@@ -1,5 +1,10 @@
+import threading
+
 import oaipmh.server
 
+from viringo import oai
+from tests.integration import factories
+
 
 def test_decode_resumption_token_raises_no_error():
     EXAMPLE_RESUMPTION = "metadataPrefix%3Ddatacite%26set%3DSND.BOLIN%26paging_cursor%3DMTU4NTU2NDkxMTAwMCwxMC4xNzA0My9zd2VydXMtMjAxNC1kMTNj%26cursor%3D1"
@@ -9,3 +14,47 @@ def test_decode_resumption_token_raises_no_error():
         assert False, f"DecodingResumptionToken raised an exception {exc}"
 
 
+
+
+def test_chunk_buffer_drain():
+    buffer = oai.ChunkBuffer()
+    buffer.write(b'<a>')
+    buffer.write(b'</a>')
+
+    assert len(buffer) == 7
+    assert buffer.drain() == b'<a></a>'
+    assert len(buffer) == 0
+    assert buffer.drain() == b''
+
+
+def test_shared_server_validators_per_request(mocker):
+    """Test requests handled at once by one server each get their own validators"""
+    both_handling = threading.Barrier(2, timeout=5)
+
+    def get_metadata(doi):
+        both_handling.wait()
+        return factories.MetadataFactory(identifier=doi) if doi.endswith('found') else None
+
+    mocker.patch('viringo.services.datacite.get_metadata', side_effect=get_metadata)
+    server = oai.build_oai_server('/static')
+    results = {}
+
+    def handle(doi):
+        results[doi] = server.handle({
+            'verb': 'GetRecord', 'metadataPrefix': 'datacite', 'identifier': 'doi:' + doi})
+
+    threads = [
+        threading.Thread(target=handle, args=(doi,))
+        for doi in ['10.5072/found', '10.5072/missing']
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    found_xml, found_validators = results['10.5072/found']
+    missing_xml, missing_validators = results['10.5072/missing']
+    assert b'idDoesNotExist' not in found_xml
+    assert found_validators is not None
+    assert b'idDoesNotExist' in missing_xml
+    assert missing_validators is None
@@ -0,0 +1,112 @@
+"""Unit tests for resumption sessions"""
+
+import os
+
+from viringo.resumption import SessionStore, make_token, session_id_of
+
+PAGE = (['record'], 1, None)
+
+def make_store(**kwargs):
+    options = {'ttl': 60, 'max_entries': 10, 'max_bytes': None, 'workers': 1}
+    options.update(kwargs)
+    return SessionStore(**options)
+
+def test_session_id_of():
+    """Test session tokens are told apart from stateless tokens"""
+    assert session_id_of(make_token('abc')) == 'abc'
+    assert session_id_of('metadataPrefix%3Doai_dc') is None
+
+def test_take_prefetched_page():
+    """Test a session token is answered with its prefetched page, once"""
+    store = make_store()
+    token = store.start('ListRecords', 'stateless', lambda: PAGE)
+
+    assert store.resolve(token) == 'stateless'
+    assert store.take(token, 'ListRecords') == PAGE
+    assert store.take(token, 'ListRecords') is None
+
+def test_take_stateless_token():
+    """Test stateless tokens are left to be fetched"""
+    assert make_store().take('stateless', 'ListRecords') is None
+
+def test_take_other_verb():
+    """Test a page is only used for the verb it was prefetched for"""
+    store = make_store()
+    token = store.start('ListRecords', 'stateless', lambda: PAGE)
+
+    assert store.take(token, 'ListIdentifiers') is None
+
+def test_take_expired():
+    """Test pages aren't used once the session has expired"""
+    now = [0]
+    store = make_store(clock=lambda: now[0])
+    token = store.start('ListRecords', 'stateless', lambda: PAGE)
+
+    now[0] = 61
+    assert store.take(token, 'ListRecords') is None
+
+def test_take_failed_prefetch():
+    """Test a failed prefetch leaves the page to be fetched again"""
+    def fail():
+        raise ValueError("API unavailable")
+
+    store = make_store()
+    token = store.start('ListRecords', 'stateless', fail)
+
+    assert store.take(token, 'ListRecords') is None
+
+def test_memory_cap_evicts_oldest(mocker):
+    """Test the oldest sessions are evicted when over the size limit"""
+    mocker.patch('viringo.resumption.page_size_estimate', return_value=100)
+    store = make_store(max_bytes=250)
+    first = store.start('ListRecords', 'first', lambda: PAGE)
+    second = store.start('ListRecords', 'second', lambda: PAGE)
+    third = store.start('ListRecords', 'third', lambda: PAGE)
+
+    assert store.stats.evictions == 1
+    assert store.take(first, 'ListRecords') is None
+    assert store.take(second, 'ListRecords') == PAGE
+    assert store.take(third, 'ListRecords') == PAGE
+
+def test_directory_shared_between_workers(tmp_path):
+    """Test a page prefetched by one worker is found by another"""
+    worker = make_store(directory=str(tmp_path))
+    other_worker = make_store(directory=str(tmp_path))
+
+    token = worker.start('ListRecords', 'stateless', lambda: PAGE)
+    # Waits for the prefetch, leaving the page on disk
+    worker.get_executor().shutdown(wait=True)
+
+    assert other_worker.take(token, 'ListRecords') == PAGE
+    assert other_worker.take(token, 'ListRecords') is None
+
+def test_directory_tokens_are_opaque(tmp_path):
+    """Test session tokens are just the session id given a shared directory"""
+    worker = make_store(directory=str(tmp_path))
+    other_worker = make_store(directory=str(tmp_path))
+
+    token = worker.start('ListRecords', 'stateless', lambda: PAGE)
+    worker.get_executor().shutdown(wait=True)
+
+    assert token == make_token(session_id_of(token))
+    assert worker.resolve(token) == 'stateless'
+    assert other_worker.resolve(token) == 'stateless'
+
+    # The token can still be resumed once its page has been used
+    assert other_worker.take(token, 'ListRecords') == PAGE
+    assert other_worker.take(token, 'ListRecords') is None
+    assert other_worker.resolve(token) == 'stateless'
+
+def test_resolve_unknown_session(tmp_path):
+    """Test session tokens are unknown once they expire"""
+    store = make_store(directory=str(tmp_path), token_ttl=120)
+    token = store.start('ListRecords', 'stateless', lambda: PAGE)
+    store.clear()
+
+    assert store.resolve(make_token('unknown')) is None
+    assert store.resolve(token) == 'stateless'
+
+    for path in tmp_path.iterdir():
+        os.utime(path, (0, 0))
+    assert store.resolve(token) is None
+    assert store.take(token, 'ListRecords') is None
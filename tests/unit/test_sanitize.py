@@ -0,0 +1,49 @@
+"""Unit tests for removing characters not allowed in XML"""
+
+from lxml import etree
+
+from viringo import sanitize
+
+def test_clean_text_returns_clean_values_unchanged():
+    """Test valid values are returned as the same object"""
+    for value in [
+            'A plain title',
+            'Tabs\tand\nnew lines\r',
+            'Überprüfung der Daten – résumé',
+            '日本語のタイトル 🙂',
+    ]:
+        assert sanitize.clean_text(value) is value
+
+def test_clean_text_removes_invalid_characters():
+    """Test control characters, surrogates and non-characters are removed"""
+    assert sanitize.clean_text('bad\x00\x0bcontrol\x1f') == 'badcontrol'
+    assert sanitize.clean_text('lone \ud800surrogate') == 'lone surrogate'
+    assert sanitize.clean_text('non￾￿characters') == 'noncharacters'
+    assert sanitize.clean_text('Grüße\x0c') == 'Grüße'
+
+def test_clean_xml_bytes():
+    """Test raw UTF-8 xml has the same characters removed"""
+    clean = '<title>Grüße 🙂</title>'.encode('utf-8')
+    assert sanitize.clean_xml(clean) is clean
+
+    dirty = '<title>Grüße\x0b</title>'.encode('utf-8') + b'\xef\xbf\xbe'
+    assert sanitize.clean_xml(dirty) == '<title>Grüße</title>'.encode('utf-8')
+
+def test_clean_xml_string():
+    """Test raw xml given as a string is cleaned as text"""
+    assert sanitize.clean_xml('<title>bad\x08</title>') == '<title>bad</title>'
+
+def test_clean_xml_other_encodings_unchanged():
+    """Test documents that aren't UTF-8 bytes are left to the parser"""
+    utf16 = '<?xml version="1.0" encoding="UTF-16"?><title>Grüße</title>'.encode('utf-16')
+    assert sanitize.clean_xml(utf16) is utf16
+    assert etree.fromstring(sanitize.clean_xml(utf16)).text == 'Grüße'
+
+    utf16_no_bom = '<title>Grüße</title>'.encode('utf-16-le')
+    assert sanitize.clean_xml(utf16_no_bom) is utf16_no_bom
+
+    latin1 = '<?xml version="1.0" encoding="ISO-8859-1"?><title>Grüße\x0b</title>'.encode('latin-1')
+    assert sanitize.clean_xml(latin1) is latin1
+
+    declared = b'<?xml version="1.0" encoding="utf-8"?><title>bad\x08</title>'
+    assert sanitize.clean_xml(declared) == b'<?xml version="1.0" encoding="utf-8"?><title>bad</title>'
@@ -1,5 +1,13 @@
 """Unit tests for the DataCite service"""
 
+import base64
+import binascii
+import datetime
+import threading
+import time
+import pytest
+import viringo.config
+from viringo import metrics
 from viringo.services import datacite
 
 def test_strip_uri_prefix():
@@ -51,3 +59,228 @@ def test_skip_invlaid_identifiers():
             'identifier': 'XXXXX'
         }
     ]
+
+def test_session_is_reused():
+    """Test the same pooled session is returned for every api call"""
+    datacite.close_session()
+
+    session = datacite.get_session()
+    assert datacite.get_session() is session
+
+    adapter = session.get_adapter(viringo.config.DATACITE_API_URL)
+    assert adapter._pool_maxsize == viringo.config.DATACITE_API_POOL_MAXSIZE
+
+    datacite.close_session()
+    assert datacite.get_session() is not session
+
+def test_session_is_recreated_after_fork(mocker):
+    """Test a forked worker does not reuse the session of its parent"""
+    datacite.close_session()
+    session = datacite.get_session()
+
+    mocker.patch('viringo.utils.os.getpid', return_value=-1)
+    assert datacite.get_session() is not session
+
+def test_parse_sets_removes_duplicates():
+    """Test providers included on several /clients pages are listed once"""
+    provider = {'id': 'datacite', 'attributes': {'name': 'DataCite'}}
+    pages = [
+        {
+            'data': [{'id': 'datacite.b', 'attributes': {'name': 'B'}}],
+            'included': [provider]
+        },
+        {
+            'data': [{'id': 'datacite.a', 'attributes': {'name': 'A'}}],
+            'included': [provider]
+        },
+    ]
+
+    results, total = datacite.parse_sets(pages)
+
+    assert results == [
+        ('datacite', 'DataCite'),
+        ('datacite.a', 'A'),
+        ('datacite.b', 'B')
+    ]
+    assert total == 3
+
+def test_sets_params_updated_since():
+    """Test incremental set requests filter clients by updated time"""
+    params = datacite.sets_params(datetime.datetime(2020, 1, 2, 3, 4, 5))
+
+    assert params['query'] == 'updated:[2020-01-02T03:04:05Z+TO+*]'
+    assert 'query' not in datacite.sets_params()
+
+def test_metadata_list_params_fields():
+    """Test only the requested fields are asked for"""
+    params = datacite.metadata_list_params(fields=('updated', 'client'))
+
+    assert params['fields[dois]'] == 'updated,client'
+    assert 'detail' not in params
+
+    params = datacite.metadata_list_params(fields=('updated', 'xml'))
+    assert params['detail'] is True
+
+    params = datacite.metadata_list_params()
+    assert 'fields[dois]' not in params
+    assert params['detail'] is True
+
+def test_build_metadata_projected():
+    """Test metadata can be built from a header only projection"""
+    result = datacite.build_metadata({
+        'id': '10.5072/projected',
+        'attributes': {
+            'updated': '2019-01-02T03:04:05.000Z',
+            'isActive': True
+        },
+        'relationships': {
+            'client': {'data': {'id': 'datacite.datacite'}},
+            'provider': {'data': {'id': 'datacite'}}
+        }
+    })
+
+    assert result.identifier == '10.5072/projected'
+    assert result.updated_datetime == datetime.datetime(2019, 1, 2, 3, 4, 5)
+    assert result.client == 'DATACITE.DATACITE'
+    assert result.active
+    assert result.xml is None
+    assert not result.resource_types
+
+def test_build_metadata_is_lazy():
+    """Test fields are only parsed when they are read"""
+    result = datacite.build_metadata({
+        'id': '10.5072/lazy',
+        'attributes': {
+            'updated': '2019-01-02T03:04:05Z',
+            'isActive': True,
+            'xml': 'not base64!',
+            'titles': None
+        },
+        'relationships': {
+            'client': {'data': {'id': 'datacite.datacite'}},
+            'provider': {'data': {'id': 'datacite'}}
+        }
+    })
+
+    # Header fields never need the xml or the other attributes
+    assert result.identifier == '10.5072/lazy'
+    assert result.updated_datetime == datetime.datetime(2019, 1, 2, 3, 4, 5)
+    assert result.provider == 'DATACITE'
+    assert result.active
+
+    with pytest.raises(binascii.Error):
+        result.xml
+
+    with pytest.raises(AttributeError):
+        result.not_a_field
+
+def test_in_flight_shares_result():
+    """Test callers with the same key while a call is in flight share it"""
+    in_flight = datacite.InFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def call():
+        calls.append(1)
+        release.wait(5)
+        return 'result'
+
+    threads = [
+        threading.Thread(target=lambda: results.append(in_flight.call('key', call)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    while in_flight.coalesced < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ['result'] * 4
+
+    # Once done, the next call with the key is made again
+    assert in_flight.call('key', lambda: 'again') == 'again'
+
+def test_in_flight_shares_error():
+    """Test callers waiting on a failed call get its exception"""
+    in_flight = datacite.InFlight()
+    release = threading.Event()
+    errors = []
+
+    def call():
+        release.wait(5)
+        raise ValueError('upstream failed')
+
+    def caller():
+        try:
+            in_flight.call('key', call)
+        except ValueError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=caller) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while in_flight.coalesced < 1:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+
+def test_api_call_get_coalesces(mocker):
+    """Test identical concurrent API calls make one request and parse its JSON once"""
+    release = threading.Event()
+    parse = mocker.Mock(return_value={'data': []})
+
+    def get(*args, **kwargs):
+        release.wait(5)
+        return mocker.Mock(status_code=200, json=parse)
+
+    session_get = mocker.patch(
+        'viringo.services.datacite.requests.Session.get', side_effect=get)
+    mocker.patch.object(datacite, 'in_flight', datacite.InFlight())
+    results = []
+
+    def caller(params):
+        results.append(datacite.api_call_get(
+            viringo.config.DATACITE_API_URL + '/dois', params=params).json())
+
+    threads = [threading.Thread(target=caller, args=({'query': 'same'},)) for _ in range(3)]
+    threads.append(threading.Thread(target=caller, args=({'query': 'other'},)))
+    for thread in threads:
+        thread.start()
+    while datacite.in_flight.coalesced < 2 or session_get.call_count < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert session_get.call_count == 2
+    assert results == [{'data': []}] * 4
+    assert parse.call_count == 2
+    assert metrics.registry.counters[
+        ('viringo_upstream_coalesced_total', (('endpoint', '/dois'),))] == 2
+
+def test_record_size_from_entry():
+    """Test a cached record's size counts its whole entry without parsing it"""
+    xml = base64.b64encode(b'<resource>' + b'x' * 3000 + b'</resource>').decode('ascii')
+    result = datacite.build_metadata({
+        'id': '10.5072/sized',
+        'attributes': {
+            'xml': xml,
+            'titles': [{'title': 'y' * 1000}],
+        },
+    })
+
+    size = datacite.record_size(datacite.CachedRecord(result))
+
+    assert size > len(xml) + 3000 + 2 * 1000
+    # Nothing was parsed or decoded to measure it
+    for field in ['xml', 'titles']:
+        with pytest.raises(AttributeError):
+            getattr(datacite.Metadata, field).__get__(result, datacite.Metadata)
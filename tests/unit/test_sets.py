@@ -0,0 +1,145 @@
+"""Unit tests for the cached set catalogue"""
+
+from viringo.services import sets
+
+class FakeClock:
+    """Controllable replacement for time.monotonic"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def build_catalogue(clock):
+    return sets.SetCatalogue(
+        ttl=60,
+        max_stale=600,
+        full_refresh_interval=3600,
+        clock=clock
+    )
+
+def test_cold_catalogue_loads_synchronously(mocker):
+    """Test the first request waits for the full set list"""
+    mocked_get_sets = mocker.patch('viringo.services.datacite_async.get_sets')
+    mocked_get_sets.return_value = [('datacite.b', 'B'), ('datacite', 'DataCite')], 2
+
+    catalogue = build_catalogue(FakeClock())
+    results, total = catalogue.get()
+
+    assert results == [('datacite', 'DataCite'), ('datacite.b', 'B')]
+    assert total == 2
+    mocked_get_sets.assert_called_once_with()
+
+def test_fresh_catalogue_served_from_memory(mocker):
+    """Test paging through a fresh catalogue makes no further upstream calls"""
+    mocked_get_sets = mocker.patch('viringo.services.datacite_async.get_sets')
+    mocked_get_sets.return_value = [('datacite', 'DataCite')], 1
+
+    clock = FakeClock()
+    catalogue = build_catalogue(clock)
+    catalogue.get()
+    clock.now += 30
+    catalogue.get()
+    catalogue.get()
+
+    assert mocked_get_sets.call_count == 1
+
+def test_stale_catalogue_refreshes_in_background(mocker):
+    """Test a stale catalogue is still served while a refresh is started"""
+    mocked_get_sets = mocker.patch('viringo.services.datacite_async.get_sets')
+    mocked_get_sets.return_value = [('datacite', 'DataCite')], 1
+    mocked_background = mocker.patch.object(sets.SetCatalogue, 'refresh_in_background')
+
+    clock = FakeClock()
+    catalogue = build_catalogue(clock)
+    catalogue.get()
+    clock.now += 120
+    results, _ = catalogue.get()
+
+    assert results == [('datacite', 'DataCite')]
+    assert mocked_get_sets.call_count == 1
+    mocked_background.assert_called_once_with()
+
+def test_expired_catalogue_loads_synchronously(mocker):
+    """Test a catalogue older than the max stale age is not served"""
+    mocked_get_sets = mocker.patch('viringo.services.datacite_async.get_sets')
+    mocked_get_sets.return_value = [('datacite', 'DataCite')], 1
+
+    clock = FakeClock()
+    catalogue = build_catalogue(clock)
+    catalogue.get()
+    clock.now += 601
+    catalogue.get()
+
+    assert mocked_get_sets.call_count == 2
+
+def test_refresh_is_incremental(mocker):
+    """Test refreshes after a recent full load only ask for updated clients"""
+    mocked_get_sets = mocker.patch('viringo.services.datacite_async.get_sets')
+    mocked_get_sets.return_value = [('datacite', 'DataCite'), ('datacite.a', 'A')], 2
+
+    clock = FakeClock()
+    catalogue = build_catalogue(clock)
+    catalogue.get()
+    version = catalogue.version
+
+    mocked_get_sets.return_value = [('datacite.a', 'Renamed'), ('datacite.c', 'C')], 2
+    clock.now += 120
+    catalogue.refresh()
+
+    _, kwargs = mocked_get_sets.call_args
+    assert kwargs['updated_since'] < catalogue.updated_since
+    assert catalogue.version == version + 1
+
+    results, total = catalogue.get()
+    assert results == [
+        ('datacite', 'DataCite'),
+        ('datacite.a', 'Renamed'),
+        ('datacite.c', 'C')
+    ]
+    assert total == 3
+
+def test_refresh_is_full_after_interval(mocker):
+    """Test clients removed upstream drop out on the next full reload"""
+    mocked_get_sets = mocker.patch('viringo.services.datacite_async.get_sets')
+    mocked_get_sets.return_value = [('datacite', 'DataCite'), ('datacite.a', 'A')], 2
+
+    clock = FakeClock()
+    catalogue = build_catalogue(clock)
+    catalogue.get()
+
+    mocked_get_sets.return_value = [('datacite', 'DataCite')], 1
+    clock.now += 3601
+    catalogue.refresh()
+
+    mocked_get_sets.assert_called_with()
+    assert catalogue.get() == ([('datacite', 'DataCite')], 1)
+
+def test_failed_refresh_keeps_sets(mocker):
+    """Test an API error during a refresh leaves the loaded sets as they were"""
+    mocked_get_sets = mocker.patch('viringo.services.datacite_async.get_sets')
+    mocked_get_sets.return_value = [('datacite', 'DataCite')], 1
+
+    clock = FakeClock()
+    catalogue = build_catalogue(clock)
+    catalogue.get()
+    loaded_at, updated_since = catalogue.loaded_at, catalogue.updated_since
+
+    clock.now += 7200
+    mocked_get_sets.return_value = None
+    catalogue.refresh()
+
+    assert catalogue.get() == ([('datacite', 'DataCite')], 1)
+    assert catalogue.loaded_at == loaded_at
+    assert catalogue.updated_since == updated_since
+
+def test_failed_cold_load_retried(mocker):
+    """Test an API error on the first load serves no sets, the next request loads them"""
+    mocked_get_sets = mocker.patch('viringo.services.datacite_async.get_sets')
+    mocked_get_sets.return_value = None
+
+    catalogue = build_catalogue(FakeClock())
+    assert catalogue.get() == ([], 0)
+
+    mocked_get_sets.return_value = [('datacite', 'DataCite')], 1
+    assert catalogue.get() == ([('datacite', 'DataCite')], 1)
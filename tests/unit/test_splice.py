@@ -0,0 +1,73 @@
+"""Unit tests for splicing raw XML documents into responses"""
+
+from lxml import etree
+
+from viringo import config, splice
+
+RESOURCE = b'<resource xmlns="http://datacite.org/schema/kernel-4"><title>A &amp; B</title></resource>'
+
+def test_root_document_strips_prolog():
+    """Test the declaration and surrounding whitespace are removed"""
+    raw = b'\xef\xbb\xbf<?xml version="1.0" encoding="UTF-8"?>\n' + RESOURCE + b'\n'
+    assert splice.root_document(raw) == RESOURCE
+    assert splice.root_document(RESOURCE.decode('utf-8')) == RESOURCE
+    assert splice.root_document(b'<resource a="1 > 0"/>') == b'<resource a="1 > 0"/>'
+
+def test_root_document_leaves_unusual_documents_to_the_parser():
+    """Test documents that can't safely be spliced are refused"""
+    for raw in [
+            b'<?xml version="1.0" encoding="ISO-8859-1"?><resource/>',
+            b'<!DOCTYPE resource><resource/>',
+            b'<!-- comment --><resource/>',
+            b'<resource><title>unclosed</title>',
+            b'<resource/><trailing/>',
+            b'not xml',
+    ]:
+        assert splice.root_document(raw) is None
+
+def test_root_document_without_check(monkeypatch):
+    """Test only the start of the document is looked at when the check is off"""
+    monkeypatch.setattr(config, 'RAW_XML_CHECK', 'none')
+    assert splice.root_document(b'<resource><title>unclosed</title>') == \
+        b'<resource><title>unclosed</title>'
+    assert splice.root_document(b'<!DOCTYPE resource><resource/>') is None
+
+def test_placeholders_are_spliced():
+    """Test placeholders are replaced by their documents once"""
+    root = etree.Element('metadata')
+    with splice.collecting() as fragments:
+        root.append(splice.placeholder(RESOURCE))
+    output = etree.tostring(root)
+
+    assert len(fragments) == 1
+    assert fragments.splice(output) == b'<metadata>' + RESOURCE + b'</metadata>'
+    assert len(fragments) == 0
+
+def test_placeholders_in_records_left_alone():
+    """Test processing instructions a record brings along are never spliced"""
+    root = etree.Element('metadata')
+    with splice.collecting() as fragments:
+        root.append(splice.placeholder(RESOURCE))
+    forged = [
+        etree.ProcessingInstruction('viringo-splice', '0'),
+        etree.ProcessingInstruction('viringo-splice-0123456789abcdef', '0'),
+        etree.ProcessingInstruction(splice.PLACEHOLDER_TARGET + fragments.nonce, '7'),
+    ]
+    for instruction in forged:
+        root.append(instruction)
+    output = etree.tostring(root)
+
+    spliced = fragments.splice(output)
+
+    assert spliced.startswith(b'<metadata>' + RESOURCE)
+    for instruction in forged:
+        assert etree.tostring(instruction) in spliced
+    assert len(fragments) == 0
+
+def test_no_placeholder_outside_collecting(monkeypatch):
+    """Test nothing is spliced unless a response is collecting or when turned off"""
+    assert splice.placeholder(RESOURCE) is None
+
+    monkeypatch.setattr(config, 'RAW_XML_SPLICE', False)
+    with splice.collecting():
+        assert splice.placeholder(RESOURCE) is None
@@ -0,0 +1,24 @@
+"""Unit tests for parsing DataCite API timestamps"""
+
+import datetime
+
+from viringo import timestamps
+
+def test_parse_datetime_api_format():
+    """Test the timestamps the API writes are parsed to naive UTC datetimes"""
+    assert timestamps.parse_datetime('2019-01-02T03:04:05.000Z') == \
+        datetime.datetime(2019, 1, 2, 3, 4, 5)
+    assert timestamps.parse_datetime('2019-01-02T03:04:05Z') == \
+        datetime.datetime(2019, 1, 2, 3, 4, 5)
+
+def test_parse_datetime_converts_offsets_to_utc():
+    """Test timestamps with an offset are converted to UTC"""
+    assert timestamps.parse_datetime('2019-01-02T03:04:05+02:00') == \
+        datetime.datetime(2019, 1, 2, 1, 4, 5)
+
+def test_parse_datetime_falls_back_to_dateutil():
+    """Test timestamps the standard library can't parse are still understood"""
+    assert timestamps.parse_datetime('2019-01-02T03:04:05.1Z') == \
+        datetime.datetime(2019, 1, 2, 3, 4, 5, 100000)
+    assert timestamps.parse_datetime('Wed, 02 Jan 2019 03:04:05 GMT') == \
+        datetime.datetime(2019, 1, 2, 3, 4, 5)
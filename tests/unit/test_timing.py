@@ -0,0 +1,34 @@
+"""Unit tests for the request timing breakdown"""
+
+from viringo import timing
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_nested_stages_count_toward_the_inner_stage():
+    """Test the time of an inner stage isn't counted toward the stage around it"""
+    clock = FakeClock()
+    recorder = timing.Recorder(clock=clock)
+
+    recorder.enter('write_metadata')
+    clock.now += 0.002
+    recorder.enter('build_metadata')
+    clock.now += 0.005
+    recorder.exit()
+    clock.now += 0.001
+    recorder.exit()
+    clock.now += 0.004
+
+    assert recorder.breakdown() == {'write_metadata': 3.0, 'build_metadata': 5.0, 'total': 12.0}
+    assert recorder.header() == 'write_metadata;dur=3.0, build_metadata;dur=5.0, total;dur=12.0'
+
+def test_unsampled_requests_are_not_recorded():
+    """Test spans and calls do nothing without a recorder"""
+    assert timing.current() is None
+    with timing.span('serialize'):
+        pass
+    assert timing.call('build_metadata', len, 'abc') == 3
@@ -0,0 +1,45 @@
+"""Unit tests for the shared helpers"""
+
+import os
+
+import pytest
+
+from viringo.utils import PerProcess, write_atomic
+
+def test_write_atomic(tmp_path):
+    """Test a file is replaced whole, leaving no temporary file behind"""
+    path = str(tmp_path / 'nested' / 'file')
+    write_atomic(path, b'first')
+    write_atomic(path, b'second')
+
+    with open(path, 'rb') as written:
+        assert written.read() == b'second'
+    assert os.listdir(os.path.dirname(path)) == ['file']
+
+def test_write_atomic_failure(tmp_path, mocker):
+    """Test a failed write leaves the old file and no temporary file"""
+    path = str(tmp_path / 'file')
+    write_atomic(path, b'first')
+    mocker.patch('viringo.utils.os.replace', side_effect=OSError)
+
+    with pytest.raises(OSError):
+        write_atomic(path, b'second')
+
+    assert os.listdir(str(tmp_path)) == ['file']
+
+def test_per_process(mocker):
+    """Test a value is created once per process and again after a reset"""
+    factory = mocker.Mock(side_effect=lambda: object())
+    close = mocker.Mock()
+    value = PerProcess(factory)
+
+    first = value.get()
+    assert value.get() is first
+
+    value.reset(close)
+    close.assert_called_once_with(first)
+    assert value.get() is not first
+
+    mocker.patch('viringo.utils.os.getpid', return_value=-1)
+    value.get()
+    assert factory.call_count == 3
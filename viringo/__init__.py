@@ -1,15 +1,24 @@
 """OAI-PMH http server repository implementation"""
 import os
 from flask import Flask, Response, redirect, url_for
-import sentry_sdk
-from sentry_sdk.integrations.flask import FlaskIntegration
 
 from . import config
 
-sentry_sdk.init(
-    dsn=config.SENTRY_DSN,
-    integrations=[FlaskIntegration()]
-)
+def init_sentry():
+    """Report errors to Sentry when a DSN is set
+
+    sentry_sdk is only imported then, as it adds noticeably to worker start up.
+    """
+    if not config.SENTRY_DSN:
+        return
+
+    import sentry_sdk
+    from sentry_sdk.integrations.flask import FlaskIntegration
+
+    sentry_sdk.init(
+        dsn=config.SENTRY_DSN,
+        integrations=[FlaskIntegration()]
+    )
 
 class DefaultResponse(Response):
     """Handles default responses for the OAI-PMH responses"""
@@ -17,6 +26,8 @@ class DefaultResponse(Response):
 
 def create_app(test_config=None):
     """Create and configure an instance of the Flask application."""
+    init_sentry()
+
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping()
     app.url_map.strict_slashes = False
@@ -37,6 +48,8 @@ def create_app(test_config=None):
     # Register Blueprints
     from viringo import oai
     app.register_blueprint(oai.BP, url_prefix="/oai")
+    # Build the OAI-PMH server once, every request shares it
+    oai.init_app(app)
 
     @app.route('/')
     def index():
@@ -54,4 +67,20 @@ def create_app(test_config=None):
     # We want to use a custom response object for default content types
     app.response_class = DefaultResponse
 
+    # Serve metrics, registered first so responses are measured once compressed
+    from viringo import metrics
+    metrics.init_app(app)
+
+    # Break down where the time of a sample of requests goes
+    from viringo import timing
+    timing.init_app(app)
+
+    # Compress responses for clients that accept it
+    from viringo import compression
+    compression.init_app(app)
+
+    # Register command line tasks
+    from viringo import commands
+    commands.init_app(app)
+
     return app
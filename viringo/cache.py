@@ -0,0 +1,93 @@
+"""Bounded in memory caches shared by the service and OAI layers"""
+
+import threading
+from collections import OrderedDict
+
+
+class CacheStats:
+    """Counters describing how well a cache is doing"""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class LRUCache:
+    """Thread safe least recently used cache bounded by entries and total size
+
+    sizeof is called with each value to work out how many bytes it accounts
+    for, values larger than max_bytes are never stored.
+    """
+
+    def __init__(self, max_entries, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda value: 0)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.size = 0
+        self.stats = CacheStats()
+
+    def get(self, key, default=None):
+        """Return a cached value and mark it as recently used"""
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self.stats.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries to make room"""
+        if self.max_entries <= 0:
+            return
+
+        size = self._sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            self.delete(key)
+            return
+
+        with self._lock:
+            if key in self._entries:
+                _, old_size = self._entries.pop(key)
+                self.size -= old_size
+
+            self._entries[key] = (value, size)
+            self.size += size
+
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self.size > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.stats.evictions += 1
+
+    def delete(self, key):
+        """Remove a value if it is cached"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def clear(self):
+        """Remove all values and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.stats = CacheStats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
@@ -6,12 +6,26 @@ pyoai library.
 
 import base64
 import binascii
+import inspect
 import logging
+from collections.abc import Mapping
 from datetime import datetime
 from oaipmh import common, error
 
-from viringo import config
-from .services import datacite
+from viringo import config, timing
+from .services import datacite, sets
+
+
+# DOI fields each response needs from the DataCite API, a prefix mapped to
+# None needs every attribute. Relationships are fields too, so the client and
+# provider used for the set specs have to be named.
+HEADER_FIELDS = ('updated', 'isActive', 'client', 'provider')
+
+RECORD_FIELDS = {
+    'oai_dc': None,
+    'oai_datacite': HEADER_FIELDS + ('xml', 'metadataVersion'),
+    'datacite': HEADER_FIELDS + ('xml',),
+}
 
 
 class InvalidIdentifierException(Exception):
@@ -19,7 +33,16 @@ class InvalidIdentifierException(Exception):
 
 
 class DataCiteOAIServer():
-    """Build OAI-PMH data responses for DataCite metadata catalog"""
+    """Build OAI-PMH data responses for DataCite metadata catalog
+
+    Records are read from a backend module providing get_metadata and
+    get_metadata_list, by default the DataCite API service. When the backend's
+    functions are coroutines, as with datacite_async, the verbs return
+    awaitables of the same responses.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or datacite
 
     def identify(self):
         """Construct common identification for the OAI service"""
@@ -84,25 +107,11 @@ class DataCiteOAIServer():
         # We just want the DOI out of the OAI identifier.
         _, doi = identifier.split(':', 1)
 
-        result = datacite.get_metadata(doi)
-        if not result:
-            raise error.IdDoesNotExistError(
-                "\"%s\" is unknown or illegal in this repository" % identifier
-            )
-
-        # Build metadata based on requested format and result
-        metadata = self.build_metadata_map(result)
-
-        header = self.build_header(result)
-        record = self.build_record(metadata)
-        data = (
-            header,
-            record,
-            None  # About string - not used
+        return then(
+            self.backend.get_metadata(doi),
+            lambda result: self.build_get_record(identifier, result)
         )
 
-        return data
-
     def listRecords(
         self,
         metadataPrefix=None,
@@ -119,35 +128,17 @@ class DataCiteOAIServer():
 
         # Get both a provider and client_id from the set
         provider_id, client_id = set_to_provider_client(set)
-        results, total_records, paging_cursor = datacite.get_metadata_list(
+        page = self.backend.get_metadata_list(
             query=search_query,
             provider_id=provider_id,
             client_id=client_id,
             from_datetime=from_,
             until_datetime=until,
-            cursor=paging_cursor
+            cursor=paging_cursor,
+            fields=RECORD_FIELDS.get(metadataPrefix)
         )
 
-        records = []
-        if results:
-            for result in results:
-                # Build metadata based on requested format and result
-                metadata = self.build_metadata_map(result)
-
-                header = self.build_header(result)
-                record = self.build_record(metadata)
-
-                data = (
-                    header,
-                    record,
-                    None  # About string - not used
-                )
-
-                records.append(data)
-
-        # This differs from the pyoai implementation in that we have to return a cursor here
-        # But this is okay as we have a custom server to handle it.
-        return records, total_records, paging_cursor
+        return then(page, lambda page: self.build_list_records(*page))
 
     def listIdentifiers(
         self,
@@ -163,14 +154,55 @@ class DataCiteOAIServer():
         # Get both a provider and client_id from the set
         provider_id, client_id = set_to_provider_client(set)
 
-        results, total_records, paging_cursor = datacite.get_metadata_list(
+        page = self.backend.get_metadata_list(
             provider_id=provider_id,
             client_id=client_id,
             from_datetime=from_,
             until_datetime=until,
-            cursor=paging_cursor
+            cursor=paging_cursor,
+            fields=HEADER_FIELDS
         )
 
+        return then(page, lambda page: self.build_list_identifiers(*page))
+
+    def listSets(
+        self,
+        paging_cursor=0
+    ):
+        #pylint: disable=no-self-use,invalid-name
+        """Returns pyoai data tuple for list of sets"""
+
+        # Sets are served from the in memory catalogue,
+        # the paging is handled just by offsetting the records returned.
+        results, total_results = sets.catalogue.get()
+
+        return self.build_list_sets(results, total_results, paging_cursor)
+
+    def build_get_record(self, identifier, result):
+        """Construct the pyoai data tuple for a GetRecord response"""
+
+        if not result:
+            raise error.IdDoesNotExistError(
+                "\"%s\" is unknown or illegal in this repository" % identifier
+            )
+
+        return self.build_record_data(result)
+
+    def build_list_records(self, results, total_records, paging_cursor):
+        """Construct the pyoai data tuple for a ListRecords response"""
+
+        records = []
+        if results:
+            for result in results:
+                records.append(self.build_record_data(result))
+
+        # This differs from the pyoai implementation in that we have to return a cursor here
+        # But this is okay as we have a custom server to handle it.
+        return records, total_records, paging_cursor
+
+    def build_list_identifiers(self, results, total_records, paging_cursor):
+        """Construct the pyoai data tuple for a ListIdentifiers response"""
+
         records = []
         if results:
             for result in results:
@@ -182,24 +214,14 @@ class DataCiteOAIServer():
         # But this is okay as we have a custom server to handle it.
         return records, total_records, paging_cursor
 
-    def listSets(
-        self,
-        paging_cursor=0
-    ):
-        #pylint: disable=no-self-use,invalid-name
-        """Returns pyoai data tuple for list of sets"""
-
-        # Note this implementation is not super efficient as we request
-        # the full set everytime regardles of actual paging
-        # The paging is handled just by offsetting the records returned.
-        # This is however acceptable given sets are a small subset of data.
+    def build_list_sets(self, results, total_results, paging_cursor):
+        """Construct the pyoai data tuple for a page of a ListSets response"""
 
         # We know we're always dealing with a integer value here
         paging_cursor = int(paging_cursor)
 
         batch_size = 50
         next_batch = paging_cursor + batch_size
-        results, total_results = datacite.get_sets()
         results = results[paging_cursor: next_batch]
 
         if len(results) < batch_size:
@@ -217,6 +239,21 @@ class DataCiteOAIServer():
         # But this is okay as we have a custom server to handle it.
         return records, total_results, paging_cursor
 
+    def build_record_data(self, result):
+        """Construct a pyoai record data tuple from a metadata result"""
+
+        # Build metadata based on requested format and result
+        metadata = self.build_metadata_map(result)
+
+        header = self.build_header(result)
+        record = self.build_record(metadata)
+
+        return (
+            header,
+            record,
+            None  # About string - not used
+        )
+
     def build_header(self, result):
         """Construct a OAI-PMH record header"""
 
@@ -240,58 +277,119 @@ class DataCiteOAIServer():
         )
 
     def build_metadata_map(self, result):
-        """Construct a metadata map object for oai metadata writing"""
-        dates = []
-        if result.publication_year:
-            dates.append(str(result.publication_year))
-        date_strings = [
-            f"{d.get('type')}: {d.get('date')}" for d in result.dates
-        ]
-        dates.extend(date_strings)
-
-        rights = []
-        for right in result.rights:
-            if right['statement']:
-                rights.append(right['statement'])
-            if right['uri']:
-                rights.append(right['uri'])
-
-        identifiers = [
-            identifier_to_string(identifier)
-            for identifier in result.identifiers
-            if 'type' in identifier
-        ]
-
-        relations = [
-            identifier_to_string(relation)
-            for relation in result.relations
-            if 'type' in relation
-        ]
-
-        contributors = [
-            contributor.get('name') for contributor in result.contributors
-        ]
-
-        metadata = {
-            'title': result.titles,
-            'creator': result.creators,
-            'subject': result.subjects,
-            'description': result.descriptions,
-            'publisher': [result.publisher] if result.publisher else [],
-            'contributor': contributors,
-            'date': dates,
-            'type': result.resource_types,
-            'format': result.formats,
-            'identifier': identifiers,
-            'relation': relations,
-            'language': [result.language] if result.language else [],
-            'rights': rights,
-            'xml': result.xml,
-            'set': result.client,
-            'metadata_version': result.metadata_version
-        }
-
-        return metadata
+        """Construct a metadata map object for oai metadata writing
+
+        Values are only built when a writer reads them, so a result is only
+        parsed as far as the requested format needs.
+        """
+        return MetadataMap(result)
+
+
+def map_dates(result):
+    dates = []
+    if result.publication_year:
+        dates.append(str(result.publication_year))
+    date_strings = [
+        f"{d.get('type')}: {d.get('date')}" for d in result.dates
+    ]
+    dates.extend(date_strings)
+    return dates
+
+
+def map_rights(result):
+    rights = []
+    for right in result.rights:
+        if right['statement']:
+            rights.append(right['statement'])
+        if right['uri']:
+            rights.append(right['uri'])
+    return rights
+
+
+def map_identifiers(result):
+    return [
+        identifier_to_string(identifier)
+        for identifier in result.identifiers
+        if 'type' in identifier
+    ]
+
+
+def map_relations(result):
+    return [
+        identifier_to_string(relation)
+        for relation in result.relations
+        if 'type' in relation
+    ]
+
+
+def map_contributors(result):
+    return [
+        contributor.get('name') for contributor in result.contributors
+    ]
+
+
+# How each metadata map value is built from a metadata result
+METADATA_MAP = {
+    'title': lambda result: result.titles,
+    'creator': lambda result: result.creators,
+    'subject': lambda result: result.subjects,
+    'description': lambda result: result.descriptions,
+    'publisher': lambda result: [result.publisher] if result.publisher else [],
+    'contributor': map_contributors,
+    'date': map_dates,
+    'type': lambda result: result.resource_types,
+    'format': lambda result: result.formats,
+    'identifier': map_identifiers,
+    'relation': map_relations,
+    'language': lambda result: [result.language] if result.language else [],
+    'rights': map_rights,
+    'xml': lambda result: result.xml,
+    'set': lambda result: result.client,
+    'metadata_version': lambda result: result.metadata_version
+}
+
+
+class MetadataMap(Mapping):
+    """Read only metadata map that builds each value on first access"""
+
+    def __init__(self, result):
+        self._result = result
+        self._values = {}
+
+    @property
+    def record_key(self):
+        """The (identifier, updated datetime) that identify this version of the record"""
+        return self._result.identifier, self._result.updated_datetime
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+
+        value = timing.call('build_metadata_map', METADATA_MAP[key], self._result)
+        self._values[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in METADATA_MAP
+
+    def __iter__(self):
+        return iter(METADATA_MAP)
+
+    def __len__(self):
+        return len(METADATA_MAP)
+
+
+def then(result, build):
+    """Build a response from a backend result, once awaited if it is awaitable"""
+    if not inspect.isawaitable(result):
+        return build(result)
+
+    async def built():
+        return build(await result)
+
+    return built()
 
 
 def set_to_search_query(unparsed_set):
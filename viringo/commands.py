@@ -0,0 +1,18 @@
+"""Command line tasks run through the flask command"""
+
+import click
+
+
+def init_app(app):
+    """Register the command line tasks for an application"""
+    app.cli.add_command(mirror_sync)
+
+
+@click.command('mirror-sync')
+@click.option('--full', is_flag=True, help='Copy every DOI, not only those updated since the last sync.')
+def mirror_sync(full):
+    """Sync the local DOI mirror with the DataCite API"""
+    from viringo.services import mirror
+
+    stored = mirror.sync(full=full)
+    click.echo('Mirrored %d DOIs' % stored)
@@ -0,0 +1,89 @@
+"""Response compression negotiated from the Accept-Encoding request header
+
+Identify advertises gzip and deflate compression, this compresses any
+response that is large enough, including streamed responses chunk by chunk.
+"""
+
+import zlib
+
+from flask import request
+
+from viringo import config
+
+# Encodings we can produce, in order of preference, with their zlib wbits.
+ENCODINGS = [
+    ('gzip', 16 + zlib.MAX_WBITS),
+    ('deflate', zlib.MAX_WBITS),
+]
+
+
+def init_app(app):
+    """Register response compression for an application"""
+    app.after_request(compress_response)
+
+
+def compress_response(response):
+    """Compress a response when the client accepts an encoding we support"""
+    if not config.COMPRESSION_ENABLED:
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if response.status_code < 200 or response.status_code >= 300 \
+            or response.status_code == 204 \
+            or response.direct_passthrough \
+            or 'Content-Encoding' in response.headers:
+        return response
+
+    encoding, wbits = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # The size isn't known up front, so streams are always compressed.
+        response.response = compress_chunks(response.response, wbits)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config.COMPRESSION_MIN_SIZE:
+            return response
+
+        compressor = zlib.compressobj(config.COMPRESSION_LEVEL, zlib.DEFLATED, wbits)
+        response.set_data(compressor.compress(data) + compressor.flush())
+
+    response.headers['Content-Encoding'] = encoding
+
+    return response
+
+
+def negotiate_encoding(accept_encodings):
+    """Returns the preferred (encoding, wbits) the client accepts, or (None, None)"""
+    best = (None, None)
+    best_quality = 0
+
+    for encoding, wbits in ENCODINGS:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best = (encoding, wbits)
+            best_quality = quality
+
+    return best
+
+
+def compress_chunks(chunks, wbits):
+    """Compress an iterable of chunks, flushing after each so output isn't held back"""
+    compressor = zlib.compressobj(config.COMPRESSION_LEVEL, zlib.DEFLATED, wbits)
+
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+
+        yield compressor.flush()
+    finally:
+        # Let the wrapped iterable clean up, e.g. pop a streamed request context
+        if hasattr(chunks, 'close'):
+            chunks.close()
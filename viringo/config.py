@@ -9,6 +9,14 @@ DATACITE_API_URL = os.getenv('DATACITE_API_URL', 'https://api.datacite.org')
 # Admin credentials for the API
 DATACITE_API_ADMIN_USERNAME = os.getenv('DATACITE_API_ADMIN_USERNAME', 'admin')
 DATACITE_API_ADMIN_PASSWORD = os.getenv('DATACITE_API_ADMIN_PASSWORD')
+# Number of distinct hosts to keep connection pools for (per worker)
+DATACITE_API_POOL_CONNECTIONS = int(os.getenv('DATACITE_API_POOL_CONNECTIONS', '4'))
+# Maximum number of keep-alive connections kept open per host (per worker)
+DATACITE_API_POOL_MAXSIZE = int(os.getenv('DATACITE_API_POOL_MAXSIZE', '10'))
+# Seconds allowed for establishing a connection to the API
+DATACITE_API_CONNECT_TIMEOUT = float(os.getenv('DATACITE_API_CONNECT_TIMEOUT', '10'))
+# Seconds allowed between bytes received from the API
+DATACITE_API_READ_TIMEOUT = float(os.getenv('DATACITE_API_READ_TIMEOUT', '120'))
 
 # Name used to identifier the repository.
 OAIPMH_REPOS_NAME = os.getenv('OAIPMH_REPOS_NAME', 'DataCite')
@@ -18,3 +26,94 @@ OAIPMH_BASE_URL = os.getenv('OAIPMH_BASE_URL', 'https://oai.datacite.org/oai')
 OAIPMH_ADMIN_EMAIL = os.getenv('OAIPMH_ADMIN_EMAIL', 'support@datacite.org')
 # Page size of results shown for result listings
 RESULT_SET_SIZE = int(os.getenv('RESULT_SET_SIZE', '50'))
+# Read records through the asyncio service, whose calls run on a thread pool
+CATALOG_ASYNC = os.getenv('CATALOG_ASYNC', 'false').lower() == 'true'
+# Seconds the set catalogue is served before it is refreshed in the background
+SETS_CACHE_TTL = int(os.getenv('SETS_CACHE_TTL', '300'))
+# Seconds after which a stale set catalogue is no longer served while refreshing
+SETS_CACHE_MAX_STALE = int(os.getenv('SETS_CACHE_MAX_STALE', '3600'))
+# Seconds between full set catalogue reloads, refreshes in between are incremental
+SETS_FULL_REFRESH_INTERVAL = int(os.getenv('SETS_FULL_REFRESH_INTERVAL', '86400'))
+# Write ListRecords/ListIdentifiers responses record by record as a chunked stream
+STREAM_LIST_RESPONSES = os.getenv('STREAM_LIST_RESPONSES', 'false').lower() == 'true'
+# Seconds a cached GetRecord result is served before it is revalidated upstream
+RECORD_CACHE_TTL = int(os.getenv('RECORD_CACHE_TTL', '60'))
+# Maximum number of records kept in the GetRecord cache, 0 disables it
+RECORD_CACHE_MAX_ENTRIES = int(os.getenv('RECORD_CACHE_MAX_ENTRIES', '10000'))
+# Maximum approximate bytes held by the GetRecord cache
+RECORD_CACHE_MAX_BYTES = int(os.getenv('RECORD_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Mixed into all response ETags, change it to invalidate responses cached downstream
+CACHE_VERSION = os.getenv('CACHE_VERSION', '1')
+# Seconds responses for each verb may be cached by browsers and proxies
+CACHE_MAX_AGE = {
+    'Identify': int(os.getenv('CACHE_MAX_AGE_IDENTIFY', '86400')),
+    'ListMetadataFormats': int(os.getenv('CACHE_MAX_AGE_LIST_METADATA_FORMATS', '86400')),
+    'ListSets': int(os.getenv('CACHE_MAX_AGE_LIST_SETS', '3600')),
+    'GetRecord': int(os.getenv('CACHE_MAX_AGE_GET_RECORD', '300')),
+    'ListIdentifiers': int(os.getenv('CACHE_MAX_AGE_LIST_IDENTIFIERS', '300')),
+    'ListRecords': int(os.getenv('CACHE_MAX_AGE_LIST_RECORDS', '300')),
+}
+# Compress responses with gzip or deflate when the client accepts it
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+# zlib compression level from 1 (fastest) to 9 (smallest)
+COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL', '6'))
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+# Splice the raw resource XML into datacite and oai_datacite output without parsing it
+RAW_XML_SPLICE = os.getenv('RAW_XML_SPLICE', 'true').lower() == 'true'
+# Check made before splicing raw XML, 'basic' checks the root element is closed, or 'none'
+RAW_XML_CHECK = os.getenv('RAW_XML_CHECK', 'basic').lower()
+# Where list requests are answered from, 'api' for the DataCite API or 'mirror'
+# for the local SQLite mirror, which is always used through the blocking catalog
+CATALOG_BACKEND = os.getenv('CATALOG_BACKEND', 'api').lower()
+# Path of the SQLite database the mirror is kept in
+MIRROR_DATABASE = os.getenv('MIRROR_DATABASE', 'mirror.sqlite3')
+# Number of DOIs requested per page when syncing the mirror
+MIRROR_SYNC_PAGE_SIZE = int(os.getenv('MIRROR_SYNC_PAGE_SIZE', '1000'))
+# Cache the rendered metadata of records by DOI, updated time and metadataPrefix
+FRAGMENT_CACHE_ENABLED = os.getenv('FRAGMENT_CACHE_ENABLED', 'true').lower() == 'true'
+# Maximum number of rendered records kept in memory
+FRAGMENT_CACHE_MAX_ENTRIES = int(os.getenv('FRAGMENT_CACHE_MAX_ENTRIES', '20000'))
+# Maximum bytes of rendered records kept in memory
+FRAGMENT_CACHE_MAX_BYTES = int(os.getenv('FRAGMENT_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+# Directory rendered records are also kept in, shared by workers, unset to keep them in memory only
+FRAGMENT_CACHE_DIR = os.getenv('FRAGMENT_CACHE_DIR', '')
+# Maximum bytes of rendered records kept on disk
+FRAGMENT_CACHE_DISK_MAX_BYTES = int(
+    os.getenv('FRAGMENT_CACHE_DISK_MAX_BYTES', str(1024 * 1024 * 1024)))
+# Seconds between measuring the disk used by rendered records, which every worker adds to
+FRAGMENT_CACHE_DISK_MEASURE_INTERVAL = int(
+    os.getenv('FRAGMENT_CACHE_DISK_MEASURE_INTERVAL', '60'))
+# Prefetch the next page of list requests while the current one is sent,
+# only once RESUMPTION_SESSION_DIR is set
+RESUMPTION_SESSIONS_ENABLED = os.getenv('RESUMPTION_SESSIONS_ENABLED', 'true').lower() == 'true'
+# Seconds a prefetched page is kept for the harvester to come back for it
+RESUMPTION_SESSION_TTL = int(os.getenv('RESUMPTION_SESSION_TTL', '300'))
+# Maximum number of resumption sessions kept by each worker
+RESUMPTION_SESSION_MAX_ENTRIES = int(os.getenv('RESUMPTION_SESSION_MAX_ENTRIES', '200'))
+# Maximum approximate bytes of prefetched pages kept by each worker
+RESUMPTION_SESSION_MAX_BYTES = int(
+    os.getenv('RESUMPTION_SESSION_MAX_BYTES', str(256 * 1024 * 1024)))
+# Number of threads each worker prefetches pages on
+RESUMPTION_PREFETCH_WORKERS = int(os.getenv('RESUMPTION_PREFETCH_WORKERS', '4'))
+# Directory resumption sessions are shared between workers in, unset to not use sessions
+RESUMPTION_SESSION_DIR = os.getenv('RESUMPTION_SESSION_DIR', '')
+# Seconds a session token can be resumed for
+RESUMPTION_TOKEN_TTL = int(os.getenv('RESUMPTION_TOKEN_TTL', '86400'))
+# Serve request, upstream and cache metrics at /metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+# Directory the workers of a multi-process server share their metrics in,
+# unset when there is only one process
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+# Seconds between writes of a worker's metrics to the directory
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1'))
+# Fraction of requests whose time is broken down by stage in a Server-Timing header
+TIMING_SAMPLE_RATE = float(os.getenv('TIMING_SAMPLE_RATE', '0.01'))
+# Secret that requests send in the X-Viringo-Profile header to be profiled, unset to never profile
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+# Directory request profiles are stored in, a temporary directory when unset
+PROFILING_DIR = os.getenv('PROFILING_DIR', '')
+# Number of request profiles kept, older ones are removed
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '100'))
+# Share one DataCite API call between identical calls made at the same time
+DATACITE_API_COALESCE = os.getenv('DATACITE_API_COALESCE', 'true').lower() == 'true'
@@ -0,0 +1,185 @@
+"""Cache of rendered record metadata
+
+Every harvester walking the repository has the same records rendered into
+the same formats again. The serialized metadata of a record is cached by
+(DOI, updated, metadataPrefix); a record gets a new updated time whenever it
+changes, so a cached fragment can never be stale.
+
+Fragments are kept in a bounded memory tier and, when a directory is
+configured, a bounded disk tier shared by all the workers on a host. Each
+worker only sees its own writes, so the size of the disk tier is measured
+again every FRAGMENT_CACHE_DISK_MEASURE_INTERVAL seconds to count the others.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from viringo import config, metrics
+from viringo.cache import LRUCache, CacheStats
+from viringo.utils import write_atomic
+
+# Fraction of the disk limit kept after evicting, so eviction doesn't run on every write.
+DISK_EVICT_TARGET = 0.9
+
+
+class DiskTier:
+    """Fragments stored as files below a directory, bounded by their total size"""
+
+    def __init__(self, directory, max_bytes, measure_interval=60, clock=time.monotonic):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.measure_interval = measure_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Approximate bytes on disk, measured on the first write and then
+        # again once measure_interval has passed, as other workers write too
+        self._size = None
+        self._measured_at = None
+        self.stats = CacheStats()
+
+    def path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        """Return a stored fragment, or None"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as fragment_file:
+                fragment = fragment_file.read()
+            # Eviction goes by modified time, so mark it as recently used
+            os.utime(path)
+        except OSError:
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        return fragment
+
+    def set(self, key, fragment):
+        """Store a fragment, evicting the oldest fragments when over the limit"""
+        path = self.path(key)
+        try:
+            write_atomic(path, fragment)
+        except OSError:
+            logging.exception("Unable to store a fragment in %s", self.directory)
+            return
+
+        with self._lock:
+            now = self._clock()
+            if self._size is None or now - self._measured_at > self.measure_interval:
+                self._size = self.measure()
+                self._measured_at = now
+            else:
+                self._size += len(fragment)
+            over_limit = self._size > self.max_bytes
+
+        if over_limit:
+            self.evict()
+
+    def measure(self):
+        """Total bytes of the fragments on disk"""
+        return sum(size for _, _, size in self.files())
+
+    def files(self):
+        """(modified time, path, size) of every stored fragment"""
+        files = []
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        return files
+
+    def evict(self):
+        """Remove the oldest fragments until the tier is comfortably under its limit"""
+        with self._lock:
+            files = sorted(self.files())
+            size = sum(file_size for _, _, file_size in files)
+            target = self.max_bytes * DISK_EVICT_TARGET
+
+            for _, path, file_size in files:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                size -= file_size
+                self.stats.evictions += 1
+
+            self._size = size
+            self._measured_at = self._clock()
+
+    def clear(self):
+        """Remove every stored fragment"""
+        with self._lock:
+            for _, path, _ in self.files():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = 0
+            self._measured_at = self._clock()
+            self.stats = CacheStats()
+
+
+class FragmentCache:
+    """Two tier cache of serialized metadata by record and format"""
+
+    def __init__(self, max_entries, max_bytes, directory=None, disk_max_bytes=0,
+                 disk_measure_interval=60):
+        self.memory = LRUCache(max_entries, max_bytes=max_bytes, sizeof=len)
+        self.disk = DiskTier(
+            directory, disk_max_bytes, disk_measure_interval) if directory else None
+
+    @staticmethod
+    def key(identifier, updated, metadata_prefix):
+        # The cache version lets a deploy that changes the output drop old fragments
+        return '%s\0%s\0%s\0%s' % (
+            config.CACHE_VERSION, identifier, updated.isoformat(), metadata_prefix)
+
+    def get(self, key):
+        """Return a cached fragment, or None"""
+        fragment = self.memory.get(key)
+        if fragment is None and self.disk is not None:
+            fragment = self.disk.get(key)
+            if fragment is not None:
+                self.memory.set(key, fragment)
+        return fragment
+
+    def set(self, key, fragment):
+        self.memory.set(key, fragment)
+        if self.disk is not None:
+            self.disk.set(key, fragment)
+
+    def stats(self):
+        """Counters of each tier"""
+        stats = {'memory': self.memory.stats.as_dict()}
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats.as_dict()
+        return stats
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+
+fragment_cache = FragmentCache(
+    max_entries=config.FRAGMENT_CACHE_MAX_ENTRIES,
+    max_bytes=config.FRAGMENT_CACHE_MAX_BYTES,
+    directory=config.FRAGMENT_CACHE_DIR,
+    disk_max_bytes=config.FRAGMENT_CACHE_DISK_MAX_BYTES,
+    disk_measure_interval=config.FRAGMENT_CACHE_DISK_MEASURE_INTERVAL
+)
+
+metrics.register_cache('fragments_memory', lambda: fragment_cache.memory.stats.as_dict())
+if fragment_cache.disk is not None:
+    metrics.register_cache('fragments_disk', lambda: fragment_cache.disk.stats.as_dict())
@@ -1,8 +1,10 @@
 """This module deals with handling the representation of metadata formats for OAI"""
 
-import re
 from lxml import etree
 
+from . import splice
+from .sanitize import clean_text, clean_xml
+
 NS_OAIPMH = 'http://www.openarchives.org/OAI/2.0/'
 NS_XSI = 'http://www.w3.org/2001/XMLSchema-instance'
 NS_OAIDC = 'http://www.openarchives.org/OAI/2.0/oai_dc/'
@@ -44,16 +46,14 @@ def oai_dc_writer(element: etree.Element, metadata):
         for value in _map.get(name, []):
             if value:
                 new_element = etree.SubElement(e_dc, nsdc(name))
-                # The regular expression here is to filter only valid XML chars
-                # Char ::= #x9 | #xA | #xD | [#x20-#xD7FF] | [#xE000-#xFFFD] | [#x10000-#x10FFFF]
-                new_element.text = re.sub(u'[^\u0020-\uD7FF\u0009\u000A\u000D\uE000-\uFFFD\U00010000-\U0010FFFF]+', '', value)
+                new_element.text = clean_text(value)
 
 def datacite_writer(element: etree.Element, metadata):
     """Writer for writing data in a metadata object out into raw datacite format"""
     _map = metadata.getMap()
     raw_xml = _map.get('xml', '')
 
-    xml_resource_element = etree.fromstring(raw_xml)
+    xml_resource_element = resource_element(raw_xml)
 
     element.append(xml_resource_element)
 
@@ -62,7 +62,7 @@ def oai_datacite_writer(element: etree.Element, metadata):
     _map = metadata.getMap()
     raw_xml = _map.get('xml', '')
 
-    xml_resource_element = etree.fromstring(raw_xml)
+    xml_resource_element = resource_element(raw_xml)
 
     e_oai_datacite = etree.SubElement(
         element, "oai_datacite", {'xmlns': 'http://schema.datacite.org/oai/oai-1.1/'},
@@ -78,8 +78,18 @@ def oai_datacite_writer(element: etree.Element, metadata):
     e_schema_version = etree.SubElement(e_oai_datacite, 'schemaVersion')
     e_schema_version.text = str(schema_version)
     e_symbol = etree.SubElement(e_oai_datacite, 'datacentreSymbol')
-    e_symbol.text = _map.get('set', '')
+    e_symbol.text = clean_text(_map.get('set', ''))
 
     e_payload = etree.SubElement(e_oai_datacite, 'payload')
 
     e_payload.append(xml_resource_element)
+
+def resource_element(raw_xml):
+    """The resource to add to a record, spliced in raw where possible, else parsed"""
+    raw_xml = clean_xml(raw_xml)
+
+    placeholder = splice.placeholder(raw_xml)
+    if placeholder is not None:
+        return placeholder
+
+    return etree.fromstring(raw_xml)
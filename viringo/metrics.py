@@ -0,0 +1,425 @@
+"""Request, upstream and cache metrics served in the Prometheus text format
+
+Each worker process counts into its own registry. With METRICS_DIR set,
+workers write their counts to a file of their own there, at most every
+METRICS_FLUSH_INTERVAL seconds; counts made within the interval are written
+once it has passed, and again when the worker exits. /metrics then sums the files of every
+worker, so any worker can answer it. The counts of workers that have exited
+are folded into an archive file so counters never go backwards.
+"""
+
+import atexit
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+
+import oaipmh.error
+import oaipmh.server
+from flask import current_app, g, request
+
+from viringo import config, resumption
+from viringo.utils import write_atomic
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RECORD_BUCKETS = (0, 1, 10, 25, 50, 100, 250, 500, 1000)
+BYTES_BUCKETS = tuple(1024 * 4 ** power for power in range(8))
+
+# Type, help and histogram buckets of every metric
+METRICS = {
+    'viringo_request_duration_seconds': (
+        'histogram', 'Time taken to answer OAI-PMH requests', LATENCY_BUCKETS),
+    'viringo_response_bytes': (
+        'histogram', 'Size of OAI-PMH response bodies as sent', BYTES_BUCKETS),
+    'viringo_page_records': (
+        'histogram', 'Records or sets on each list page', RECORD_BUCKETS),
+    'viringo_upstream_duration_seconds': (
+        'histogram', 'Time taken by DataCite API requests', LATENCY_BUCKETS),
+    'viringo_upstream_responses_total': (
+        'counter', 'DataCite API responses by status', None),
+    'viringo_upstream_coalesced_total': (
+        'counter', 'DataCite API calls answered by an identical call already in flight', None),
+    'viringo_cache_events_total': (
+        'counter', 'Cache lookups and evictions by outcome', None),
+}
+
+# Label values taken from requests are limited to these, others are 'other'
+VERBS = [
+    'GetRecord', 'Identify', 'ListIdentifiers', 'ListMetadataFormats',
+    'ListRecords', 'ListSets'
+]
+METADATA_PREFIXES = ['oai_dc', 'oai_datacite', 'datacite']
+
+ARCHIVE_FILE = 'archive.json'
+LOCK_FILE = '.lock'
+
+
+class Registry:
+    """Counters and histograms of one worker process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self._pid = os.getpid()
+
+    def _check_process(self):
+        """Forget counts inherited from a parent process, they are its own to report"""
+        if self._pid != os.getpid():
+            self.counters = {}
+            self.histograms = {}
+            self._pid = os.getpid()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_process()
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Count a value into the histogram bucket it falls in"""
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+
+        with self._lock:
+            self._check_process()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # One count per bucket and one above them all, then the sum
+                histogram = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        """The counts as JSON-able data, with the counters of the caches"""
+        with self._lock:
+            self._check_process()
+            snapshot = {
+                'counters': [[name, dict(labels), value]
+                             for (name, labels), value in self.counters.items()],
+                'histograms': [[name, dict(labels), list(histogram)]
+                               for (name, labels), histogram in self.histograms.items()],
+            }
+
+        for cache, stats in CACHES.items():
+            for event, value in stats().items():
+                snapshot['counters'].append(
+                    ['viringo_cache_events_total', {'cache': cache, 'event': event}, value])
+
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = Registry()
+
+# Functions returning the counters of each cache, by cache name
+CACHES = {
+    'resumption_sessions': lambda: resumption.sessions.stats.as_dict(),
+}
+
+_FLUSHED_AT = {'time': 0.0}
+# The timer writing counts held back by the flush interval, and its process
+_PENDING_FLUSH = {'timer': None, 'pid': None}
+_FLUSH_LOCK = threading.Lock()
+
+
+def register_cache(name, stats):
+    """Expose the counters a cache's stats function returns"""
+    CACHES[name] = stats
+
+
+def init_app(app):
+    """Register the metrics endpoint and request metrics for an application
+
+    Registered ahead of compression, so response sizes are as sent.
+    """
+    if not config.METRICS_ENABLED:
+        return
+
+    app.before_request(start_timer)
+    app.after_request(observe_response)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+def metrics_view():
+    """Serve the metrics of every worker"""
+    return current_app.response_class(
+        render(collect()), mimetype='text/plain', content_type='text/plain; version=0.0.4')
+
+
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+def observe_response(response):
+    """Record the latency and size of an OAI-PMH response once it has been sent"""
+    if request.endpoint != 'oai.index':
+        return response
+
+    started = g.request_started
+    verb, metadata_prefix = request_labels()
+    sent = [0]
+
+    if response.is_streamed:
+        response.response = count_bytes(response.response, sent)
+    else:
+        sent[0] = len(response.get_data())
+
+    def observe():
+        registry.observe(
+            'viringo_request_duration_seconds',
+            {'verb': verb, 'metadata_prefix': metadata_prefix},
+            time.perf_counter() - started
+        )
+        registry.observe('viringo_response_bytes', {'verb': verb}, sent[0])
+        flush()
+
+    response.call_on_close(observe)
+    return response
+
+
+def count_bytes(chunks, sent):
+    try:
+        for chunk in chunks:
+            sent[0] += len(chunk)
+            yield chunk
+    finally:
+        # Let the wrapped iterable clean up, e.g. pop a streamed request context
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def request_labels():
+    """The verb and metadataPrefix of the current OAI-PMH request"""
+    verb = request.args.get('verb', 'Identify')
+    metadata_prefix = request.args.get('metadataPrefix')
+
+    token = request.args.get('resumptionToken')
+    stateless_token = resumption.sessions.resolve(token) if token and not metadata_prefix else None
+    if stateless_token:
+        try:
+            token_kw, _ = oaipmh.server.decodeResumptionToken(stateless_token)
+            metadata_prefix = token_kw.get('metadataPrefix')
+        except oaipmh.error.BadResumptionTokenError:
+            pass
+
+    return (
+        verb if verb in VERBS else 'other',
+        metadata_prefix if metadata_prefix in METADATA_PREFIXES else (
+            'other' if metadata_prefix else 'none')
+    )
+
+
+def observe_page(verb, records):
+    registry.observe('viringo_page_records', {'verb': verb}, records)
+
+
+def observe_upstream(url, status, seconds):
+    """Record the latency and status of a DataCite API request"""
+    endpoint = upstream_endpoint(url)
+    registry.observe('viringo_upstream_duration_seconds', {'endpoint': endpoint}, seconds)
+    registry.inc('viringo_upstream_responses_total', {'endpoint': endpoint, 'status': str(status)})
+
+
+def observe_coalesced(url):
+    registry.inc('viringo_upstream_coalesced_total', {'endpoint': upstream_endpoint(url)})
+
+
+def upstream_endpoint(url):
+    """The API endpoint a url is for, with any DOI left out"""
+    path = url[len(config.DATACITE_API_URL):] if url.startswith(config.DATACITE_API_URL) else url
+    path = path.split('?', 1)[0]
+    if path == '/dois':
+        return '/dois'
+    if path.startswith('/dois/'):
+        return '/dois/{id}'
+    if path == '/clients':
+        return '/clients'
+    return 'other'
+
+
+def flush(force=False):
+    """Write this worker's counts to its file, unless they were written recently"""
+    if not config.METRICS_DIR:
+        return
+
+    with _FLUSH_LOCK:
+        now = time.monotonic()
+        wait = config.METRICS_FLUSH_INTERVAL - (now - _FLUSHED_AT['time'])
+        if not force and wait > 0:
+            schedule_flush(wait)
+            return
+        _FLUSHED_AT['time'] = now
+
+    write_json(worker_path(os.getpid()), registry.snapshot())
+
+
+def schedule_flush(delay):
+    """Flush after a delay, unless this process already has a flush scheduled"""
+    timer = _PENDING_FLUSH['timer']
+    if timer is not None and timer.is_alive() and _PENDING_FLUSH['pid'] == os.getpid():
+        return
+
+    timer = threading.Timer(delay, flush, kwargs={'force': True})
+    timer.daemon = True
+    timer.start()
+    _PENDING_FLUSH.update(timer=timer, pid=os.getpid())
+
+
+atexit.register(flush, force=True)
+
+
+def collect():
+    """The counts of every worker summed into one snapshot"""
+    if not config.METRICS_DIR:
+        return registry.snapshot()
+
+    flush(force=True)
+    snapshots = []
+
+    with directory_lock():
+        archive = read_json(os.path.join(config.METRICS_DIR, ARCHIVE_FILE))
+        exited = []
+
+        for name in os.listdir(config.METRICS_DIR):
+            pid = worker_pid(name)
+            if pid is None:
+                continue
+            snapshot = read_json(os.path.join(config.METRICS_DIR, name))
+            if snapshot is None:
+                continue
+            if pid_alive(pid):
+                snapshots.append(snapshot)
+            else:
+                exited.append((name, snapshot))
+
+        if exited:
+            # Fold the counts of exited workers into the archive, then forget them
+            archive = merge([archive] + [snapshot for _, snapshot in exited])
+            write_json(os.path.join(config.METRICS_DIR, ARCHIVE_FILE), archive)
+            for name, _ in exited:
+                os.remove(os.path.join(config.METRICS_DIR, name))
+
+    return merge([archive] + snapshots)
+
+
+def merge(snapshots):
+    """Sum snapshots into one"""
+    counters = {}
+    histograms = {}
+
+    for snapshot in snapshots:
+        if not snapshot:
+            continue
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, tuple(sorted(labels.items())))
+            total = histograms.get(key)
+            histograms[key] = histogram if total is None else [
+                a + b for a, b in zip(total, histogram)]
+
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), histogram]
+                       for (name, labels), histogram in histograms.items()],
+    }
+
+
+def render(snapshot):
+    """A snapshot in the Prometheus text exposition format
+
+    Series are sorted by their labels, a histogram's buckets are kept in
+    increasing order followed by its sum and count.
+    """
+    series = {name: [] for name in METRICS}
+
+    for name, labels, value in snapshot['counters']:
+        series[name].append((sorted(labels.items()), [sample(name, labels, value)]))
+
+    for name, labels, histogram in snapshot['histograms']:
+        buckets = METRICS[name][2]
+        cumulative = 0
+        lines = []
+        for bound, count in zip(buckets + ('+Inf',), histogram[:-1]):
+            cumulative += count
+            lines.append(sample(name + '_bucket', dict(labels, le=str(bound)), cumulative))
+        lines.append(sample(name + '_sum', labels, histogram[-1]))
+        lines.append(sample(name + '_count', labels, cumulative))
+        series[name].append((sorted(labels.items()), lines))
+
+    lines = []
+    for name, (metric_type, help_text, _) in METRICS.items():
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        for _, series_lines in sorted(series[name], key=lambda labelled: labelled[0]):
+            lines.extend(series_lines)
+
+    return '\n'.join(lines) + '\n'
+
+
+def sample(name, labels, value):
+    label_text = ','.join(
+        '%s="%s"' % (label, escape(str(label_value)))
+        for label, label_value in sorted(labels.items())
+    )
+    return '%s{%s} %s' % (name, label_text, value)
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def worker_path(pid):
+    return os.path.join(config.METRICS_DIR, 'worker-%d.json' % pid)
+
+
+def worker_pid(name):
+    """The pid of a worker's file name, None for any other file"""
+    if not (name.startswith('worker-') and name.endswith('.json')):
+        return None
+    pid = name[len('worker-'):-len('.json')]
+    return int(pid) if pid.isdigit() else None
+
+
+def pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextlib.contextmanager
+def directory_lock():
+    """Hold the lock of the metrics directory, kept while the archive is updated"""
+    with open(os.path.join(config.METRICS_DIR, LOCK_FILE), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_json(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    write_atomic(path, json.dumps(data).encode('utf-8'))
@@ -1,10 +1,15 @@
 """OAI-PMH main request handling"""
 
-from xml.dom import minidom
+import asyncio
+import contextvars
+import hashlib
+import inspect
+import threading
+from lxml import etree
 from lxml.etree import ElementTree, Element, SubElement
 
 from flask import (
-    Blueprint, g, request, current_app
+    Blueprint, request, current_app, stream_with_context
 )
 import oaipmh.common
 import oaipmh.metadata
@@ -12,10 +17,27 @@ import oaipmh.server
 import oaipmh.datestamp
 
 from .catalogs import DataCiteOAIServer
-from . import metadata
+from . import config, metadata, metrics, profiling, splice, timing
+from .resumption import sessions
+from .fragments import fragment_cache
 
 BP = Blueprint('oai', __name__)
 
+# Event loops used to drive an asynchronous catalog, one per thread.
+_LOOPS = threading.local()
+# HTTP validators of the request being handled, None until it succeeds
+_VALIDATORS = contextvars.ContextVar('oai_validators', default=None)
+
+# List verbs that can be written out record by record
+STREAMING_VERBS = ['ListIdentifiers', 'ListRecords']
+# Bytes of output collected before a chunk is sent when streaming
+STREAM_CHUNK_SIZE = 16 * 1024
+# Depth of a record's metadata element below the OAI-PMH root element
+RECORD_METADATA_LEVEL = 3
+# Element rendered metadata is serialized in, and cut from, to make a fragment
+FRAGMENT_START = b'<metadata xmlns:xsi="%s">' % metadata.NS_XSI.encode('utf-8')
+FRAGMENT_END = b'</metadata>'
+
 class XMLTreeServer(oaipmh.server.XMLTreeServer):
     def __init__(self, server, metadata_registry, nsmap=None):
         super(XMLTreeServer, self).__init__(
@@ -24,11 +46,17 @@ class XMLTreeServer(oaipmh.server.XMLTreeServer):
             nsmap)
 
     def _outputResuming(self, element, input_func, output_func, kw):
+        result, total_records, token, token_kw = self._inputResuming(input_func, kw)
+        output_func(element, result, token_kw)
+        self._outputResumptionToken(element, token, total_records)
+
+    def _inputResuming(self, input_func, kw):
         if 'resumptionToken' in kw:
             resumption_token = kw['resumptionToken']
             result, total_records, token = input_func(resumptionToken=resumption_token)
             # unpack keywords from resumption token
-            token_kw, dummy = oaipmh.server.decodeResumptionToken(resumption_token)
+            token_kw, dummy = oaipmh.server.decodeResumptionToken(
+                resolve_token(resumption_token))
         else:
             result, total_records, token = input_func(**kw)
 
@@ -36,15 +64,148 @@ class XMLTreeServer(oaipmh.server.XMLTreeServer):
                 raise oaipmh.error.NoRecordsMatchError(
                     "No records match for request.")
             token_kw = kw
-        output_func(element, result, token_kw)
+        return result, total_records, token, token_kw
+
+    def _outputResumptionToken(self, element, token, total_records):
         if token is not None:
             e_resumption_token = SubElement(element, '{%s}%s' % (metadata.NS_OAIPMH, 'resumptionToken'))
             e_resumption_token.text = token
             e_resumption_token.set('completeListSize', str(total_records))
 
+    def streamList(self, verb, kw, stylesheet=None):
+        """Returns a generator writing a ListRecords or ListIdentifiers response in chunks
+
+        The page of results is requested and the metadata format checked before
+        returning, so OAI-PMH errors are raised as usual; only the XML output of
+        each record is deferred.
+        """
+        envelope, e_verb = self._outputEnvelope(verb=verb, **kw)
+        input_func = oaipmh.common.getMethodForVerb(self._server, verb)
+        result, total_records, token, token_kw = self._inputResuming(input_func, kw)
+
+        metadata_prefix = token_kw.get('metadataPrefix')
+        if verb == 'ListRecords' and not self._metadata_registry.hasWriter(metadata_prefix):
+            # Raised while writing records otherwise, after the response has started
+            raise oaipmh.error.CannotDisseminateFormatError(
+                "Unknown metadata format: %s" % metadata_prefix)
+
+        return self._streamList(
+            envelope, e_verb, result, total_records, token, token_kw, stylesheet)
+
+    def _streamList(self, envelope, e_verb, result, total_records, token, token_kw, stylesheet):
+        e_oaipmh = envelope.getroot()
+        buffer = ChunkBuffer()
+        fragments = splice.Fragments()
+
+        with etree.xmlfile(buffer, encoding='UTF-8') as xml_file:
+            xml_file.write_declaration()
+            if stylesheet:
+                xml_file.write(stylesheet_instruction(stylesheet))
+
+            with xml_file.element(e_oaipmh.tag, dict(e_oaipmh.attrib), nsmap=e_oaipmh.nsmap):
+                xml_file.write('\n')
+                for e_child in e_oaipmh:
+                    if e_child is not e_verb:
+                        # Copied so only the OAI-PMH namespace is declared again
+                        e_copy = Element(e_child.tag, dict(e_child.attrib), nsmap=self._nsmap)
+                        e_copy.text = e_child.text
+                        xml_file.write(e_copy, pretty_print=True)
+
+                with xml_file.element(e_verb.tag):
+                    xml_file.write('\n')
+                    for item in result:
+                        # Each item is built in its own small tree that is
+                        # written out and discarded before the next one.
+                        e_items = Element(e_verb.tag, nsmap=self._nsmap)
+                        with splice.collecting(fragments):
+                            self._outputListItem(e_items, e_verb.tag, item, token_kw)
+                        for e_item in e_items:
+                            xml_file.write(e_item, pretty_print=True)
+
+                        if len(buffer) >= STREAM_CHUNK_SIZE:
+                            # Placeholders are only ever spliced whole
+                            xml_file.flush()
+                            yield fragments.splice(buffer.drain())
+
+                    e_token = Element(e_verb.tag, nsmap=self._nsmap)
+                    self._outputResumptionToken(e_token, token, total_records)
+                    for e_item in e_token:
+                        xml_file.write(e_item, pretty_print=True)
+
+                xml_file.write('\n')
+
+        yield fragments.splice(buffer.drain())
+
+    def _outputMetadata(self, element, metadata_prefix, metadata_):
+        with timing.span('write_metadata'):
+            self._writeMetadata(element, metadata_prefix, metadata_)
+
+    def _writeMetadata(self, element, metadata_prefix, metadata_):
+        record_key = getattr(metadata_.getMap(), 'record_key', None)
+        if not config.FRAGMENT_CACHE_ENABLED or record_key is None:
+            super(XMLTreeServer, self)._outputMetadata(element, metadata_prefix, metadata_)
+            return
+
+        if not self._metadata_registry.hasWriter(metadata_prefix):
+            raise oaipmh.error.CannotDisseminateFormatError(
+                "Unknown metadata format: %s" % metadata_prefix)
+
+        # Rendered metadata is cached by the version of the record it was rendered from
+        key = fragment_cache.key(record_key[0], record_key[1], metadata_prefix)
+        fragment = fragment_cache.get(key)
+        if fragment is None:
+            fragment = self._renderMetadata(metadata_prefix, metadata_)
+            fragment_cache.set(key, fragment)
+
+        e_metadata = SubElement(element, nsoai('metadata'))
+        placeholder = splice.insert(fragment)
+        if placeholder is not None:
+            e_metadata.append(placeholder)
+        else:
+            # Nothing is splicing the output, so the fragment is parsed back
+            e_metadata.extend(etree.fromstring(FRAGMENT_START + fragment + FRAGMENT_END))
+
+    def _renderMetadata(self, metadata_prefix, metadata_):
+        """Returns the serialized children of a record's metadata element
+
+        They are indented for the depth records are written at and rely on
+        the xsi namespace declared by the OAI-PMH root element.
+        """
+        e_metadata = Element('metadata', nsmap={'xsi': metadata.NS_XSI})
+        with splice.collecting() as fragments:
+            self._metadata_registry.writeMetadata(metadata_prefix, e_metadata, metadata_)
+        etree.indent(e_metadata, level=RECORD_METADATA_LEVEL)
+
+        rendered = fragments.splice(etree.tostring(e_metadata, encoding='UTF-8'))
+        return rendered[len(FRAGMENT_START):-len(FRAGMENT_END)].strip()
+
+    def _outputListItem(self, element, tag, item, token_kw):
+        if tag == nsoai('ListRecords'):
+            header, metadata_, _ = item
+            e_record = SubElement(element, nsoai('record'))
+            self._outputHeader(e_record, header)
+            if not header.isDeleted():
+                self._outputMetadata(e_record, token_kw['metadataPrefix'], metadata_)
+        else:
+            self._outputHeader(element, item)
+
 class Server(oaipmh.server.ServerBase):
-    """Expects to be initialized with a IOAI server implementation."""
-    def __init__(self, server, metadata_registry=None, nsmap=None):
+    """Expects to be initialized with a IOAI server implementation.
+
+    When a stylesheet href is given an xml-stylesheet processing instruction
+    pointing at it is written ahead of the OAI-PMH root element.
+
+    One server answers every request of an application, from any thread,
+    so the state of a request is kept in context variables instead.
+    """
+    def __init__(
+        self,
+        server,
+        metadata_registry=None,
+        nsmap=None,
+        stylesheet=None,
+        streaming=False
+    ):
         resumption_server = Resumption(server)
         super(Server, self).__init__(
             resumption_server,
@@ -52,6 +213,47 @@ class Server(oaipmh.server.ServerBase):
             nsmap)
         # Override the XML tree writing server for some custom output
         self._tree_server = XMLTreeServer(resumption_server, metadata_registry, nsmap)
+        self._resumption_server = resumption_server
+        self._stylesheet = stylesheet
+        self._streaming = streaming
+
+    def handle(self, request_kw):
+        """Returns the response to a request and its HTTP validators, None for errors"""
+        token = _VALIDATORS.set(None)
+        try:
+            return self.handleRequest(request_kw), _VALIDATORS.get()
+        finally:
+            _VALIDATORS.reset(token)
+
+    def handleVerb(self, verb, kw):
+        """Returns the serialized response, or a generator of chunks when streaming"""
+        _VALIDATORS.set(ResponseValidators(verb))
+
+        if self._streaming and verb in STREAMING_VERBS:
+            return self._tree_server.streamList(verb, kw, self._stylesheet)
+
+        method = oaipmh.common.getMethodForVerb(self._tree_server, verb)
+        with splice.collecting() as fragments:
+            tree = method(**kw)
+        with timing.span('serialize'):
+            return fragments.splice(self.serialize(tree))
+
+    def handleException(self, kw, exc_info):
+        # Error responses are never cached
+        _VALIDATORS.set(None)
+        _, value, _ = exc_info
+        return self.serialize(self._tree_server.handleException(value))
+
+    def serialize(self, tree):
+        """Serialize a response tree, including the stylesheet instruction"""
+        if self._stylesheet:
+            tree.getroot().addprevious(stylesheet_instruction(self._stylesheet))
+
+        return etree.tostring(
+            tree,
+            encoding='UTF-8',
+            xml_declaration=True,
+            pretty_print=True)
 
 class Resumption(oaipmh.common.ResumptionOAIPMH):
     """ A custom resumption server based on the pyoai implementation
@@ -66,14 +268,19 @@ class Resumption(oaipmh.common.ResumptionOAIPMH):
         # Get the method that matches the verb we want to call.
         method = oaipmh.common.getMethodForVerb(self._server, verb)
 
+        page = None
         if 'resumptionToken' in kw:
+            stateless_token = resolve_token(kw['resumptionToken'])
+            # A page prefetched for the token's session saves asking for it now
+            page = sessions.take(kw['resumptionToken'], verb)
             # Handling a resumption token, so work out arguments for next method
-            kw, _ = oaipmh.server.decodeResumptionToken(kw['resumptionToken'])
+            kw, _ = oaipmh.server.decodeResumptionToken(stateless_token)
 
         if verb in ['ListSets', 'ListIdentifiers', 'ListRecords']:
             # Call underlying method to get results
-            result, total_records, resume_cursor = method(**kw)
+            result, total_records, resume_cursor = page or resolve(method(**kw))
             kw['paging_cursor'] = resume_cursor
+            metrics.observe_page(verb, len(result))
 
             # When a cursor exists more results can be resumed, otherwise it's the end.
             if resume_cursor:
@@ -83,29 +290,168 @@ class Resumption(oaipmh.common.ResumptionOAIPMH):
             else:
                 token = "" # Provide a blank token as per oaipmh spec
 
+            validators = _VALIDATORS.get()
+            if validators is not None:
+                # Validators describe the page, whatever session it is sent with
+                validators.record(verb, kw, result, token)
+
+            if resume_cursor and verb != 'ListSets' and sessions.enabled:
+                next_kw = dict(kw)
+                token = sessions.start(verb, token, lambda: resolve(method(**next_kw)))
+
             # With paging verbs return a token
             return result, total_records, token
         else:
             # Call underlying method to get results
-            result = method(**kw)
+            result = resolve(method(**kw))
+
+            validators = _VALIDATORS.get()
+            if validators is not None:
+                validators.record(verb, kw, result)
+
             return result
 
-def get_oai_server():
+class ResponseValidators:
+    """HTTP validators describing the content of one OAI-PMH response
+
+    The ETag is a digest of what the response is built from: the record
+    headers for GetRecord and list pages, the sets for ListSets and the
+    repository description for Identify and ListMetadataFormats.
+    CACHE_VERSION is mixed in so a deploy changing the output can invalidate
+    all of them.
+    """
+    def __init__(self, verb):
+        self.verb = verb
+        self.etag = None
+        self.last_modified = None
+
+    def record(self, verb, kw, result, token=None):
+        """Record the validators from the result of the verb being responded to"""
+        # Other verbs are called internally, e.g. Identify for the base url
+        if verb != self.verb or self.etag is not None:
+            return
+
+        digest = hashlib.sha1()
+
+        def update(*values):
+            for value in values:
+                digest.update(str(value).encode('utf-8'))
+                digest.update(b'\0')
+
+        update(config.CACHE_VERSION, verb, kw.get('metadataPrefix', ''))
+
+        if verb == 'GetRecord':
+            header = result[0]
+            update_header(update, header)
+            self.last_modified = header.datestamp()
+        elif verb == 'ListRecords':
+            for header, _, _ in result:
+                update_header(update, header)
+        elif verb == 'ListIdentifiers':
+            for header in result:
+                update_header(update, header)
+        elif verb == 'ListSets':
+            for set_spec, set_name, _ in result:
+                update(set_spec, set_name)
+        elif verb == 'Identify':
+            update(result.repositoryName(), result.baseURL(), *result.adminEmails())
+        else:
+            update(result)
+
+        update(token)
+
+        self.etag = digest.hexdigest()
+
+def update_header(update, header):
+    update(header.identifier(), header.datestamp().isoformat(), header.isDeleted())
+
+class ChunkBuffer:
+    """Minimal file-like sink collecting streamed output until it is drained"""
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._size += len(data)
+
+    def __len__(self):
+        return self._size
+
+    def drain(self):
+        """Return all output written since the last drain"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        return data
+
+def stylesheet_instruction(href):
+    """Returns the xml-stylesheet processing instruction for a xsl href"""
+    return etree.PI('xml-stylesheet', 'type="text/xsl" href="%s"' % href)
+
+def nsoai(name):
+    return '{%s}%s' % (metadata.NS_OAIPMH, name)
+
+def resolve_token(token):
+    """Return the stateless token a resumptionToken resumes"""
+    stateless_token = sessions.resolve(token)
+    if stateless_token is None:
+        raise oaipmh.error.BadResumptionTokenError(
+            "The resumptionToken is unknown or has expired")
+    return stateless_token
+
+
+def resolve(result):
+    """Return the result of a catalog call, running it to completion if awaitable
+
+    pyoai serializes synchronously, so an asynchronous catalog is driven on an
+    event loop kept for the lifetime of the calling thread.
+    """
+    if not inspect.isawaitable(result):
+        return result
+
+    loop = getattr(_LOOPS, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _LOOPS.loop = loop
+
+    return loop.run_until_complete(result)
+
+def init_app(app):
+    """Build the OAI-PMH server an application's requests share"""
+    app.extensions['oai'] = build_oai_server(app.static_url_path)
+
+def build_oai_server(static_url_path):
     """Returns a pyoai server object that can process and return OAI requests"""
-    if 'oai' not in g:
+    if config.CATALOG_BACKEND == 'mirror':
+        from .services import mirror
+        catalog_server = DataCiteOAIServer(backend=mirror)
+    elif config.CATALOG_ASYNC:
+        from .services import datacite_async
+        catalog_server = DataCiteOAIServer(backend=datacite_async)
+    else:
         catalog_server = DataCiteOAIServer()
 
-        metadata_registry = oaipmh.metadata.MetadataRegistry()
-        metadata_registry.registerWriter('oai_dc', metadata.oai_dc_writer)
-        metadata_registry.registerWriter('oai_datacite', metadata.oai_datacite_writer)
-        metadata_registry.registerWriter('datacite', metadata.datacite_writer)
-        oai = Server(catalog_server, metadata_registry)
+    metadata_registry = oaipmh.metadata.MetadataRegistry()
+    metadata_registry.registerWriter('oai_dc', metadata.oai_dc_writer)
+    metadata_registry.registerWriter('oai_datacite', metadata.oai_datacite_writer)
+    metadata_registry.registerWriter('datacite', metadata.datacite_writer)
+    # xsl stylesheet from static url path
+    xsl_path = static_url_path + '/oaitohtml.xsl'
 
-        g.oai = oai
+    return Server(
+        catalog_server,
+        metadata_registry,
+        stylesheet=xsl_path,
+        streaming=config.STREAM_LIST_RESPONSES
+    )
 
-    return g.oai
+def get_oai_server():
+    """Returns the OAI-PMH server of the current application"""
+    return current_app.extensions['oai']
 
 @BP.route('/', methods=['GET', 'POST'])
+@profiling.profiled
 def index():
     """Root OAIPMH request handler"""
 
@@ -131,26 +477,65 @@ def index():
     if request.args.get('until'):
         oai_request_args['until'] = request.args.get('until')
 
-    current_app.logger.info("OAI request %s", oai_request_args['verb'], extra=oai_request_args)
-
     # Obtain a OAI-PMH server interface to handle requests
     oai = get_oai_server()
+    log_request = request_logger(oai_request_args)
 
     # Handle a request for a specific verb
-    xml = oai.handleRequest(oai_request_args)
-
-    # xsl stylesheet from static url path
-    xsl_path = current_app.static_url_path + '/oaitohtml.xsl'
-    full_xsl_instruction = 'type="text/xsl" href="%s"' % xsl_path
-
-    # This isn't the prettiest way but we need to add the xsl stylesheet
-    dom = minidom.parseString(xml)
-    process_instruction = dom.createProcessingInstruction(
-        'xml-stylesheet',
-        full_xsl_instruction
-    )
-    root = dom.firstChild
-    dom.insertBefore(process_instruction, root)
-    xml = dom.toxml()
-
-    return xml
+    try:
+        xml, validators = oai.handle(oai_request_args)
+    except Exception as exception:
+        log_request(exception)
+        raise
+
+    if isinstance(xml, bytes):
+        response = current_app.response_class(xml)
+    else:
+        # Streamed list responses are generators of chunks,
+        # working out their length would buffer the whole response.
+        response = current_app.response_class(stream_with_context(xml))
+        response.automatically_set_content_length = False
+
+    if not profiling.active():
+        # A profiled response names its profile, it mustn't be cached or revalidated
+        set_cache_headers(response, oai_request_args['verb'], validators)
+    response.call_on_close(log_request)
+
+    return response.make_conditional(request)
+
+@BP.route('/profiles/<name>')
+def profile(name):
+    """Download a stored request profile, with the profiling token"""
+    return profiling.download(name)
+
+def request_logger(oai_request_args):
+    """Returns a function logging the request once its response has been sent
+
+    The log line has the timing breakdown of sampled requests. A request that
+    fails is logged with its error and the breakdown so far.
+    """
+    logger = current_app.logger
+    recorder = timing.current()
+
+    def log_request(exception=None):
+        extra = dict(oai_request_args)
+        if recorder is not None:
+            extra['timing'] = recorder.breakdown()
+        if exception is not None:
+            extra['error'] = type(exception).__name__
+        logger.info("OAI request %s", oai_request_args['verb'], extra=extra)
+
+    return log_request
+
+def set_cache_headers(response, verb, validators):
+    """Set validators and cache lifetime for a successful OAI-PMH response"""
+    if validators is None:
+        return
+
+    # Weak as the responseDate differs and the body may be compressed
+    response.set_etag(validators.etag, weak=True)
+    if validators.last_modified:
+        response.last_modified = validators.last_modified
+
+    response.cache_control.public = True
+    response.cache_control.max_age = config.CACHE_MAX_AGE.get(verb, 0)
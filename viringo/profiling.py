@@ -0,0 +1,210 @@
+"""Profiles of single requests, asked for with a secret header
+
+A request whose PROFILE_HEADER is PROFILING_TOKEN is handled under a
+profiler, then its profile is stored in PROFILING_DIR and named in the
+PROFILE_ID_HEADER of the response. The response body is unchanged, but it
+has no validators and isn't stored by caches, as it names its own profile.
+Profiles are downloaded from /oai/profiles/<name> with the same header.
+Only the newest PROFILING_MAX_PROFILES are kept.
+
+Profiles are either cProfile pstats, the default, or with a
+PROFILE_FORMAT_HEADER of 'collapsed', stacks sampled from the request's
+thread in the collapsed format flamegraph tools read. Only the thread
+answering the request is profiled, upstream calls of the asynchronous
+catalog run on other threads and show as waits.
+"""
+
+import functools
+import hmac
+import os
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from flask import abort, g, request, send_from_directory
+
+from viringo import config
+
+PROFILE_HEADER = 'X-Viringo-Profile'
+PROFILE_FORMAT_HEADER = 'X-Viringo-Profile-Format'
+PROFILE_ID_HEADER = 'X-Viringo-Profile-Id'
+# Seconds between the stacks sampled for collapsed profiles
+SAMPLE_INTERVAL = 0.001
+
+
+class FunctionProfiler:
+    """cProfile of a request, saved as pstats"""
+
+    extension = 'pstats'
+
+    def __init__(self):
+        import cProfile
+        self._profile = cProfile.Profile()
+
+    def enable(self):
+        self._profile.enable()
+
+    def disable(self):
+        self._profile.disable()
+
+    def save(self, path):
+        self._profile.dump_stats(path)
+
+
+class StackSampler:
+    """Stacks of a thread sampled while enabled, saved as collapsed stacks"""
+
+    extension = 'collapsed'
+
+    def __init__(self, thread_id=None, interval=None):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval or SAMPLE_INTERVAL
+        self.stacks = Counter()
+        self._enabled = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._sample, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def enable(self):
+        self._enabled.set()
+
+    def disable(self):
+        self._enabled.clear()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            if not self._enabled.is_set():
+                continue
+            frame = sys._current_frames().get(self.thread_id) #pylint: disable=protected-access
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def save(self, path):
+        self._stopped.set()
+        self._thread.join()
+        with open(path, 'w') as profile_file:
+            for stack, count in sorted(self.stacks.items()):
+                profile_file.write('%s %d\n' % (stack, count))
+
+
+PROFILERS = {
+    'pstats': FunctionProfiler,
+    'collapsed': StackSampler,
+}
+
+
+def collapse(frame):
+    """A frame's stack, outermost first, as semicolon separated functions"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%d)' % (
+            code.co_name, code.co_filename.replace(';', '_'), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def requested():
+    """Whether the current request asks to be profiled with the right token"""
+    token = request.headers.get(PROFILE_HEADER)
+    if not token or not config.PROFILING_TOKEN:
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), config.PROFILING_TOKEN.encode('utf-8'))
+
+
+def profiled(view):
+    """Profile a view when the request asks for it, other requests only check a header"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if PROFILE_HEADER not in request.headers or not requested():
+            return view(*args, **kwargs)
+
+        profiler = PROFILERS.get(
+            request.headers.get(PROFILE_FORMAT_HEADER, 'pstats'), FunctionProfiler)()
+        g.profiled = True
+
+        profiler.enable()
+        try:
+            response = view(*args, **kwargs)
+        finally:
+            profiler.disable()
+
+        if response.is_streamed:
+            # Streamed records are written after the view returns
+            response.response = profile_chunks(profiler, response.response)
+
+        name = profile_name(request.args.get('verb', 'Identify'), profiler.extension)
+        response.headers[PROFILE_ID_HEADER] = name
+        response.cache_control.no_store = True
+        response.call_on_close(lambda: save(profiler, name))
+        return response
+
+    return wrapper
+
+
+def active():
+    """Whether the current request is being profiled"""
+    return g.get('profiled', False)
+
+
+def profile_chunks(profiler, chunks):
+    """Profile the writing of each chunk of a streamed response"""
+    iterator = iter(chunks)
+    try:
+        while True:
+            profiler.enable()
+            try:
+                chunk = next(iterator, None)
+            finally:
+                profiler.disable()
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # Let the wrapped iterable clean up, e.g. pop a streamed request context
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def profile_directory():
+    return config.PROFILING_DIR or os.path.join(tempfile.gettempdir(), 'viringo-profiles')
+
+
+def profile_name(verb, extension):
+    return '%s-%s-%s.%s' % (
+        time.strftime('%Y%m%dT%H%M%S'), verb if verb.isalpha() else 'other',
+        secrets.token_hex(4), extension)
+
+
+def save(profiler, name):
+    directory = profile_directory()
+    os.makedirs(directory, exist_ok=True)
+    profiler.save(os.path.join(directory, name))
+    prune(directory)
+
+
+def prune(directory):
+    """Remove the oldest profiles beyond PROFILING_MAX_PROFILES"""
+    try:
+        profiles = sorted(
+            (entry for entry in os.scandir(directory) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+
+    for entry in profiles[config.PROFILING_MAX_PROFILES:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            continue
+
+
+def download(name):
+    """Serve a stored profile to a request with the profiling token"""
+    if not requested():
+        abort(404)
+    return send_from_directory(profile_directory(), name, as_attachment=True)
@@ -0,0 +1,264 @@
+"""Server side resumption sessions with the next page fetched ahead
+
+When a list response has more results, a session is started for its
+resumptionToken and the next page is requested from the catalog in the
+background while the current page is sent. When the harvester comes back
+with the token the page is usually ready.
+
+Sessions need a directory shared by the workers, RESUMPTION_SESSION_DIR,
+as the harvester's next request may reach any worker. Prefetched pages are
+kept by the worker that fetched them and, once finished, written to the
+directory for whichever worker receives the next request. Session tokens
+are just the session id, the stateless token, the encoded request arguments
+and upstream cursor, is kept in the directory for as long as the token can
+be resumed.
+
+A session whose page has expired or been evicted is resumed from its
+stateless token just as before sessions existed.
+"""
+
+import logging
+import os
+import pickle
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from viringo import config
+from viringo.cache import LRUCache
+from viringo.utils import PerProcess, write_atomic
+
+# Marks a token as a session token, the stateless tokens never start with it
+SESSION_PREFIX = 'rs.'
+# Names the files keeping the stateless token of a session in a shared directory
+TOKEN_SUFFIX = '.token'
+# Approximate bytes held by a record of a prefetched page
+RECORD_SIZE_ESTIMATE = 16 * 1024
+
+
+def make_token(session_id):
+    return SESSION_PREFIX + session_id
+
+
+def session_id_of(token):
+    """Returns the session id of a resumptionToken, None for stateless tokens"""
+    if token.startswith(SESSION_PREFIX):
+        return token[len(SESSION_PREFIX):]
+    return None
+
+
+class Session:
+    """A prefetch of the page a resumptionToken resumes"""
+
+    def __init__(self, verb, stateless_token, future, expires_at):
+        self.verb = verb
+        self.stateless_token = stateless_token
+        self.future = future
+        self.expires_at = expires_at
+
+
+class DirectoryBackend:
+    """Prefetched pages shared between workers as files in a directory
+
+    Pages are pickled, so the directory must only be writable by viringo.
+    """
+
+    def __init__(self, directory, ttl, token_ttl):
+        self.directory = directory
+        self.ttl = ttl
+        self.token_ttl = token_ttl
+        self._pruned_at = 0
+
+    def path(self, session_id):
+        return os.path.join(self.directory, session_id)
+
+    def token_path(self, session_id):
+        return os.path.join(self.directory, session_id + TOKEN_SUFFIX)
+
+    def save_token(self, session_id, stateless_token):
+        """Keep the stateless token a session token resumes"""
+        write_atomic(self.token_path(session_id), stateless_token.encode('utf-8'))
+
+    def load_token(self, session_id):
+        """Returns the stateless token of a session, None if it's unknown or expired"""
+        path = self.token_path(session_id)
+        try:
+            with open(path, 'rb') as token_file:
+                stateless_token = token_file.read().decode('utf-8')
+            fresh = time.time() - os.stat(path).st_mtime <= self.token_ttl
+        except (OSError, UnicodeDecodeError):
+            return None
+
+        return stateless_token if fresh else None
+
+    def save(self, session_id, verb, stateless_token, page):
+        try:
+            write_atomic(self.path(session_id), pickle.dumps((verb, stateless_token, page)))
+        except (OSError, pickle.PicklingError):
+            logging.exception("Unable to share a prefetched page in %s", self.directory)
+
+        self.prune()
+
+    def take(self, session_id, verb, stateless_token):
+        """Returns a shared page and removes it, None if there isn't a current one"""
+        path = self.path(session_id)
+        try:
+            with open(path, 'rb') as page_file:
+                saved_verb, saved_token, page = pickle.load(page_file)
+            fresh = time.time() - os.stat(path).st_mtime <= self.ttl
+            os.remove(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if not fresh or saved_verb != verb or saved_token != stateless_token:
+            return None
+        return page
+
+    def discard(self, session_id):
+        try:
+            os.remove(self.path(session_id))
+        except OSError:
+            pass
+
+    def prune(self):
+        """Remove expired pages, at most once per ttl"""
+        now = time.time()
+        if now - self._pruned_at < self.ttl:
+            return
+        self._pruned_at = now
+
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+
+        for entry in entries:
+            ttl = self.token_ttl if entry.name.endswith(TOKEN_SUFFIX) else self.ttl
+            try:
+                if now - entry.stat().st_mtime > ttl:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+
+class SessionStore:
+    """Resumption sessions of a worker, bounded by count and approximate size
+
+    Without a directory sessions are only known to the worker that started
+    them, which is enough for tests but not for several workers.
+    """
+
+    def __init__(self, ttl, max_entries, max_bytes, workers, directory=None, token_ttl=None,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.workers = workers
+        self._clock = clock
+        self._sessions = LRUCache(
+            max_entries, max_bytes=max_bytes, sizeof=lambda session: page_size_estimate())
+        self.backend = DirectoryBackend(directory, ttl, token_ttl or ttl) if directory else None
+        self._executor = PerProcess(lambda: ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='resumption-prefetch'))
+
+    def get_executor(self):
+        """Return the thread pool pages are prefetched on, one per worker process"""
+        return self._executor.get()
+
+    def start(self, verb, stateless_token, fetch):
+        """Start prefetching the page a token resumes, returns the session token
+
+        fetch is called on a background thread and returns the page.
+        """
+        session_id = secrets.token_urlsafe(12)
+
+        if self.backend is not None:
+            try:
+                self.backend.save_token(session_id, stateless_token)
+            except OSError:
+                logging.exception("Unable to share a session in %s", self.backend.directory)
+                return stateless_token
+
+        future = self.get_executor().submit(self._prefetch, session_id, verb, stateless_token, fetch)
+        self._sessions.set(
+            session_id, Session(verb, stateless_token, future, self._clock() + self.ttl))
+
+        return make_token(session_id)
+
+    @property
+    def enabled(self):
+        """Whether list responses start sessions, only when they can be shared"""
+        return config.RESUMPTION_SESSIONS_ENABLED and self.backend is not None
+
+    def _prefetch(self, session_id, verb, stateless_token, fetch):
+        page = fetch()
+        if self.backend is not None:
+            self.backend.save(session_id, verb, stateless_token, page)
+        return page
+
+    def resolve(self, token):
+        """Returns the stateless token a resumptionToken resumes, None if it's unknown"""
+        session_id = session_id_of(token)
+        if session_id is None:
+            return token
+
+        session = self._sessions.get(session_id)
+        if session is not None:
+            return session.stateless_token
+        if self.backend is not None:
+            return self.backend.load_token(session_id)
+        return None
+
+    def take(self, token, verb):
+        """Returns the prefetched page for a session token, or None
+
+        None means the page has to be fetched, because the token is stateless,
+        the session is gone or the prefetch failed.
+        """
+        session_id = session_id_of(token)
+        if session_id is None:
+            return None
+
+        session = self._sessions.get(session_id)
+        self._sessions.delete(session_id)
+
+        if session is None:
+            stateless_token = self.resolve(token)
+            if stateless_token is None:
+                return None
+            return self.backend.take(session_id, verb, stateless_token)
+
+        try:
+            if session.verb != verb or self._clock() > session.expires_at:
+                session.future.cancel()
+                return None
+
+            try:
+                return session.future.result(timeout=config.DATACITE_API_READ_TIMEOUT)
+            except Exception: #pylint: disable=broad-except
+                logging.exception("Unable to prefetch the next page")
+                return None
+        finally:
+            if self.backend is not None:
+                # Answered here, the shared copy isn't needed by other workers
+                self.backend.discard(session_id)
+
+    def clear(self):
+        self._sessions.clear()
+
+    @property
+    def stats(self):
+        return self._sessions.stats
+
+
+def page_size_estimate():
+    """Approximate bytes held by a prefetched page"""
+    return config.RESULT_SET_SIZE * RECORD_SIZE_ESTIMATE
+
+
+sessions = SessionStore(
+    ttl=config.RESUMPTION_SESSION_TTL,
+    max_entries=config.RESUMPTION_SESSION_MAX_ENTRIES,
+    max_bytes=config.RESUMPTION_SESSION_MAX_BYTES,
+    workers=config.RESUMPTION_PREFETCH_WORKERS,
+    directory=config.RESUMPTION_SESSION_DIR,
+    token_ttl=config.RESUMPTION_TOKEN_TTL
+)
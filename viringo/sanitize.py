@@ -0,0 +1,70 @@
+"""Removal of characters that are not allowed in XML 1.0 documents
+
+Char ::= #x9 | #xA | #xD | [#x20-#xD7FF] | [#xE000-#xFFFD] | [#x10000-#x10FFFF]
+
+Almost every value is already valid, so the checks are arranged to make the
+clean case as cheap as possible and only build a new value when needed.
+"""
+
+import re
+
+# Everything outside the Char production, written as a positive class
+# because matching it is much cheaper than a negated class with astral ranges.
+INVALID_XML_CHARS = re.compile(
+    '[\u0000-\u0008\u000B\u000C\u000E-\u001F\uD800-\uDFFF￾￿]+'
+)
+
+# The same characters as they appear in UTF-8 encoded bytes.
+# Control characters are single bytes, encoded surrogates and the two
+# non-characters are three byte sequences.
+INVALID_XML_BYTES = re.compile(
+    b'(?:[\\x00-\\x08\\x0B\\x0C\\x0E-\\x1F]|\\xED[\\xA0-\\xBF][\\x80-\\xBF]|\\xEF\\xBF[\\xBE\\xBF])+'
+)
+
+# Byte order marks of UTF-16 and UTF-32, whose documents aren't UTF-8 bytes
+WIDE_BOMS = (b'\xff\xfe', b'\xfe\xff', b'\x00\x00\xfe\xff')
+DECLARATION = re.compile(rb'(?:\xef\xbb\xbf)?\s*<\?xml\s([^>]*)\?>')
+ENCODING = re.compile(rb'encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+UTF8_ENCODINGS = [b'utf-8', b'utf8', b'us-ascii', b'ascii']
+
+
+def clean_text(value):
+    """Return a string with any characters not allowed in XML removed"""
+    # Printable ASCII can never contain an invalid character
+    if value.isascii() and value.isprintable():
+        return value
+
+    if INVALID_XML_CHARS.search(value) is None:
+        return value
+
+    return INVALID_XML_CHARS.sub('', value)
+
+
+def is_utf8(raw_xml):
+    """Whether an XML document's bytes are UTF-8, by its byte order mark and declaration"""
+    # A wide encoding without a byte order mark still has a NUL byte in "<?"
+    if raw_xml.startswith(WIDE_BOMS) or b'\x00' in raw_xml[:4]:
+        return False
+
+    declaration = DECLARATION.match(raw_xml)
+    if declaration:
+        encoding = ENCODING.search(declaration.group(1))
+        if encoding and encoding.group(1).lower() not in UTF8_ENCODINGS:
+            return False
+
+    return True
+
+
+def clean_xml(raw_xml):
+    """Return a raw XML document, bytes or string, with invalid characters removed
+
+    Only UTF-8 bytes are cleaned, documents in other encodings are left to the
+    parser as they are.
+    """
+    if isinstance(raw_xml, str):
+        return clean_text(raw_xml)
+
+    if not is_utf8(raw_xml) or INVALID_XML_BYTES.search(raw_xml) is None:
+        return raw_xml
+
+    return INVALID_XML_BYTES.sub(b'', raw_xml)
@@ -2,17 +2,66 @@
 
 import base64
 import logging
+import threading
+import time
 from datetime import datetime
 from urllib.parse import urlparse, parse_qs
 from operator import itemgetter
-import dateutil.parser
-import dateutil.tz
 import requests
-from viringo import config
+from requests.adapters import HTTPAdapter
+from viringo import config, metrics, timing
+from viringo.cache import LRUCache
+from viringo.timestamps import parse_datetime
+from viringo.utils import PerProcess
+
+# Upstream HTTP session, one per worker process.
+_SESSION = PerProcess(lambda: build_session())
+
+
+# Shared default for empty list fields, never mutated so one is enough.
+EMPTY = ()
 
 
 class Metadata:
-    """Represents a DataCite metadata resultset"""
+    """Represents a DataCite metadata resultset
+
+    Results built from a JSON-API entry with from_entry only keep the entry,
+    each field is parsed from it the first time it is read. A ListIdentifiers
+    page never touches anything but the header fields and the raw xml
+    formats never parse the attributes.
+
+    Fields are slots rather than a per instance dict, as every page builds
+    a result for each of its records.
+    """
+
+    __slots__ = (
+        '_entry',
+        'identifier',
+        'created_datetime',
+        'updated_datetime',
+        'xml',
+        'metadata_version',
+        'titles',
+        'creators',
+        'subjects',
+        'descriptions',
+        'publisher',
+        'publication_year',
+        'dates',
+        'contributors',
+        'resource_types',
+        'funding_references',
+        'geo_locations',
+        'formats',
+        'identifiers',
+        'language',
+        'relations',
+        'rights',
+        'sizes',
+        'client',
+        'provider',
+        'active',
+    )
 
     def __init__(
         self,
@@ -43,118 +92,176 @@ class Metadata:
         active=True
     ):
 
+        self._entry = None
         self.identifier = identifier
         self.created_datetime = created_datetime or datetime.min
         self.updated_datetime = updated_datetime or datetime.min
         self.xml = xml
         self.metadata_version = metadata_version
-        self.titles = titles or []
-        self.creators = creators or []
-        self.subjects = subjects or []
-        self.descriptions = descriptions or []
+        self.titles = titles or EMPTY
+        self.creators = creators or EMPTY
+        self.subjects = subjects or EMPTY
+        self.descriptions = descriptions or EMPTY
         self.publisher = publisher
         self.publication_year = publication_year
-        self.dates = dates or []
-        self.contributors = contributors or []
-        self.resource_types = resource_types or []
-        self.funding_references = funding_references or []
-        self.geo_locations = geo_locations or []
-        self.formats = formats or []
-        self.identifiers = identifiers or []
+        self.dates = dates or EMPTY
+        self.contributors = contributors or EMPTY
+        self.resource_types = resource_types or EMPTY
+        self.funding_references = funding_references or EMPTY
+        self.geo_locations = geo_locations or EMPTY
+        self.formats = formats or EMPTY
+        self.identifiers = identifiers or EMPTY
         self.language = language
-        self.relations = relations or []
-        self.rights = rights or []
-        self.sizes = sizes or []
+        self.relations = relations or EMPTY
+        self.rights = rights or EMPTY
+        self.sizes = sizes or EMPTY
         self.client = client
         self.provider = provider
         self.active = active
 
+    @classmethod
+    def from_entry(cls, data):
+        """Metadata that parses its fields from a json-api data dict on demand"""
+        result = cls.__new__(cls)
+        result._entry = data
+        return result
+
+    def __getattr__(self, name):
+        # Only reached for fields that haven't been parsed yet.
+        parser = FIELD_PARSERS.get(name)
+        if parser is None or self._entry is None:
+            raise AttributeError(name)
+
+        value = timing.call('build_metadata', parser, self._entry)
+        setattr(self, name, value)
+        return value
+
 
 def build_metadata(data):
     """Parse single json-api data dict into metadata object"""
-    result = Metadata()
-    result.identifier = data.get('id')
+    return Metadata.from_entry(data)
 
-    attributes = data.get("attributes", {})
 
-    # Here we want to parse a ISO date but convert to UTC and then remove the TZinfo entirely
-    # This is because OAI always works in UTC.
-    created = dateutil.parser.parse(attributes['created'])
-    result.created_datetime = created.astimezone(
-        dateutil.tz.UTC).replace(tzinfo=None)
-    updated = dateutil.parser.parse(attributes['updated'])
-    result.updated_datetime = updated.astimezone(
-        dateutil.tz.UTC).replace(tzinfo=None)
+def copy_attribute(name, default=None):
+    """Field parser returning a DOI attribute as is
 
-    result.xml = base64.b64decode(attributes['xml']) \
-        if attributes['xml'] is not None else None
+    default is called to make the value when the attribute is missing.
+    """
+    def parse(data):
+        attributes = data.get('attributes', {})
+        if name in attributes:
+            return attributes[name]
+        return default() if default is not None else None
+    return parse
 
-    result.metadata_version = attributes.get('metadataVersion')
 
-    result.titles = [
-        title.get('title', '') for title in attributes.get('titles',[])
-    ]
+def parse_created(data):
+    # Attributes can be missing when only some fields were requested.
+    created = data.get('attributes', {}).get('created')
+    return parse_datetime(created) if created else datetime.min
 
-    result.creators = [
-        creator.get('name', '') for creator in attributes.get('creators',[])
-    ]
 
-    result.subjects = [
-        subject.get('subject', '') for subject in attributes.get('subjects', [])
-    ]
-    result.descriptions = [
-        description.get('description', '') for description in attributes.get('descriptions',[])
-    ]
+def parse_updated(data):
+    return parse_datetime(data['attributes']['updated'])
+
 
-    result.publisher = attributes.get('publisher', '')
-    result.publication_year = attributes.get('publicationYear', '')
+def parse_xml(data):
+    xml = data.get('attributes', {}).get('xml')
+    return base64.b64decode(xml) if xml is not None else None
 
-    result.dates = []
-    for date in attributes.get('dates',[]):
+
+def parse_dates(data):
+    dates = []
+    for date in data.get('attributes', {}).get('dates', []):
         type_ = date.get('dateType')
         value = date.get('date')
         if bool(type_) and bool(value) :
-            result.dates.append({
+            dates.append({
                 'type': type_,
                 'date': value
             })
+    return dates or EMPTY
 
-    result.contributors = attributes.get('contributors',[])
-    result.funding_references = attributes.get('fundingReferences',[])
-    result.sizes = attributes.get('sizes', [])
-    result.geo_locations = attributes.get('geoLocations', [])
 
-    result.resource_types = []
-    result.resource_types += [attributes['types'].get('resourceTypeGeneral')] \
-        if attributes['types'].get('resourceTypeGeneral') is not None else []
-    result.resource_types += [attributes['types'].get('resourceType')] \
-        if attributes['types'].get('resourceType') is not None else []
+def parse_resource_types(data):
+    types = data.get('attributes', {}).get('types') or {}
+    resource_types = []
+    resource_types += [types.get('resourceTypeGeneral')] \
+        if types.get('resourceTypeGeneral') is not None else []
+    resource_types += [types.get('resourceType')] \
+        if types.get('resourceType') is not None else []
+    return resource_types or EMPTY
 
-    result.formats = attributes.get('formats', [])
-    result.identifiers = identifiers_from_attributes(attributes)
-    result.language = attributes.get('language', '')
-    result.relations = relations_from_attributes(attributes)
 
-    result.rights = [
+def parse_rights(data):
+    rights_list = data.get('attributes', {}).get('rightsList')
+    if not rights_list:
+        return EMPTY
+    return [
         {
             'statement': right.get('rights'),
             'uri': right.get('rightsUri')
         }
-        for right in attributes.get('rightsList', [])
+        for right in rights_list
     ]
 
-    result.client = data['relationships']['client']['data'].get(
-        'id').upper() or ''
 
-    result.provider = data['relationships']['provider']['data'].get(
-        'id').upper() or ''
+def parse_relationship(name):
+    """Field parser returning the upper cased id of a related resource"""
+    def parse(data):
+        return data['relationships'][name]['data'].get('id').upper() or ''
+    return parse
+
 
+def parse_active(data):
     # We make the active decision based upon if there is metadata and the isActive flag
     # This is the same as the previous oai-pmh datacite implementation.
-    result.active = True if result.xml and attributes.get(
-        'isActive', True) else False
-
-    return result
+    # Checking the encoded xml is enough, there is no need to decode it.
+    # When the xml wasn't requested only the isActive flag can be used,
+    # registered and findable DOIs always have metadata.
+    attributes = data.get('attributes', {})
+    has_metadata = attributes.get('xml') if 'xml' in attributes else True
+    return True if has_metadata and attributes.get('isActive', True) else False
+
+
+def parse_list(name, key):
+    """Field parser returning one value from each entry of a DOI attribute list"""
+    def parse(data):
+        items = data.get('attributes', {}).get(name)
+        if not items:
+            return EMPTY
+        return [item.get(key, '') for item in items]
+    return parse
+
+
+# How each Metadata field is parsed from a json-api data dict
+FIELD_PARSERS = {
+    'identifier': lambda data: data.get('id'),
+    'created_datetime': parse_created,
+    'updated_datetime': parse_updated,
+    'xml': parse_xml,
+    'metadata_version': copy_attribute('metadataVersion'),
+    'titles': parse_list('titles', 'title'),
+    'creators': parse_list('creators', 'name'),
+    'subjects': parse_list('subjects', 'subject'),
+    'descriptions': parse_list('descriptions', 'description'),
+    'publisher': copy_attribute('publisher', str),
+    'publication_year': copy_attribute('publicationYear', str),
+    'dates': parse_dates,
+    'contributors': copy_attribute('contributors', tuple),
+    'resource_types': parse_resource_types,
+    'funding_references': copy_attribute('fundingReferences', tuple),
+    'geo_locations': copy_attribute('geoLocations', tuple),
+    'formats': copy_attribute('formats', tuple),
+    'identifiers': lambda data: identifiers_from_attributes(data.get('attributes', {})),
+    'language': copy_attribute('language', str),
+    'relations': lambda data: relations_from_attributes(data.get('attributes', {})),
+    'rights': parse_rights,
+    'sizes': copy_attribute('sizes', tuple),
+    'client': parse_relationship('client'),
+    'provider': parse_relationship('provider'),
+    'active': parse_active,
+}
 
 def relations_from_attributes(attributes):
     return identifiers_from_attributes(attributes,
@@ -200,7 +307,22 @@ def get_metadata(doi):
     Aside from the raw xml, the attributes parsed are best guesses for returning filled data.
     """
 
-    response = api_call_get(config.DATACITE_API_URL + '/dois/' + doi, None)
+    cached = record_cache.lookup(doi)
+    result = record_cache.serve(cached)
+    if result is not None:
+        return result
+
+    response = api_call_get(
+        config.DATACITE_API_URL + '/dois/' + doi,
+        None,
+        headers=record_cache.conditional_headers(cached)
+    )
+
+    return record_cache.update(doi, cached, response)
+
+
+def parse_metadata_response(response):
+    """Parse a /dois/{doi} response into a metadata object"""
 
     if response.status_code == 200:
         data = response.json()['data']
@@ -213,15 +335,170 @@ def get_metadata(doi):
     return None
 
 
+class CachedRecord:
+    """A parsed record along with the validators it was served with"""
+    def __init__(self, metadata, etag=None, last_modified=None, fetched_at=None):
+        self.metadata = metadata
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+
+class RecordCache:
+    """Cache of parsed single records keyed by DOI
+
+    Records are served without asking the API for ttl seconds, after that they
+    are revalidated with a conditional request so an unchanged record costs a
+    304 rather than a full payload transfer and parse.
+    """
+
+    def __init__(self, ttl, max_entries, max_bytes, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._cache = LRUCache(max_entries, max_bytes, sizeof=record_size)
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    @property
+    def evictions(self):
+        return self._cache.stats.evictions
+
+    def lookup(self, doi):
+        """Return the cached record for a DOI, fresh or not"""
+        return self._cache.get(doi)
+
+    def serve(self, cached):
+        """Return the metadata of a cached record if it is fresh enough to serve as is"""
+        if cached is not None and self._clock() - cached.fetched_at <= self.ttl:
+            self.hits += 1
+            return cached.metadata
+        return None
+
+    def conditional_headers(self, cached):
+        """Return the headers to revalidate a cached record with, if any"""
+        if cached is None:
+            return None
+
+        headers = {}
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+        return headers or None
+
+    def update(self, doi, cached, response):
+        """Update the cache from an API response and return the current metadata"""
+        if response.status_code == 304 and cached is not None:
+            self.revalidations += 1
+            self._cache.set(doi, CachedRecord(
+                cached.metadata, cached.etag, cached.last_modified, self._clock()
+            ))
+            return cached.metadata
+
+        self.misses += 1
+        result = parse_metadata_response(response)
+
+        if result is not None and response.status_code == 200:
+            self._cache.set(doi, CachedRecord(
+                result,
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+                self._clock()
+            ))
+        elif response.status_code == 404:
+            self._cache.delete(doi)
+
+        return result
+
+    def stats(self):
+        """Returns the hit, revalidation, miss and eviction counters"""
+        return {
+            'hits': self.hits,
+            'revalidations': self.revalidations,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def clear(self):
+        """Remove all cached records and reset the counters"""
+        self._cache.clear()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+
+def record_size(cached):
+    """Approximate number of bytes a cached record holds on to
+
+    Estimated from the JSON-API entry the record keeps, without parsing any of
+    its fields. The base64 xml is held as well as the document decoded from it,
+    and parsed attributes take about twice the length of their JSON.
+    """
+    entry = cached.metadata._entry #pylint: disable=protected-access
+    if entry is None:
+        xml = cached.metadata.xml
+        return 1024 + (2 * len(xml) if xml else 0)
+
+    attributes = entry.get('attributes') or {}
+    encoded = len(attributes.get('xml') or '')
+    others = sum(len(str(value)) for key, value in attributes.items() if key != 'xml')
+    return 1024 + encoded + encoded * 3 // 4 + 2 * others
+
+
+record_cache = RecordCache(
+    ttl=config.RECORD_CACHE_TTL,
+    max_entries=config.RECORD_CACHE_MAX_ENTRIES,
+    max_bytes=config.RECORD_CACHE_MAX_BYTES
+)
+
+metrics.register_cache('records', record_cache.stats)
+
+
 def get_metadata_list(
     query=None,
     provider_id=None,
     client_id=None,
     from_datetime=None,
     until_datetime=None,
-    cursor=None
+    cursor=None,
+    fields=None
+):
+    """Returns metadata in parsed metadata result from the DataCite API
+
+    fields limits the DOI attributes requested to those named,
+    when None all attributes including the xml are requested.
+    """
+
+    params = metadata_list_params(
+        query=query,
+        provider_id=provider_id,
+        client_id=client_id,
+        from_datetime=from_datetime,
+        until_datetime=until_datetime,
+        cursor=cursor,
+        fields=fields
+    )
+
+    url = config.DATACITE_API_URL + '/dois'
+
+    json, cursor = api_get_cursor(url, params)
+
+    results, total_records = parse_metadata_list(json)
+
+    return results, total_records, cursor
+
+
+def metadata_list_params(
+    query=None,
+    provider_id=None,
+    client_id=None,
+    from_datetime=None,
+    until_datetime=None,
+    cursor=None,
+    fields=None
 ):
-    """Returns metadata in parsed metadata result from the DataCite API"""
+    """Construct the /dois query params for a metadata list request"""
 
     # Trigger cursor navigation with a starting value
     if not cursor:
@@ -247,6 +524,13 @@ def get_metadata_list(
         'state': 'registered,findable',
     }
 
+    if fields is not None:
+        # Sparse fieldset, the xml is only ever sent with detail. The API may take
+        # any detail value as true, so it's left out, the API default, when not needed.
+        params['fields[dois]'] = ','.join(fields)
+        if 'xml' not in fields:
+            del params['detail']
+
     # Only use the provider id if we dont have a client id
     # Otherwise just send client_id
     if not client_id:
@@ -263,9 +547,11 @@ def get_metadata_list(
     if query:
         params['query'] = query
 
-    url = config.DATACITE_API_URL + '/dois'
+    return params
 
-    json, cursor = api_get_cursor(url, params)
+
+def parse_metadata_list(json):
+    """Parse a /dois json-api response into metadata objects and a total"""
 
     # handle response that is not dict
     if type(json) is not dict:
@@ -282,38 +568,68 @@ def get_metadata_list(
         result = build_metadata(doi_entry)
         results.append(result)
 
-    return results, total_records, cursor
+    return results, total_records
+
 
+def get_sets(updated_since=None):
+    """Returns sets that can be used for further sub dividing results
 
-def get_sets():
-    """Returns sets that can be used for further sub dividing results"""
+    When updated_since is given only the clients updated since then, and their
+    providers, are returned. None is returned when a page can't be fetched, as
+    part of the sets would look like sets having been removed.
+    """
 
     next_url = config.DATACITE_API_URL + '/clients'
 
-    results = []
+    pages = []
 
     while next_url:
-        params = {
-            'include': 'provider',
-            'page[size]': 1000,
-        }
+        params = sets_params(updated_since)
 
         json, next_url = api_get_paging_with_url(next_url, params)
 
-        if json:
-            data = json['data']  # clients
-            included = json['included']  # providers
+        if json is None:
+            return None
+
+        pages.append(json)
+
+    return parse_sets(pages)
 
-            for entry in data:
-                if entry['id'] not in results:
-                    results.append((entry['id'], entry['attributes']['name']))
 
-            for entry in included:
-                if entry['id'] not in results:
-                    results.append((entry['id'], entry['attributes']['name']))
+def sets_params(updated_since=None):
+    """Construct the /clients query params for a sets request"""
+    params = {
+        'include': 'provider',
+        'page[size]': 1000,
+    }
+
+    if updated_since:
+        params['query'] = "updated:[{0}+TO+*]".format(
+            updated_since.strftime('%Y-%m-%dT%H:%M:%SZ')
+        )
+
+    return params
+
+
+def parse_sets(pages):
+    """Parse /clients json-api response pages into sorted (id, name) sets"""
+
+    # Clients and providers share one namespace of set ids,
+    # the same provider is included on every page it has clients on.
+    sets = {}
+
+    for json in pages:
+        data = json['data']  # clients
+        included = json.get('included', [])  # providers
+
+        for entry in data:
+            sets.setdefault(entry['id'], entry['attributes']['name'])
+
+        for entry in included:
+            sets.setdefault(entry['id'], entry['attributes']['name'])
 
     # Sort the results, this should be relativly fast given sets tend to be a small subset.
-    results.sort(key=itemgetter(0))
+    results = sorted(sets.items(), key=itemgetter(0))
     total_results = len(results)
 
     return results, total_results
@@ -324,6 +640,12 @@ def api_get_cursor(url, params):
 
     response = api_call_get(url, params)
 
+    return parse_cursor_response(response)
+
+
+def parse_cursor_response(response):
+    """Parse a cursor paged response into the json and the next cursor"""
+
     if response.status_code == 200:
         json = response.json()
 
@@ -351,6 +673,12 @@ def api_get_paging_with_url(url, params):
 
     response = api_call_get(url, params)
 
+    return parse_paging_response(response)
+
+
+def parse_paging_response(response):
+    """Parse a url paged response into the json and the next url"""
+
     if response.status_code == 200:
         json = response.json()
         if 'links' in json:
@@ -361,8 +689,40 @@ def api_get_paging_with_url(url, params):
     else:
         logging.error("Error receiving data from datacite REST API")
 
+    return None, None
+
+
+def get_session():
+    """Return the pooled keep-alive session used for all calls to the API
+
+    A session is created lazily per process, so forked workers never share
+    sockets inherited from their parent.
+    """
+    return _SESSION.get()
+
+
+def build_session():
+    """Construct a new authenticated session with a sized connection pool"""
+    session = requests.Session()
+    session.auth = requests.auth.HTTPBasicAuth(
+        config.DATACITE_API_ADMIN_USERNAME, config.DATACITE_API_ADMIN_PASSWORD)
+
+    adapter = HTTPAdapter(
+        pool_connections=config.DATACITE_API_POOL_CONNECTIONS,
+        pool_maxsize=config.DATACITE_API_POOL_MAXSIZE
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def close_session():
+    """Close the pooled session, a new one is created on next use"""
+    _SESSION.reset(lambda session: session.close())
+
 
-def api_call_get(url, params=None):
+def api_call_get(url, params=None, headers=None):
     """Make authenticated get request to API with params"""
 
     if not params:
@@ -376,12 +736,95 @@ def api_call_get(url, params=None):
     payload_str = "&".join("%s=%s" % (k, v)
                             for k, v in params.items() if v is not None)
 
-    response = requests.get(
-        url,
-        params=payload_str,
-        auth=requests.auth.HTTPBasicAuth(
-            config.DATACITE_API_ADMIN_USERNAME, config.DATACITE_API_ADMIN_PASSWORD),
-        timeout=120
-    )
+    with timing.span('upstream'):
+        if not config.DATACITE_API_COALESCE:
+            return fetch(url, payload_str, headers)
+
+        key = (url, payload_str, tuple(sorted((headers or {}).items())))
+        return in_flight.call(key, lambda: fetch(url, payload_str, headers))
 
+
+def fetch(url, payload_str, headers):
+    """Make the get request to the API, its JSON is parsed once for every caller"""
+    started = time.perf_counter()
+    try:
+        response = get_session().get(
+            url,
+            params=payload_str,
+            headers=headers,
+            timeout=(config.DATACITE_API_CONNECT_TIMEOUT, config.DATACITE_API_READ_TIMEOUT)
+        )
+    except requests.RequestException:
+        metrics.observe_upstream(url, 'error', time.perf_counter() - started)
+        raise
+
+    metrics.observe_upstream(url, response.status_code, time.perf_counter() - started)
+    share_json(response)
     return response
+
+
+def share_json(response):
+    """Parse a response's JSON only the first time it is asked for"""
+    parse = response.json
+    parsed = []
+    lock = threading.Lock()
+
+    def json(**kwargs):
+        with lock:
+            if not parsed:
+                parsed.append(parse(**kwargs))
+        return parsed[0]
+
+    response.json = json
+
+
+class InFlight:
+    """Identical concurrent calls coalesced into one
+
+    The first caller with a key makes the call, callers arriving with the
+    same key while it is in flight wait for it and share its result or
+    exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def call(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = InFlightCall()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            metrics.observe_coalesced(key[0])
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+class InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+in_flight = InFlight()
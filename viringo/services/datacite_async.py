@@ -0,0 +1,133 @@
+"""Asynchronous interface to the DataCite REST Service for retrieving metadata
+
+Mirrors the record functions of viringo.services.datacite, so it can be the
+backend of a catalog, and get_sets, which the set catalogue loads sets with.
+Request building and response parsing are shared with the blocking functions.
+Upstream calls are dispatched on the pooled keep-alive session through a
+per-worker thread pool without blocking the event loop. A record request
+makes one call at a time, so it is no faster than the blocking backend; the
+pages of /clients are fetched at the same time.
+"""
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from viringo import config, timing
+from viringo.utils import PerProcess
+from . import datacite
+
+# Upstream call executor, one per worker process.
+# Never runs more calls at once than the pool can keep alive.
+_EXECUTOR = PerProcess(lambda: ThreadPoolExecutor(
+    max_workers=config.DATACITE_API_POOL_MAXSIZE,
+    thread_name_prefix='datacite-api'
+))
+
+
+def get_executor():
+    """Return the thread pool upstream calls are dispatched on"""
+    return _EXECUTOR.get()
+
+
+async def api_call_get(url, params=None, headers=None):
+    """Make authenticated get request to API with params without blocking the loop"""
+    loop = asyncio.get_running_loop()
+    recorder = timing.current()
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(
+            get_executor(),
+            functools.partial(datacite.api_call_get, url, params, headers=headers)
+        )
+    finally:
+        if recorder is not None:
+            # Calls can overlap, so their times are added rather than nested
+            recorder.add('upstream', time.perf_counter() - started)
+
+
+async def get_metadata(doi):
+    """Return a parsed metadata result from the DataCite API"""
+
+    record_cache = datacite.record_cache
+
+    cached = record_cache.lookup(doi)
+    result = record_cache.serve(cached)
+    if result is not None:
+        return result
+
+    response = await api_call_get(
+        config.DATACITE_API_URL + '/dois/' + doi,
+        None,
+        headers=record_cache.conditional_headers(cached)
+    )
+
+    return record_cache.update(doi, cached, response)
+
+
+async def get_metadata_list(
+    query=None,
+    provider_id=None,
+    client_id=None,
+    from_datetime=None,
+    until_datetime=None,
+    cursor=None,
+    fields=None
+):
+    """Returns metadata in parsed metadata result from the DataCite API"""
+
+    params = datacite.metadata_list_params(
+        query=query,
+        provider_id=provider_id,
+        client_id=client_id,
+        from_datetime=from_datetime,
+        until_datetime=until_datetime,
+        cursor=cursor,
+        fields=fields
+    )
+
+    response = await api_call_get(config.DATACITE_API_URL + '/dois', params)
+    json, cursor = datacite.parse_cursor_response(response)
+
+    results, total_records = datacite.parse_metadata_list(json)
+
+    return results, total_records, cursor
+
+
+
+async def get_sets(updated_since=None):
+    """Returns sets that can be used for further sub dividing results
+
+    The first /clients page tells us how many pages there are, the remaining
+    pages are then all requested at the same time. None is returned when a
+    page can't be fetched, as with datacite.get_sets.
+    """
+
+    url = config.DATACITE_API_URL + '/clients'
+
+    first_page = await get_sets_page(url, 1, updated_since)
+    if first_page is None:
+        return None
+
+    total_pages = first_page.get('meta', {}).get('totalPages') or 1
+
+    other_pages = await asyncio.gather(*[
+        get_sets_page(url, number, updated_since) for number in range(2, total_pages + 1)
+    ])
+    if any(page is None for page in other_pages):
+        return None
+
+    return datacite.parse_sets([first_page] + other_pages)
+
+
+async def get_sets_page(url, number, updated_since=None):
+    """Returns the json for a single numbered /clients page"""
+
+    params = datacite.sets_params(updated_since)
+    params['page[number]'] = number
+
+    response = await api_call_get(url, params)
+    json, _ = datacite.parse_paging_response(response)
+
+    return json
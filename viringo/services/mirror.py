@@ -0,0 +1,298 @@
+"""Local SQLite mirror of DataCite DOIs for serving list requests
+
+A sync job copies DOIs incrementally, by their updated time, from the DataCite
+API into an indexed SQLite database. ListRecords and ListIdentifiers pages are
+then read from the database with keyset pagination on (updated, doi), which
+costs the same for the last page of a harvest as for the first. The total a
+list has is counted for its first page and carried in the cursor after that.
+
+The module has the same get_metadata and get_metadata_list functions as
+viringo.services.datacite so it can be used as a catalog backend. Sets defined
+by a search query can't be answered locally and are passed on to the API,
+as are single records.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from viringo import config
+from . import datacite
+
+# Overlap used when syncing updated DOIs to allow for clock differences.
+SYNC_OVERLAP = timedelta(minutes=5)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dois (
+    doi TEXT PRIMARY KEY,
+    client TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    active INTEGER NOT NULL,
+    xml BLOB,
+    attributes TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dois_updated ON dois (updated, doi);
+CREATE INDEX IF NOT EXISTS dois_client_updated ON dois (client, updated, doi);
+CREATE INDEX IF NOT EXISTS dois_provider_updated ON dois (provider, updated, doi);
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Requested fields that are stored as columns of their own
+HEADER_COLUMNS = ['updated', 'isActive', 'client', 'provider', 'xml']
+
+# Database connections, one per thread and database path.
+_CONNECTIONS = threading.local()
+
+
+class MirrorSyncError(Exception):
+    pass
+
+
+def get_connection(path=None):
+    """Return this thread's connection to the mirror database, creating it if needed"""
+    path = path or config.MIRROR_DATABASE
+
+    connections = getattr(_CONNECTIONS, 'connections', None)
+    if connections is None or _CONNECTIONS.pid != os.getpid():
+        # Connections can't be shared with a forked worker.
+        connections = _CONNECTIONS.connections = {}
+        _CONNECTIONS.pid = os.getpid()
+
+    connection = connections.get(path)
+    if connection is None:
+        connection = sqlite3.connect(path)
+        connection.row_factory = sqlite3.Row
+        # Let requests read while the sync job writes
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+        connections[path] = connection
+
+    return connection
+
+
+def close_connections():
+    """Close this thread's mirror database connections"""
+    connections = getattr(_CONNECTIONS, 'connections', None) or {}
+    for connection in connections.values():
+        connection.close()
+    connections.clear()
+
+
+def get_metadata(doi):
+    """Return a parsed metadata result, single records always come from the API"""
+    return datacite.get_metadata(doi)
+
+
+def get_metadata_list(
+    query=None,
+    provider_id=None,
+    client_id=None,
+    from_datetime=None,
+    until_datetime=None,
+    cursor=None,
+    fields=None
+):
+    """Returns a page of metadata results from the mirror, their total and the next cursor
+
+    The cursor is the total and the (updated, doi) of the last result on the
+    previous page.
+    """
+
+    if query:
+        return datacite.get_metadata_list(
+            query=query,
+            provider_id=provider_id,
+            client_id=client_id,
+            from_datetime=from_datetime,
+            until_datetime=until_datetime,
+            cursor=cursor,
+            fields=fields
+        )
+
+    conditions = []
+    values = []
+
+    if client_id:
+        conditions.append('client = ?')
+        values.append(client_id.upper())
+    elif provider_id:
+        conditions.append('provider = ?')
+        values.append(provider_id.upper())
+
+    if from_datetime:
+        conditions.append('updated >= ?')
+        values.append(format_updated(from_datetime))
+    if until_datetime:
+        conditions.append('updated <= ?')
+        values.append(format_updated(until_datetime))
+
+    connection = get_connection()
+
+    where = ' AND '.join(conditions) or '1'
+    total_records, after = parse_cursor(cursor)
+    if total_records is None:
+        # Counting is a scan of the matching DOIs, so only the first page does it
+        total_records = connection.execute(
+            'SELECT COUNT(*) FROM dois WHERE ' + where, values).fetchone()[0]
+
+    if after:
+        conditions.append('(updated, doi) > (?, ?)')
+        values.extend(after)
+        where = ' AND '.join(conditions)
+
+    # Only read the columns the requested fields need
+    columns = 'doi, client, provider, updated, active'
+    if fields is None or 'xml' in fields:
+        columns += ', xml'
+    if fields is None or set(fields) - set(HEADER_COLUMNS):
+        columns += ', attributes'
+
+    # One more than a page tells us whether there is a next page
+    rows = connection.execute(
+        'SELECT ' + columns + ' FROM dois WHERE ' + where +
+        ' ORDER BY updated, doi LIMIT ?',
+        values + [config.RESULT_SET_SIZE + 1]
+    ).fetchall()
+
+    next_cursor = None
+    if len(rows) > config.RESULT_SET_SIZE:
+        rows = rows[:config.RESULT_SET_SIZE]
+        next_cursor = format_cursor(total_records, rows[-1]['updated'], rows[-1]['doi'])
+
+    return [build_metadata(row) for row in rows], total_records, next_cursor
+
+
+def build_metadata(row):
+    """Build a metadata result from a mirror row"""
+    keys = row.keys()
+    attributes = json.loads(row['attributes']) if 'attributes' in keys else {}
+
+    result = datacite.Metadata.from_entry({
+        'id': row['doi'],
+        'attributes': attributes,
+        'relationships': {
+            'client': {'data': {'id': row['client']}},
+            'provider': {'data': {'id': row['provider']}},
+        }
+    })
+
+    # Fields kept in columns are set directly, so they are never parsed.
+    result.updated_datetime = datetime.fromisoformat(row['updated'])
+    result.active = bool(row['active'])
+    if 'xml' in keys:
+        result.xml = row['xml']
+
+    return result
+
+
+def format_updated(value):
+    """Format a datetime the way updated times are stored, so they sort as strings"""
+    return value.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def format_cursor(total_records, updated, doi):
+    return '%d,%s,%s' % (total_records, updated, doi)
+
+
+def parse_cursor(cursor):
+    """Returns the total of a cursor's list and the (updated, doi) it resumes after
+
+    Both are None to start at the beginning. Cursors from before the total was
+    carried have no total, so it is counted again.
+    """
+    if not cursor or ',' not in str(cursor):
+        return None, None
+
+    total_records, rest = str(cursor).split(',', 1)
+    if not total_records.isdigit():
+        updated, doi = str(cursor).split(',', 1)
+        return None, (updated, doi)
+
+    updated, doi = rest.split(',', 1)
+    return int(total_records), (updated, doi)
+
+
+def sync(full=False, path=None):
+    """Copy DOIs updated since the last sync from the DataCite API into the mirror
+
+    Returns the number of DOIs stored. The first sync, or a full one, copies
+    every DOI.
+    """
+    connection = get_connection(path)
+
+    started = datetime.utcnow()
+    since = None if full else last_synced(connection)
+    if since is not None:
+        since -= SYNC_OVERLAP
+
+    url = config.DATACITE_API_URL + '/dois'
+    cursor = None
+    stored = 0
+
+    while True:
+        params = datacite.metadata_list_params(from_datetime=since, cursor=cursor)
+        params['page[size]'] = config.MIRROR_SYNC_PAGE_SIZE
+
+        response = datacite.api_call_get(url, params)
+        if response.status_code != 200:
+            # Leave the sync state alone so the next sync tries again
+            raise MirrorSyncError(
+                "Unable to sync DOIs, the API responded with %s" % response.status_code)
+
+        data, cursor = datacite.parse_cursor_response(response)
+        if not data or not data['data']:
+            break
+
+        with connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO dois '
+                '(doi, client, provider, updated, active, xml, attributes) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [entry_row(entry) for entry in data['data']]
+            )
+        stored += len(data['data'])
+        logging.info("Mirrored %s DOIs", stored)
+
+        if not cursor:
+            break
+
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)',
+            ('synced_at', started.isoformat())
+        )
+
+    return stored
+
+
+def entry_row(entry):
+    """The mirror row values for a json-api DOI entry"""
+    result = datacite.build_metadata(entry)
+
+    # The xml is kept decoded in its own column
+    attributes = dict(entry['attributes'])
+    attributes.pop('xml', None)
+
+    return (
+        result.identifier,
+        result.client,
+        result.provider,
+        format_updated(result.updated_datetime),
+        int(result.active),
+        result.xml,
+        json.dumps(attributes)
+    )
+
+
+def last_synced(connection):
+    """Returns when the last sync started, None if the mirror was never synced"""
+    row = connection.execute(
+        "SELECT value FROM sync_state WHERE name = 'synced_at'").fetchone()
+    return datetime.fromisoformat(row['value']) if row else None
@@ -0,0 +1,152 @@
+"""In memory catalogue of the sets available from the DataCite API
+
+Sets change rarely but a ListSets harvest pages through them many times, so
+the full list is kept per worker and served from memory. Once the catalogue
+is older than its TTL the stale copy keeps being served while a background
+refresh fetches only the clients updated since the last refresh. The pages of
+/clients are fetched at the same time by the asynchronous service.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from operator import itemgetter
+
+from viringo import config
+from . import datacite_async
+
+# Overlap used when asking for updated clients to allow for clock differences.
+INCREMENTAL_OVERLAP = timedelta(minutes=5)
+
+
+class SetCatalogue:
+    """Cached sorted list of (set id, set name) with stale-while-revalidate refresh"""
+
+    def __init__(self, ttl, max_stale, full_refresh_interval, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.full_refresh_interval = full_refresh_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self.reset()
+
+    def reset(self):
+        """Drop all cached sets, the next request loads them again"""
+        with self._lock:
+            self._sets = {}
+            self._results = []
+            self.loaded_at = None
+            self.full_loaded_at = None
+            self.updated_since = None
+            # Changes whenever the contents of the catalogue change
+            self.version = 0
+
+    def get(self):
+        """Return the sorted sets and their total, refreshing them as needed"""
+        if self.needs_load():
+            # Nothing usable to serve, so the caller has to wait.
+            with self._load_lock:
+                if self.needs_load():
+                    self.refresh()
+        elif self.age() > self.ttl:
+            self.refresh_in_background()
+
+        results = self._results
+        return results, len(results)
+
+    def age(self):
+        """Seconds since the catalogue was last refreshed, None if never loaded"""
+        loaded_at = self.loaded_at
+        if loaded_at is None:
+            return None
+        return self._clock() - loaded_at
+
+    def needs_load(self):
+        """True when the catalogue can not be served without loading it first"""
+        age = self.age()
+        return age is None or age > self.max_stale
+
+    def refresh_in_background(self):
+        """Start a refresh on a background thread unless one is running"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        thread = threading.Thread(
+            target=self._background_refresh, name='set-catalogue-refresh', daemon=True)
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            with self._load_lock:
+                self.refresh()
+        except Exception: #pylint: disable=broad-except
+            logging.exception("Unable to refresh set catalogue")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def refresh(self):
+        """Refresh the catalogue, incrementally when a recent full load exists
+
+        When the API fails the catalogue is left as it was.
+        """
+        started = self._clock()
+        started_utc = datetime.utcnow()
+
+        full = self.full_loaded_at is None or \
+            started - self.full_loaded_at > self.full_refresh_interval
+
+        if full:
+            found = asyncio.run(datacite_async.get_sets())
+        else:
+            found = asyncio.run(datacite_async.get_sets(
+                updated_since=self.updated_since - INCREMENTAL_OVERLAP))
+
+        if found is None:
+            # The sets already loaded are kept, and refreshed again on a later request
+            logging.error("Unable to refresh set catalogue, keeping the current sets")
+            return
+
+        if full:
+            self.replace(found[0], started, started_utc)
+        else:
+            self.merge(found[0], started, started_utc)
+
+    def replace(self, results, loaded_at=None, loaded_at_utc=None):
+        """Replace the whole catalogue with the given (id, name) sets"""
+        loaded_at = self._clock() if loaded_at is None else loaded_at
+        with self._lock:
+            self._sets = dict(results)
+            self._publish()
+            self.loaded_at = loaded_at
+            self.full_loaded_at = loaded_at
+            self.updated_since = loaded_at_utc or datetime.utcnow()
+
+    def merge(self, results, loaded_at=None, loaded_at_utc=None):
+        """Add or update the given (id, name) sets in the catalogue"""
+        loaded_at = self._clock() if loaded_at is None else loaded_at
+        with self._lock:
+            changed = any(self._sets.get(key) != name for key, name in results)
+            if changed:
+                self._sets.update(results)
+                self._publish()
+            self.loaded_at = loaded_at
+            self.updated_since = loaded_at_utc or datetime.utcnow()
+
+    def _publish(self):
+        # Readers take a reference to the list, so it is replaced, never mutated.
+        self._results = sorted(self._sets.items(), key=itemgetter(0))
+        self.version += 1
+
+
+catalogue = SetCatalogue(
+    ttl=config.SETS_CACHE_TTL,
+    max_stale=config.SETS_CACHE_MAX_STALE,
+    full_refresh_interval=config.SETS_FULL_REFRESH_INTERVAL
+)
@@ -0,0 +1,146 @@
+"""Splicing of raw XML documents into serialized responses
+
+The datacite formats embed the resource XML exactly as it was registered.
+Parsing it into a tree only for it to be serialized again is the main cost
+of writing those records, so the writers instead leave a placeholder
+processing instruction and the raw document is substituted into the
+serialized output.
+
+A registered document is a complete document, every prefix it uses is
+declared within it, so it means the same wherever it is spliced. A document
+without a default namespace is written out just as lxml writes the parsed
+tree, which doesn't declare an empty default namespace either.
+"""
+
+import contextlib
+import contextvars
+import re
+import secrets
+from lxml import etree
+
+from viringo import config
+from viringo.sanitize import is_utf8
+
+# Placeholders are viringo-splice-<nonce> processing instructions, the nonce is
+# random for each response so a record's own XML can't name a placeholder.
+PLACEHOLDER_TARGET = 'viringo-splice-'
+PLACEHOLDER = re.compile(rb'<\?viringo-splice-([0-9a-f]+) (\d+)\?>')
+
+# Optional byte order mark, XML declaration and whitespace ahead of the root
+PROLOG = re.compile(rb'(?:\xef\xbb\xbf)?\s*(?:<\?xml\s([^>]*)\?>)?\s*')
+# The root start tag, its name and whether it is an empty element
+ROOT = re.compile(
+    rb'<([^\s/>!?]+)(?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*\s*(/?)>'
+)
+
+# Raw documents of the response currently being written
+_FRAGMENTS = contextvars.ContextVar('splice_fragments', default=None)
+
+
+class Fragments:
+    """Raw documents waiting to replace their placeholders in the output"""
+
+    def __init__(self):
+        self._documents = {}
+        self._next_index = 0
+        self.nonce = secrets.token_hex(8)
+        self._target = PLACEHOLDER_TARGET + self.nonce
+
+    def add(self, document):
+        """Register a document, returning its placeholder processing instruction"""
+        index = self._next_index
+        self._next_index += 1
+        self._documents[index] = document
+        return etree.ProcessingInstruction(self._target, str(index))
+
+    def splice(self, data):
+        """Replace the placeholders in serialized output with their documents
+
+        Each document is released once it has been written. Anything that only
+        looks like one of the placeholders is left as it is.
+        """
+        if not self._documents:
+            return data
+
+        return PLACEHOLDER.sub(self._document, data)
+
+    def _document(self, match):
+        if match.group(1).decode('ascii') != self.nonce:
+            return match.group(0)
+        return self._documents.pop(int(match.group(2)), match.group(0))
+
+    def __len__(self):
+        return len(self._documents)
+
+
+@contextlib.contextmanager
+def collecting(fragments=None):
+    """Collect the documents writers register while the block runs"""
+    fragments = Fragments() if fragments is None else fragments
+    token = _FRAGMENTS.set(fragments)
+    try:
+        yield fragments
+    finally:
+        _FRAGMENTS.reset(token)
+
+
+def placeholder(raw_xml):
+    """Returns a placeholder to splice a raw document in at, or None
+
+    None means the document has to be parsed and added as a tree, because
+    splicing is turned off, nothing is collecting, or it fails the check.
+    """
+    fragments = _FRAGMENTS.get()
+    if fragments is None or not config.RAW_XML_SPLICE:
+        return None
+
+    document = root_document(raw_xml)
+    if document is None:
+        return None
+
+    return fragments.add(document)
+
+
+def insert(document):
+    """Returns a placeholder to splice an already checked document in at, or None"""
+    fragments = _FRAGMENTS.get()
+    if fragments is None:
+        return None
+
+    return fragments.add(document)
+
+
+def root_document(raw_xml):
+    """The UTF-8 bytes of a document's root element, None if it can't be spliced
+
+    Unless the check is turned off the root element has to be closed at
+    the very end, the content in between is trusted. Anything unusual in the
+    prolog, such as a DOCTYPE or a different encoding, is left to the parser.
+    """
+    # A declared encoding only matters for documents that are still bytes
+    check_encoding = not isinstance(raw_xml, str)
+    if not check_encoding:
+        raw_xml = raw_xml.encode('utf-8')
+
+    if check_encoding and not is_utf8(raw_xml):
+        return None
+
+    prolog = PROLOG.match(raw_xml)
+
+    document = raw_xml[prolog.end():].rstrip()
+
+    if config.RAW_XML_CHECK == 'none':
+        root_start = document[:2]
+        return document if root_start[:1] == b'<' and root_start not in (b'<!', b'<?') else None
+
+    root = ROOT.match(document)
+    if root is None:
+        return None
+
+    if root.group(2):
+        return document if root.end() == len(document) else None
+
+    if not document.endswith(b'</' + root.group(1) + b'>'):
+        return None
+
+    return document
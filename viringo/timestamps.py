@@ -0,0 +1,29 @@
+"""Parsing of the ISO 8601 timestamps in DataCite API responses
+
+The API always writes timestamps like 2019-01-02T03:04:05.000Z, which the
+standard library parses far faster than dateutil's general purpose parser.
+Anything else is still handed to dateutil, imported the first time it is.
+"""
+
+from datetime import datetime, timezone
+
+
+def parse_datetime(value):
+    """Parse an ISO date, converted to UTC and then with the TZinfo removed entirely
+
+    This is because OAI always works in UTC.
+    """
+    try:
+        # fromisoformat only understands a Z suffix from Python 3.11
+        if value.endswith('Z'):
+            parsed = datetime.fromisoformat(value[:-1] + '+00:00')
+        else:
+            parsed = datetime.fromisoformat(value)
+    except ValueError:
+        import dateutil.parser
+        parsed = dateutil.parser.parse(value)
+
+    if parsed.tzinfo is timezone.utc:
+        return parsed.replace(tzinfo=None)
+
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None)
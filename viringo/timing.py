@@ -0,0 +1,122 @@
+"""Breakdown of where the time of a request goes, by stage
+
+A sample of requests, TIMING_SAMPLE_RATE of them, get a recorder that the
+stages of answering a request report their time to. Stages nested in another
+stage, such as a record being parsed while its metadata is written, count
+toward the inner stage only, so the durations add up.
+
+The breakdown is sent in the Server-Timing header and added to the request's
+log line. A streamed response sends its headers before writing its records,
+so only its log line has the time taken writing them.
+"""
+
+import contextlib
+import contextvars
+import random
+import time
+
+from flask import g
+
+from viringo import config
+
+# Recorder of the request being answered, None when it wasn't sampled
+_RECORDER = contextvars.ContextVar('timing_recorder', default=None)
+
+
+class Recorder:
+    """Time spent in each stage of one request"""
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self.started = clock()
+        self.durations = {}
+        # [stage, time it was entered or its last inner stage exited] of open stages
+        self._stack = []
+
+    def enter(self, stage):
+        now = self._clock()
+        if self._stack:
+            outer = self._stack[-1]
+            self.add(outer[0], now - outer[1])
+        self._stack.append([stage, now])
+
+    def exit(self):
+        now = self._clock()
+        stage, entered = self._stack.pop()
+        self.add(stage, now - entered)
+        if self._stack:
+            self._stack[-1][1] = now
+
+    def add(self, stage, seconds):
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def breakdown(self):
+        """Milliseconds of each stage and of the whole request so far"""
+        breakdown = {stage: round(seconds * 1000, 3) for stage, seconds in self.durations.items()}
+        breakdown['total'] = round((self._clock() - self.started) * 1000, 3)
+        return breakdown
+
+    def header(self):
+        """The breakdown as a Server-Timing header value"""
+        return ', '.join(
+            '%s;dur=%s' % (stage, milliseconds)
+            for stage, milliseconds in self.breakdown().items()
+        )
+
+
+def init_app(app):
+    """Record a breakdown of a sample of an application's requests"""
+    app.before_request(start)
+    app.after_request(set_header)
+    app.teardown_request(stop)
+
+
+def start():
+    if config.TIMING_SAMPLE_RATE > 0 and random.random() < config.TIMING_SAMPLE_RATE:
+        g.timing = Recorder()
+        _RECORDER.set(g.timing)
+
+
+def set_header(response):
+    recorder = _RECORDER.get()
+    if recorder is not None:
+        response.headers['Server-Timing'] = recorder.header()
+    return response
+
+
+def stop(_exception=None):
+    # Threads serve one request after another, so nothing is left for the next
+    _RECORDER.set(None)
+
+
+def current():
+    """The recorder of the current request, None when it isn't sampled"""
+    return _RECORDER.get()
+
+
+@contextlib.contextmanager
+def span(stage):
+    """Report the time the block takes to the current request's recorder"""
+    recorder = _RECORDER.get()
+    if recorder is None:
+        yield
+        return
+
+    recorder.enter(stage)
+    try:
+        yield
+    finally:
+        recorder.exit()
+
+
+def call(stage, func, *args):
+    """Call func, reporting its time, for hot paths where a with block costs too much"""
+    recorder = _RECORDER.get()
+    if recorder is None:
+        return func(*args)
+
+    recorder.enter(stage)
+    try:
+        return func(*args)
+    finally:
+        recorder.exit()
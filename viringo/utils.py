@@ -0,0 +1,57 @@
+"""Helpers shared by the caches, metrics and upstream services"""
+
+import os
+import tempfile
+import threading
+
+
+def write_atomic(path, data):
+    """Write bytes to a file aside and rename it, so readers never see part of it
+
+    The file is written in the directory it replaces a file in, as a dot file
+    so it is never taken for a finished one.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.')
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class PerProcess:
+    """A value created on first use in each process
+
+    Forked workers create their own, rather than sharing the threads or
+    sockets of one inherited from their parent.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        pid = os.getpid()
+        if self._value is None or self._pid != pid:
+            with self._lock:
+                if self._value is None or self._pid != pid:
+                    self._value = self._factory()
+                    self._pid = pid
+        return self._value
+
+    def reset(self, close=None):
+        """Forget the value, calling close with it, a new one is created on next use"""
+        with self._lock:
+            if self._value is not None and close is not None:
+                close(self._value)
+            self._value = None
+            self._pid = None
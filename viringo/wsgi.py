@@ -6,14 +6,13 @@ import logging
 import json_log_formatter
 from dotenv import load_dotenv
 
-from viringo import create_app
-
-# load env variables from .env file
+# load env variables from .env file, ahead of the config reading them
 load_dotenv()
 
-application = create_app()
-
 from flask.logging import default_handler
+from viringo import create_app
+
+application = create_app()
 
 logger = application.logger
 if not logger.handlers: